@@ -3,6 +3,11 @@ __author__ = 'tratincica'
 from PyQt4 import QtCore, QtGui, uic
 import sys
 from Pyheli_bare import Heli
+from binlog import BinaryLogger
+from stripchart import StripChart
+from scheduler import PeriodicScheduler
+import threading
+import Queue
 import time
 import datetime
 
@@ -19,20 +24,74 @@ import datetime
 #         self.trigger.emit()
 
 
+class HeliWorker(QtCore.QThread):
+
+    """
+    Dretva koja jedina koristi serijsku vezu s maketom.
+    Svakih period sekundi izvrsi naredbe primljene od sucelja,
+    procita senzor i posalje ocitanje signalom sample,
+    tako da sucelje nikad ne ceka na serijsku vezu.
+    """
+
+    sample = QtCore.pyqtSignal(object)
+
+    def __init__(self, port, period):
+        QtCore.QThread.__init__(self)
+        self.port = port
+        self.period = period
+        self.commands = Queue.Queue()
+        self.stopped = threading.Event()
+
+    def send(self, method, *args):
+        """
+        sprema poziv metode objekta Heli koji ce dretva izvrsiti u sljedecem ciklusu
+
+        """
+        self.commands.put((method, args))
+
+    def stop(self):
+        self.stopped.set()
+
+    def execute_commands(self, board):
+        while True:
+            try:
+                method, args = self.commands.get_nowait()
+            except Queue.Empty:
+                return
+            getattr(board, method)(*args)
+
+    def run(self):
+        board = Heli(port=self.port)
+
+        def step():
+            self.execute_commands(board)
+            sensor_data = board.read_sensor_data()
+            if sensor_data is not None:
+                self.sample.emit(sensor_data)
+
+        PeriodicScheduler(self.period, stop_event=self.stopped).run(step)
+
+        #prilikom gasenja se izvrse preostale naredbe, a motori se zaustave
+        self.execute_commands(board)
+        board.reset_all()
+        board.close()
+
+
 class GUI():
 
     def __init__(self):
 
         #inicijalizacija
-        self.board = Heli(port="/dev/ttyACM0")
+        #serijskom vezom upravlja dretva HeliWorker, a sucelje joj salje naredbe
+        self.sensor_data = None
 
         #dio vezan za spremanje podataka naziv dadoteke je mjesec-dan-sat-minuta
+        #binarni zapis, pisanje na disk radi pozadinska dretva (python binlog.py za CSV)
         datetimes = datetime.datetime.now()
         self.ftimer = time.clock()
-        self.f = open("Test " + str(datetimes.month) + '-' + str(datetimes.day) + '-' + str(datetimes.hour) + '-' +
-                      str(datetimes.minute) + '.txt', 'w')
-        self.f.write('{0:10}, {1:10}, {2:10}, {3:10}, {4:10}, {5:10}, {6:10}, {7:10}\r\n'.format('time', 'yaw', 'pitch',
-                     'u_yaw', 'u_pitch', 'p_yaw', 'p_pitch', 'factor'))
+        self.f = BinaryLogger("Test " + str(datetimes.month) + '-' + str(datetimes.day) + '-' +
+                              str(datetimes.hour) + '-' + str(datetimes.minute) + '.bin',
+                              ['time', 'yaw', 'pitch', 'u_yaw', 'u_pitch', 'p_yaw', 'p_pitch', 'factor'])
 
         #vrijeme ciklusa za metodu update
         self.t = 50
@@ -42,6 +101,10 @@ class GUI():
         app = QtGui.QApplication(sys.argv)
         self.window = uic.loadUi("main.ui")
         self.window.show()
+        self.init_plots()
+        self.worker = HeliWorker("/dev/ttyACM0", self.t / 1000.0)
+        self.worker.sample.connect(self.sample_callback)
+        self.worker.start()
         self.timer.start(self.t)
         self.y_integrator = 0
         self.p_integrator = 0
@@ -64,6 +127,40 @@ class GUI():
         self.closing()
         sys.exit(ret)
 
+    def init_plots(self):
+
+        """
+        prozor s grafovima kuteva, referenci i upravljackih velicina
+        grafovi prikazuju zadnjih 10 minuta, a osvjezavaju se 10 puta u sekundi
+
+        """
+        history = int(600 * 1000 / self.t)
+        self.angle_plot = StripChart("kutevi [deg]", history=history, period=self.t / 1000.0)
+        self.angle_plot.add_channel("pitch", QtCore.Qt.blue)
+        self.angle_plot.add_channel("yaw", QtCore.Qt.red)
+        self.angle_plot.add_channel("ref pitch", QtCore.Qt.darkCyan)
+        self.angle_plot.add_channel("ref yaw", QtCore.Qt.darkMagenta)
+        self.command_plot = StripChart("motori [%]", history=history, y_range=(-100, 100),
+                                       period=self.t / 1000.0)
+        self.command_plot.add_channel("pitch (12V)", QtCore.Qt.blue)
+        self.command_plot.add_channel("yaw (5V)", QtCore.Qt.red)
+
+        self.plots = QtGui.QWidget()
+        self.plots.setWindowTitle("Grafovi")
+        layout = QtGui.QVBoxLayout(self.plots)
+        layout.addWidget(self.angle_plot)
+        layout.addWidget(self.command_plot)
+        self.plots.resize(800, 500)
+        self.plots.show()
+
+    def sample_callback(self, sensor_data):
+
+        """
+        prima ocitanja senzora od dretve HeliWorker
+
+        """
+        self.sensor_data = sensor_data
+
     def update(self):
 
         """
@@ -72,7 +169,9 @@ class GUI():
         ukoliko je u automatskom modu rada, provodi se regulacija
         zapisuju se podatci u datoteku
         """
-        sensor_data = self.board.read_sensor_data()
+        sensor_data = self.sensor_data
+        if sensor_data is None:
+            return
 
         self.window.horizontalSliderYawSensor.setValue(int(float(sensor_data[2])))
         self.window.horizontalSliderPitchSensor.setValue(int(float(sensor_data[1])))
@@ -95,8 +194,9 @@ class GUI():
             self.window.spinBoxYaw.setReadOnly(1)
 
             #kada je u rucnom modu, resetira se velicina integratora kako ne bi doslo do windupa
-            u_yaw = 'rucno'
-            u_pitch = 'rucno'
+            #u rucnom modu se upravljacke velicine zapisuju kao NaN
+            u_yaw = float('nan')
+            u_pitch = float('nan')
             self.p_integrator = 0
             self.y_integrator = 0
 
@@ -125,9 +225,13 @@ class GUI():
             if abs(ref_yaw-yaw_angle) > 5:
                 self.window.verticalSliderYaw.setValue(int(u_yaw))
 
+        #grafovi se samo pune, iscrtavaju se na vlastiti timer
+        self.angle_plot.push(pitch_angle, yaw_angle, ref_pitch, ref_yaw)
+        self.command_plot.push(self.window.verticalSliderPitch.value(),
+                               self.window.verticalSliderYaw.value())
+
         #zapisivanje u datoteku
-        self.f.write('{:10.5}, {!s:10.2}, {!s:10.2}, {!s:10.2}, {!s:10.2}, {!s:10.2}, {!s:10.2}, {!s:10.2}\r\n'
-                     .format(time.clock(), yaw_angle, pitch_angle, u_yaw, u_pitch, p_yaw, p_pitch, ki_pitch))
+        self.f.log(time.clock(), yaw_angle, pitch_angle, u_yaw, u_pitch, p_yaw, p_pitch, ki_pitch)
 
     def set_12v_motor_state_callback(self):
 
@@ -140,7 +244,7 @@ class GUI():
         if self.window.checkBox12V.isChecked():
             self.window.verticalSliderPitch.setValue(0)
 
-        self.board.set_12v_motor_sleep_state(self.window.checkBox12V.isChecked())
+        self.worker.send('set_12v_motor_sleep_state', self.window.checkBox12V.isChecked())
 
     # def keyPressEvent(self, event):
     #
@@ -165,7 +269,7 @@ class GUI():
         if self.window.checkBox5V.isChecked():
             self.window.verticalSliderYaw.setValue(0)
 
-        self.board.set_5v_motor_sleep_state(self.window.checkBox5V.isChecked())
+        self.worker.send('set_5v_motor_sleep_state', self.window.checkBox5V.isChecked())
 
     def vertical_slider_pitch_callback(self):
 
@@ -182,7 +286,7 @@ class GUI():
         elif self.window.verticalSliderPitch.value() < 0:
             self.window.verticalSliderPitch.setValue(0)
 
-        self.board.set_motor_speed_12v(self.window.verticalSliderPitch.value())
+        self.worker.send('set_motor_speed_12v', self.window.verticalSliderPitch.value())
 
     def vertical_slider_yaw_callback(self):
 
@@ -199,7 +303,7 @@ class GUI():
         elif self.window.verticalSliderYaw.value < -100:
             self.window.verticalSliderYaw.setValue(-100)
 
-        self.board.set_motor_speed_5v(self.window.verticalSliderYaw.value()-20)
+        self.worker.send('set_motor_speed_5v', self.window.verticalSliderYaw.value()-20)
     #
     # funckije vezane za pokusaj refreshanja vrijednosti sa senzora na drugi nacin - neuspjeli, ali da ostane
     #
@@ -224,8 +328,9 @@ class GUI():
         prilikom gasenja programa se vrijednosti vrate na 0 kako prilikom pokretanja ne bi bilo iznenadenja
 
         """
-        self.board.reset_all()
-        self.board.close()
+        self.worker.stop()
+        self.worker.wait()
+        self.f.close()
         print 'Ending'
 
 
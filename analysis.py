@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+"""
+Step-response analysis of experiment logs.
+
+Reads the binary logs written by binlog.BinaryLogger through a memory map,
+as well as the CSV logs of the controllers (*_ctrl_log.csv: the older
+headerless logs and the exports of binlog.py with a header row) and the
+text logs of the GUI (Test M-D-H-M.txt), and computes vectorized metrics
+over the whole run:
+
+    rise time (10-90 %), overshoot and settling time (2 %) of every
+    reference step, IAE and ISE of theta and phi against their references,
+    control effort of u_1 and u_2 and the real sample period and jitter.
+
+Usage, to process every run in a directory in parallel:
+
+    python analysis.py logs/ --jobs 4 --out summary.csv
+"""
+
+import argparse
+import csv
+import glob
+import mmap
+import os
+import sys
+from multiprocessing import Pool, cpu_count
+
+import numpy as np
+
+import binlog
+
+# Column names of the GUI logs mapped to the names used by the controllers
+GUI_COLUMNS = {'time': 'time', 'pitch': 'theta', 'yaw': 'phi',
+               'u_pitch': 'u_1', 'u_yaw': 'u_2'}
+CSV_COLUMNS = ['time', 'theta', 'phi', 'theta_ref', 'phi_ref', 'u_1', 'u_2']
+LOG_PATTERNS = ['*_ctrl_log.bin', '*_ctrl_log.csv', 'Test *.bin', 'Test *.txt']
+
+
+def map_binlog(path):
+    """
+    Memory-maps a binary log
+    -------------
+    :return value: dict of field name -> array. Logs of a single chunk are
+                   returned as views into the map, longer logs are joined.
+    """
+    with open(path, 'rb') as f:
+        header, offset = binlog.read_header(f)
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    dtype = np.dtype(header["typecode"])
+    if header["byteorder"] == 'little':
+        dtype = dtype.newbyteorder('<')
+    else:
+        dtype = dtype.newbyteorder('>')
+    fields = [str(name) for name in header["fields"]]
+    parts = [[] for name in fields]
+    size = len(mm)
+    while offset + binlog.CHUNK_HEADER.size <= size:
+        rows = binlog.CHUNK_HEADER.unpack_from(mm, offset)[0]
+        offset += binlog.CHUNK_HEADER.size
+        if offset + rows * dtype.itemsize * len(fields) > size:
+            # The file of an interrupted run ends mid chunk
+            break
+        for part in parts:
+            part.append(np.frombuffer(mm, dtype, rows, offset))
+            offset += rows * dtype.itemsize
+    columns = {}
+    for name, part in zip(fields, parts):
+        if len(part) == 1:
+            columns[name] = part[0]
+        elif part:
+            columns[name] = np.concatenate(part)
+        else:
+            columns[name] = np.zeros(0, dtype)
+    return columns
+
+
+def _is_number(text):
+    try:
+        float(text)
+    except ValueError:
+        return False
+    return True
+
+
+def load_csv(path):
+    """
+    Loads a CSV log: an older controller log, headerless with the
+    CSV_COLUMNS separated by ';', or an export of binlog.py with a header
+    row of the field names.
+    """
+    with open(path, 'rb') as f:
+        first = f.readline()
+    delimiter = ';' if ';' in first or ',' not in first else ','
+    if _is_number(first.split(delimiter)[0]):
+        data = np.atleast_2d(np.loadtxt(path, delimiter=delimiter))
+        return dict(zip(CSV_COLUMNS, data.T))
+    data = np.genfromtxt(path, delimiter=delimiter, names=True)
+    return dict((name, np.atleast_1d(data[name]))
+                for name in data.dtype.names)
+
+
+def load_run(path):
+    """
+    Loads a log of any of the supported formats
+    -------------
+    :return value: dict of column name -> array, with the controller names
+                   (time, theta, phi, theta_ref, phi_ref, u_1, u_2)
+    """
+    with open(path, 'rb') as f:
+        is_binlog = f.read(len(binlog.MAGIC)) == binlog.MAGIC
+    if is_binlog:
+        columns = map_binlog(path)
+    elif path.endswith('.csv'):
+        columns = load_csv(path)
+    else:
+        # Text log of the GUI: a padded header line, then comma separated
+        # values where the manual mode outputs are not numbers
+        data = np.genfromtxt(path, delimiter=',', names=True,
+                             autostrip=True)
+        columns = dict((name, data[name]) for name in data.dtype.names)
+    return dict((GUI_COLUMNS.get(name, name), np.asarray(values, dtype=float))
+                for name, values in columns.items())
+
+
+def step_metrics(t, y, ref, band=0.02):
+    """
+    Rise time, overshoot and settling time of every step of the reference.
+    -------------
+    :param band: settling band as a fraction of the step size
+    :return value: list of dicts, one per step
+    """
+    steps = np.flatnonzero(np.diff(ref) != 0) + 1
+    ends = np.append(steps[1:], len(ref))
+    results = []
+    for k0, k1 in zip(steps, ends):
+        size = ref[k0] - ref[k0 - 1]
+        # Normalized response: 0 at the old reference, 1 at the new one
+        s = (y[k0:k1] - ref[k0 - 1]) / size
+        ts = t[k0:k1] - t[k0]
+        above10 = s >= 0.1
+        above90 = s >= 0.9
+        rise = np.nan
+        if above10.any() and above90.any():
+            rise = ts[above90.argmax()] - ts[above10.argmax()]
+        outside = np.flatnonzero(np.abs(s - 1.0) > band)
+        if len(outside) == 0:
+            settling = 0.0
+        elif outside[-1] + 1 < len(s):
+            settling = ts[outside[-1] + 1]
+        else:
+            settling = np.nan
+        results.append({"time": t[k0], "size": size, "rise_time": rise,
+                        "overshoot": max(0.0, np.nanmax(s) - 1.0) * 100.0,
+                        "settling_time": settling})
+    return results
+
+
+def analyse(columns):
+    """
+    Computes the metrics of one run
+    -------------
+    :param columns: dict of column name -> array, as returned by load_run
+    :return value: dict of metric name -> value
+    """
+    t = columns['time']
+    metrics = {"samples": len(t)}
+    if len(t) < 2:
+        return metrics
+    dt = np.diff(t)
+    metrics["period_mean"] = dt.mean()
+    metrics["period_jitter"] = dt.std()
+    metrics["period_max"] = dt.max()
+    dt = np.append(dt, dt[-1])
+
+    for axis in ('theta', 'phi'):
+        if axis + '_ref' not in columns:
+            continue
+        y = columns[axis]
+        ref = columns[axis + '_ref']
+        e = ref - y
+        metrics[axis + "_iae"] = np.nansum(np.abs(e) * dt)
+        metrics[axis + "_ise"] = np.nansum(e * e * dt)
+        steps = step_metrics(t, y, ref)
+        metrics[axis + "_steps"] = len(steps)
+        for name in ("rise_time", "overshoot", "settling_time"):
+            values = [step[name] for step in steps]
+            if values and not np.all(np.isnan(values)):
+                metrics[axis + "_" + name] = np.nanmean(values)
+            else:
+                metrics[axis + "_" + name] = np.nan
+
+    for u in ('u_1', 'u_2'):
+        if u not in columns:
+            continue
+        metrics[u + "_effort"] = np.nansum(np.abs(columns[u]) * dt)
+        # Outputs of the GUI manual mode are logged as NaN
+        valid = columns[u][~np.isnan(columns[u])]
+        if len(valid):
+            metrics[u + "_rms"] = np.sqrt(np.mean(valid ** 2))
+        else:
+            metrics[u + "_rms"] = np.nan
+    return metrics
+
+
+def analyse_file(path):
+    """
+    Loads and analyses one log, for use in a process pool.
+    """
+    try:
+        metrics = analyse(load_run(path))
+    except (IOError, ValueError) as e:
+        metrics = {"error": str(e)}
+    metrics["file"] = os.path.basename(path)
+    return metrics
+
+
+def find_runs(directory, patterns=LOG_PATTERNS):
+    """
+    Lists the runs in a directory. A text log with a binary log of the same
+    name is taken for its export and skipped.
+    """
+    runs = set()
+    for pattern in patterns:
+        runs.update(glob.glob(os.path.join(directory, pattern)))
+    return sorted(path for path in runs if path.endswith('.bin') or
+                  os.path.splitext(path)[0] + '.bin' not in runs)
+
+
+def analyse_directory(directory, jobs=None, patterns=LOG_PATTERNS):
+    """
+    Analyses every run in a directory with a pool of jobs processes.
+    -------------
+    :return value: list of metric dicts, one per run
+    """
+    runs = find_runs(directory, patterns)
+    if not runs:
+        return []
+    pool = Pool(jobs or cpu_count())
+    try:
+        return pool.map(analyse_file, runs)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def write_summary(results, f):
+    """
+    Writes the metrics of several runs as CSV, one row per run.
+    """
+    names = sorted(set(name for r in results for name in r) - set(["file"]))
+    writer = csv.writer(f, delimiter=';')
+    writer.writerow(["file"] + names)
+    for r in results:
+        writer.writerow([r["file"]] + [r.get(name, '') for name in names])
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Analyse experiment logs')
+    parser.add_argument('directory', help='Directory with the run logs')
+    parser.add_argument('--jobs', type=int, default=None,
+                        help='Worker processes, by default one per core')
+    parser.add_argument('--pattern', action='append',
+                        help='File name pattern of the logs, can be repeated')
+    parser.add_argument('--out', help='Write the summary to this CSV file')
+    args = parser.parse_args()
+
+    results = analyse_directory(args.directory, args.jobs,
+                                args.pattern or LOG_PATTERNS)
+    if args.out:
+        with open(args.out, 'wb') as f:
+            write_summary(results, f)
+    else:
+        write_summary(results, sys.stdout)
@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+"""
+Offline gain tuning of the PI controller.
+
+Every candidate set of gains (Kp1, Ti1, Kp2, Ti2) is run through
+controller_PI.Controller against the simulated helicopter of virtual_heli,
+so the control law, the motor scaling of Heli and the protocol are the same
+as on the rig. Each run is a step of the pitch and the yaw reference and is
+scored with the metrics of analysis.py:
+
+    score = IAE(theta) + IAE(phi)
+            + overshoot weight * (overshoot(theta) + overshoot(phi))
+            + effort weight * (effort(u_1) + effort(u_2))
+
+Candidates come from a grid (log-spaced, --grid N points per gain) or from
+a log-uniform random search (--random N) and are simulated on a process
+pool, one process per core by default. The best candidates are printed as a
+ranked table followed by a [Controller] section for platform.cfg:
+
+    python autotune_pi.py --random 500 --duration 20
+"""
+
+import argparse
+import ConfigParser
+import os
+import sys
+import threading
+from itertools import product
+from multiprocessing import Pool, cpu_count
+
+import numpy as np
+
+import controller_PI
+from analysis import analyse
+from pyheli import Heli
+from virtual_heli import VirtualArduino
+
+GAINS = ('Kp1', 'Ti1', 'Kp2', 'Ti2')
+DEFAULT_RANGES = {'Kp1': (0.01, 20.0), 'Ti1': (0.1, 100.0),
+                  'Kp2': (0.01, 20.0), 'Ti2': (0.1, 100.0)}
+# Sections of platform.cfg that replace the PI law of an axis, and its gains
+AXIS_SECTIONS = (('Pitch', ('Kp1', 'Ti1')), ('Yaw', ('Kp2', 'Ti2')))
+
+
+def step_reference(initial, final, steps, at=0.25):
+    """
+    Reference list for Controller.set_ref: initial for the first fraction
+    at of the run, final for the rest.
+    """
+    k = int(steps * at)
+    return [initial] * k + [final] * (steps - k)
+
+
+def simulate(gains, config_file='platform.cfg', duration=20.0,
+             theta_step=(0.0, 10.0), phi_step=(0.0, 30.0), noise=0.1, seed=0):
+    """
+    Runs one closed-loop step response on the virtual helicopter
+    -------------
+    :param gains: dict with Kp1, Ti1, Kp2, Ti2
+    :param duration: simulated time in s
+    :param theta_step: (initial, final) pitch reference in degrees
+    :param phi_step: (initial, final) yaw reference in degrees
+    :return value: dict of column name -> array, as analysis.load_run
+    """
+    heli = Heli(None, sr=VirtualArduino(noise=noise, seed=seed), binary=True)
+    heli.sensor_delay = 0.0
+    ctrl = controller_PI.Controller(threading.Event(), config_file,
+                                    log=False, heli=heli)
+    # The plant advances by the sample time of the configured controller
+    heli.sr.step = ctrl.Td
+    ctrl.set_gains(**gains)
+    heli.set_12v_motor_sleep_state(True)
+    heli.set_5v_motor_sleep_state(True)
+
+    steps = int(round(duration / ctrl.Td))
+    theta_ref = step_reference(theta_step[0], theta_step[1], steps)
+    phi_ref = step_reference(phi_step[0], phi_step[1], steps)
+    ctrl.set_ref(theta_ref, phi_ref)
+
+    columns = dict((name, np.zeros(steps)) for name in
+                   ('time', 'theta', 'phi', 'theta_ref', 'phi_ref',
+                    'u_1', 'u_2'))
+    for k in range(steps):
+        ctrl.update()
+        columns['time'][k] = k * ctrl.Td
+        columns['theta'][k] = ctrl.theta[0]
+        columns['phi'][k] = ctrl.phi[0]
+        columns['theta_ref'][k] = theta_ref[k]
+        columns['phi_ref'][k] = phi_ref[k]
+        columns['u_1'][k] = ctrl.u_1[0]
+        columns['u_2'][k] = ctrl.u_2[0]
+    return columns
+
+
+def score(metrics, overshoot_weight=0.1, effort_weight=0.001):
+    """
+    Scalar cost of a run, lower is better.
+    """
+    cost = metrics['theta_iae'] + metrics['phi_iae']
+    for axis in ('theta', 'phi'):
+        overshoot = metrics[axis + '_overshoot']
+        if np.isnan(overshoot):
+            # The response never reached the reference
+            overshoot = 100.0
+        cost += overshoot_weight * overshoot
+    cost += effort_weight * (metrics['u_1_effort'] + metrics['u_2_effort'])
+    return cost
+
+
+def evaluate(job):
+    """
+    Simulates and scores one candidate, for use in a process pool
+    -------------
+    :param job: (gains, simulate keyword arguments, score keyword arguments)
+    :return value: (score, gains, metrics)
+    """
+    gains, sim_args, score_args = job
+    metrics = analyse(simulate(gains, **sim_args))
+    return score(metrics, **score_args), gains, metrics
+
+
+def grid_candidates(ranges, points):
+    """
+    Every combination of points log-spaced values of each gain.
+    """
+    axes = [np.logspace(np.log10(ranges[name][0]), np.log10(ranges[name][1]),
+                        points) for name in GAINS]
+    return [dict(zip(GAINS, (float(x) for x in values)))
+            for values in product(*axes)]
+
+
+def random_candidates(ranges, n, seed=0):
+    """
+    n candidates drawn log-uniformly from the ranges.
+    """
+    rng = np.random.RandomState(seed)
+    columns = [np.exp(rng.uniform(np.log(ranges[name][0]),
+                                  np.log(ranges[name][1]), n))
+               for name in GAINS]
+    return [dict(zip(GAINS, (float(x) for x in values)))
+            for values in zip(*columns)]
+
+
+def _quiet():
+    # The controller prints its outputs on every step
+    sys.stdout = open(os.devnull, 'w')
+
+
+def tune(candidates, sim_args=None, score_args=None, jobs=None):
+    """
+    Evaluates the candidates on a process pool
+    -------------
+    :param jobs: number of processes, by default one per core
+    :return value: list of (score, gains, metrics), best first
+    """
+    work = [(gains, sim_args or {}, score_args or {}) for gains in candidates]
+    pool = Pool(jobs or cpu_count(), initializer=_quiet)
+    try:
+        results = pool.map(evaluate, work, chunksize=max(1, len(work) // 64))
+    finally:
+        pool.close()
+        pool.join()
+    results.sort(key=lambda result: result[0])
+    return results
+
+
+def overriding_sections(config):
+    """
+    Axis sections of the config whose controller is used instead of the PI
+    law, as (section, gains) of AXIS_SECTIONS.
+    """
+    return [(section, names) for section, names in AXIS_SECTIONS
+            if config.has_section(section)]
+
+
+def override_warning(section, names):
+    return ('Warning: [%s] in the config overrides %s, remove it to use '
+            'the tuned gains' % (section, ' and '.join(names)))
+
+
+def config_section(gains, Td, overridden=()):
+    """
+    [Controller] section with the gains, to paste into platform.cfg
+    -------------
+    :param overridden: (section, gains) of overriding_sections, noted as
+                       comments
+    """
+    lines = ['[Controller]', 'Td = %g' % Td]
+    lines.extend('%s = %.6g' % (name, gains[name]) for name in GAINS)
+    lines.extend('# ' + override_warning(section, names)
+                 for section, names in overridden)
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='PI gain tuning on the '
+                                     'simulated helicopter')
+    parser.add_argument('--config_file', help='Platform configuration file name',
+                        default='platform.cfg')
+    search = parser.add_mutually_exclusive_group()
+    search.add_argument('--grid', type=int, metavar='N',
+                        help='Grid search with N values per gain')
+    search.add_argument('--random', type=int, metavar='N', default=200,
+                        help='Random search with N candidates (default)')
+    for name in GAINS:
+        parser.add_argument('--' + name, type=float, nargs=2,
+                            metavar=('MIN', 'MAX'), default=DEFAULT_RANGES[name],
+                            help='Search range of ' + name)
+    parser.add_argument('--duration', type=float, default=20.0,
+                        help='Simulated time of a run in s')
+    parser.add_argument('--theta_step', type=float, nargs=2, default=(0.0, 10.0),
+                        metavar=('FROM', 'TO'), help='Pitch reference step')
+    parser.add_argument('--phi_step', type=float, nargs=2, default=(0.0, 30.0),
+                        metavar=('FROM', 'TO'), help='Yaw reference step')
+    parser.add_argument('--noise', type=float, default=0.1,
+                        help='Angle noise of the simulated IMU in degrees')
+    parser.add_argument('--overshoot_weight', type=float, default=0.1)
+    parser.add_argument('--effort_weight', type=float, default=0.001)
+    parser.add_argument('--jobs', type=int, default=None,
+                        help='Worker processes, by default one per core')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--top', type=int, default=10,
+                        help='Number of candidates in the table')
+    args = parser.parse_args()
+
+    config = ConfigParser.RawConfigParser()
+    config.read(args.config_file)
+    overridden = overriding_sections(config)
+    for section, names in overridden:
+        sys.stderr.write(override_warning(section, names) + '\n')
+
+    ranges = dict((name, getattr(args, name)) for name in GAINS)
+    if args.grid:
+        candidates = grid_candidates(ranges, args.grid)
+    else:
+        candidates = random_candidates(ranges, args.random, args.seed)
+    sim_args = {'config_file': args.config_file, 'duration': args.duration,
+                'theta_step': args.theta_step, 'phi_step': args.phi_step,
+                'noise': args.noise, 'seed': args.seed}
+    score_args = {'overshoot_weight': args.overshoot_weight,
+                  'effort_weight': args.effort_weight}
+
+    results = tune(candidates, sim_args, score_args, args.jobs)
+
+    print('{0:>4} {1:>9} {2:>9} {3:>9} {4:>9} {5:>9} {6:>8} {7:>8} '
+          '{8:>7} {9:>7}'.format('rank', 'score', 'Kp1', 'Ti1', 'Kp2', 'Ti2',
+                                 'iae_th', 'iae_phi', 'os_th', 'os_phi'))
+    for rank, (cost, gains, m) in enumerate(results[:args.top], 1):
+        print('{0:4d} {1:9.3f} {2:9.4g} {3:9.4g} {4:9.4g} {5:9.4g} {6:8.2f} '
+              '{7:8.2f} {8:7.1f} {9:7.1f}'.format(
+                  rank, cost, gains['Kp1'], gains['Ti1'], gains['Kp2'],
+                  gains['Ti2'], m['theta_iae'], m['phi_iae'],
+                  m['theta_overshoot'], m['phi_overshoot']))
+    print('')
+    print(config_section(results[0][1], config.getfloat('Controller', 'Td'),
+                         overridden))
@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+"""
+Benchmarks of the protocol, parsing and control step hot paths.
+
+Everything runs offline against MockSerial, which discards writes and
+answers reads with canned replies, so only the Python side of the
+transport and the controllers is measured.
+
+    python benchmark.py                          # print the results
+    python benchmark.py --save baseline.json     # record a baseline
+    python benchmark.py --compare baseline.json  # flag regressions
+"""
+
+import argparse
+import json
+import os
+import struct
+import sys
+import timeit
+from threading import Event
+
+import numpy
+
+import pyno
+from pyheli import Heli
+import controller_PI
+import controller_fuzzy_template
+from fuzzy import FuzzyEngine, SparseFuzzyEngine, FuzzySurface
+from profiler import StageProfiler
+
+
+class MockSerial(object):
+    """
+    Stand-in for serial.Serial that discards writes and returns the same
+    IMU reply to every read.
+    """
+
+    def __init__(self, line="!ANG:0.12,10.53,-45.27\r\n"):
+        self.line = line
+        frame = pyno.BIN_IMU_REPLY.pack(pyno.BIN_SYNC, pyno.BIN_OPCODES["sd"],
+                                        0.12, 10.53, -45.27)
+        self.frame = frame + struct.pack("<B", pyno.crc8(frame))
+        self.timeout = 2
+        self.bytes_written = 0
+
+    def write(self, data):
+        self.bytes_written += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def readline(self):
+        return self.line
+
+    def read(self, size=1):
+        return self.frame[:size]
+
+    def readinto(self, b):
+        n = min(len(b), len(self.frame))
+        b[:n] = self.frame[:n]
+        return n
+
+    def isOpen(self):
+        return True
+
+    def close(self):
+        pass
+
+
+def make_heli(binary=False):
+    heli = Heli(None, sr=MockSerial())
+    heli.binary = binary
+    heli.sensor_delay = 0.0
+    return heli
+
+
+def triangles(centers):
+    """
+    Triangles that end at the centres of their neighbours.
+    """
+    step = centers[1] - centers[0]
+    points = [centers[0] - step] + centers + [centers[-1] + step]
+    return [points[k:k + 3] for k in range(len(centers))]
+
+
+def fuzzy_rules(n=5):
+    """
+    Returns a typical n x n rule base (e_trimf, de_trimf, A): evenly spaced
+    overlapping triangles for e and de and a PD-like singleton table.
+    """
+    e_centers = [-20.0 + k * 40.0 / (n - 1) for k in range(n)]
+    de_centers = [-4.0 + k * 8.0 / (n - 1) for k in range(n)]
+    return (triangles(e_centers), triangles(de_centers),
+            [[max(-100.0, min(100.0, 2.0 * ce + 5.0 * cde))
+              for ce in e_centers] for cde in de_centers])
+
+
+class Quiet(object):
+    """
+    Swallows the per-step prints of the controllers while timing them.
+    """
+
+    def __enter__(self):
+        self.stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+
+    def __exit__(self, *exc):
+        sys.stdout.close()
+        sys.stdout = self.stdout
+
+
+def bench_build_cmd_str():
+    return lambda: pyno.build_cmd_str("aw", (9, 127))
+
+
+def bench_build_cmd_bin():
+    return lambda: pyno.build_cmd_bin("aw", (9, 127))
+
+
+def bench_read_sensor_ascii():
+    heli = make_heli()
+    return heli.read_sensor
+
+
+def bench_read_sensor_binary():
+    heli = make_heli(binary=True)
+    return heli.read_sensor
+
+
+def bench_set_motor_speed_12v():
+    heli = make_heli()
+    heli.set_12v_motor_sleep_state(True)
+    state = [0]
+
+    def step():
+        # Alternate the speed so the shadow registers do not skip the write
+        state[0] ^= 1
+        heli.set_motor_speed_12v(40 + state[0])
+    return step
+
+
+def bench_set_motor_speed_5v():
+    heli = make_heli()
+    heli.set_5v_motor_sleep_state(True)
+    state = [0]
+
+    def step():
+        state[0] ^= 1
+        heli.set_motor_speed_5v(40 + state[0])
+    return step
+
+
+def bench_pi_update(config_file):
+    heli = make_heli()
+    ctrl = controller_PI.Controller(Event(), config_file, log=False,
+                                    heli=heli)
+    heli.set_12v_motor_sleep_state(True)
+    heli.set_5v_motor_sleep_state(True)
+    return ctrl.update
+
+
+def bench_pi_update_profiled(config_file):
+    heli = make_heli()
+    ctrl = controller_PI.Controller(Event(), config_file, log=False,
+                                    heli=heli)
+    ctrl.profiler = StageProfiler()
+    heli.set_12v_motor_sleep_state(True)
+    heli.set_5v_motor_sleep_state(True)
+    return ctrl.update
+
+
+def bench_fuzzy_batch_1000():
+    engine = FuzzyEngine(*fuzzy_rules())
+    e = numpy.linspace(-25.0, 25.0, 1000)
+    de = numpy.linspace(-5.0, 5.0, 1000)
+    return lambda: engine.evaluate_batch(e, de)
+
+
+def bench_fuzzy_dense(n):
+    engine = FuzzyEngine(*fuzzy_rules(n))
+    return lambda: engine.evaluate(3.3, -1.2)
+
+
+def bench_fuzzy_sparse(n):
+    engine = SparseFuzzyEngine(*fuzzy_rules(n))
+    return lambda: engine.evaluate(3.3, -1.2)
+
+
+def bench_fuzzy_lookup():
+    surface = FuzzySurface.compile(FuzzyEngine(*fuzzy_rules()))
+    return lambda: surface.lookup(3.3, -1.2)
+
+
+def bench_fuzzy_update(config_file):
+    heli = make_heli()
+    ctrl = controller_fuzzy_template.Controller(Event(), config_file,
+                                                log=False, heli=heli)
+    ctrl.set_rules(*fuzzy_rules())
+    return ctrl.update
+
+
+def run_benchmarks(config_file, number, repeat):
+    """
+    Runs every benchmark and returns a dict of name -> seconds per call,
+    the best of repeat rounds of number calls.
+    """
+    benchmarks = [
+        ("build_cmd_str", bench_build_cmd_str),
+        ("build_cmd_bin", bench_build_cmd_bin),
+        ("read_sensor_ascii", bench_read_sensor_ascii),
+        ("read_sensor_binary", bench_read_sensor_binary),
+        ("set_motor_speed_12v", bench_set_motor_speed_12v),
+        ("set_motor_speed_5v", bench_set_motor_speed_5v),
+        ("pi_update", lambda: bench_pi_update(config_file)),
+        ("pi_update_profiled", lambda: bench_pi_update_profiled(config_file)),
+        ("fuzzy_update", lambda: bench_fuzzy_update(config_file)),
+        ("fuzzy_batch_1000", bench_fuzzy_batch_1000),
+        ("fuzzy_dense_5", lambda: bench_fuzzy_dense(5)),
+        ("fuzzy_dense_21", lambda: bench_fuzzy_dense(21)),
+        ("fuzzy_sparse_5", lambda: bench_fuzzy_sparse(5)),
+        ("fuzzy_sparse_21", lambda: bench_fuzzy_sparse(21)),
+        ("fuzzy_lookup", bench_fuzzy_lookup),
+    ]
+    results = {}
+    for name, setup in benchmarks:
+        with Quiet():
+            fn = setup()
+            times = timeit.repeat(fn, repeat=repeat, number=number)
+        results[name] = min(times) / number
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Compares results against a baseline.
+    -------------
+    :return value: list of (name, baseline, current, relative change) for
+                   the benchmarks that got slower by more than threshold
+    """
+    regressions = []
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        change = results[name] / baseline[name] - 1.0
+        if change > threshold:
+            regressions.append((name, baseline[name], results[name], change))
+    return regressions
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Hot path benchmarks')
+    parser.add_argument('--config_file', help='Platform configuration file name',
+                        default='platform.cfg')
+    parser.add_argument('--number', type=int, default=2000,
+                        help='Calls per round')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Rounds, the best one is reported')
+    parser.add_argument('--save', help='Write the results to a JSON baseline')
+    parser.add_argument('--compare', help='JSON baseline to compare against')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='Relative slowdown reported as a regression')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.config_file, args.number, args.repeat)
+    for name in sorted(results):
+        print('{0:22} {1:10.2f} us/call'.format(name, results[name] * 1e6))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for name, old, new, change in regressions:
+            print('REGRESSION {0}: {1:.2f} -> {2:.2f} us/call (+{3:.0%})'
+                  .format(name, old * 1e6, new * 1e6, change))
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+"""
+Buffered binary experiment logger.
+
+Samples with a fixed schema are appended to preallocated column buffers.
+Full buffers are handed to a background thread that writes them to disk in
+one chunk, so logging a sample never waits for the file system.
+
+File format (all integers little endian uint32):
+
+    b"OIULOG1\\n"
+    header length, JSON header {"fields": [...], "typecode": "d",
+                                "byteorder": "little" | "big"}
+    padding of the header to a multiple of 8 bytes
+    chunks of: number of rows, 0, then each column as rows values
+
+Usage as a tool, to convert a log to CSV:
+
+    python binlog.py run_ctrl_log.bin [run_ctrl_log.csv]
+"""
+
+import argparse
+import csv
+import json
+import struct
+import sys
+import threading
+import Queue
+from array import array
+
+MAGIC = b"OIULOG1\n"
+UINT32 = struct.Struct("<I")
+CHUNK_HEADER = struct.Struct("<II")
+
+
+class BinaryLogger(object):
+
+    def __init__(self, path, fields, chunk=1024, typecode='d'):
+        """
+        Opens the log file and starts the writer thread
+        -------------
+        :param path: file name of the log
+        :param fields: names of the logged values, in the order of log()
+        :param chunk: rows per buffer written at once
+        :param typecode: array typecode of the values, 'd' for doubles
+        """
+        self.fields = list(fields)
+        self.chunk = chunk
+        self.typecode = typecode
+        self._file = open(path, 'wb')
+        header = json.dumps({"fields": self.fields, "typecode": typecode,
+                             "byteorder": sys.byteorder})
+        header += " " * (-(len(MAGIC) + UINT32.size + len(header)) % 8)
+        self._file.write(MAGIC + UINT32.pack(len(header)) + header)
+
+        self._full = Queue.Queue()
+        self._free = Queue.Queue()
+        self._columns = self._new_columns()
+        self._rows = 0
+        self.samples = 0
+
+        self._writer = threading.Thread(target=self._write_loop)
+        self._writer.daemon = True
+        self._writer.start()
+
+    def _new_columns(self):
+        try:
+            return self._free.get_nowait()
+        except Queue.Empty:
+            return [array(self.typecode, [0]) * self.chunk
+                    for f in self.fields]
+
+    def log(self, *values):
+        """
+        Appends one sample, the values in the order of fields.
+        """
+        rows = self._rows
+        for column, value in zip(self._columns, values):
+            column[rows] = value
+        self._rows = rows + 1
+        self.samples += 1
+        if self._rows == self.chunk:
+            self.flush()
+
+    def flush(self):
+        """
+        Hands the buffered samples to the writer thread.
+        """
+        if self._rows:
+            self._full.put((self._columns, self._rows))
+            self._columns = self._new_columns()
+            self._rows = 0
+
+    def _write_loop(self):
+        while True:
+            item = self._full.get()
+            if item is None:
+                break
+            columns, rows = item
+            self._file.write(CHUNK_HEADER.pack(rows, 0))
+            for column in columns:
+                column[:rows].tofile(self._file)
+            self._free.put(columns)
+
+    def close(self):
+        """
+        Writes the remaining samples and closes the file.
+        """
+        self.flush()
+        self._full.put(None)
+        self._writer.join()
+        self._file.close()
+
+
+def read_header(f):
+    """
+    Reads the header of an open log file
+    -------------
+    :return value: (header dict, offset of the first chunk)
+    """
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError("not a binary log file")
+    length = UINT32.unpack(f.read(UINT32.size))[0]
+    header = json.loads(f.read(length))
+    return header, len(MAGIC) + UINT32.size + length
+
+
+def read_log(path):
+    """
+    Reads a whole log file
+    -------------
+    :return value: (fields, list of one array per field)
+    """
+    with open(path, 'rb') as f:
+        header, offset = read_header(f)
+        fields = [str(name) for name in header["fields"]]
+        columns = [array(header["typecode"]) for name in fields]
+        swap = header["byteorder"] != sys.byteorder
+        while True:
+            raw = f.read(CHUNK_HEADER.size)
+            if len(raw) < CHUNK_HEADER.size:
+                break
+            rows = CHUNK_HEADER.unpack(raw)[0]
+            for column in columns:
+                part = array(header["typecode"])
+                try:
+                    part.fromfile(f, rows)
+                except EOFError:
+                    # The file of an interrupted run ends mid chunk
+                    break
+                if swap:
+                    part.byteswap()
+                column.extend(part)
+    n = min(len(column) for column in columns)
+    return fields, [column[:n] for column in columns]
+
+
+def export_csv(path, csv_path, delimiter=';'):
+    """
+    Converts a binary log to a CSV file with a header row.
+    """
+    fields, columns = read_log(path)
+    with open(csv_path, 'wb') as f:
+        writer = csv.writer(f, delimiter=delimiter)
+        writer.writerow(fields)
+        for row in zip(*columns):
+            writer.writerow(row)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Convert a binary log to CSV')
+    parser.add_argument('log', help='Binary log file')
+    parser.add_argument('csv', nargs='?', help='CSV file, by default the log '
+                        'file name with a .csv extension')
+    parser.add_argument('--delimiter', default=';', help='CSV delimiter')
+    args = parser.parse_args()
+
+    csv_path = args.csv
+    if csv_path is None:
+        csv_path = args.log.rsplit('.', 1)[0] + '.csv'
+    export_csv(args.log, csv_path, args.delimiter)
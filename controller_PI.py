@@ -3,6 +3,11 @@ Template for a fuzzy controller.
 """
 
 from pyheli import Heli
+from heli_broker import BrokerHeli
+from scheduler import PeriodicScheduler, SKIP
+from ringbuffer import RingBuffer
+from profiler import StageProfiler, STAGES, SENSOR, LAW, ACTUATE, LOG
+from dtcontrol import compile_spec, spec_from_config
 
 import argparse
 import ConfigParser
@@ -11,14 +16,25 @@ from threading import Thread, Event
 # For logging
 import time
 from datetime import datetime
-import csv
+from binlog import BinaryLogger
+
+# Output ranges of the motors, in percent
+U1_LIMITS = (0.0, 100.0)
+U2_LIMITS = (-100.0, 100.0)
+
+def pi_spec(Kp, Ti):
+    """
+    Spec of the incremental (velocity form) PI law
+        u(k) = u(k-1) + Kp*((e(k) - e(k-1)) + Td*e(k)/Ti)
+    """
+    return {'type': 'pi', 'Kp': Kp, 'Ti': Ti, 'method': 'backward'}
 
 class Controller(Thread):
     """
     Controls the pitch and yaw of the helicopter model.
     """
     
-    def __init__(self, event, config_file, log = True, show = False):
+    def __init__(self, event, config_file, log = True, show = False, heli = None):
         
         Thread.__init__(self)
         self.stopped = event
@@ -27,23 +43,39 @@ class Controller(Thread):
         config = ConfigParser.RawConfigParser()
         config.read(config_file)
         self.Td = config.getfloat('Controller','Td')
-        self.__heli = Heli(config.getstring('Motors','port'))
+        # Overrun policy of the fixed-rate loop: skip, catch_up or stretch
+        policy = SKIP
+        if config.has_option('Controller','overrun'):
+            policy = config.get('Controller','overrun')
+        self.scheduler = PeriodicScheduler(self.Td, policy, self.stopped)
+        # A Heli can be passed in, e.g. one on a virtual_heli.VirtualArduino
+        if heli is None:
+            if config.has_option('Motors','broker'):
+                # Shared link of a running heli_broker.py
+                heli = BrokerHeli(config.get('Motors','broker'))
+            else:
+                # Optional link rate negotiation, see Arduino.negotiate_baud
+                negotiate = config.has_option('Motors','negotiate') and \
+                    config.getboolean('Motors','negotiate')
+                heli = Heli(config.get('Motors','port'), negotiate=negotiate)
+        self.__heli = heli
 
         # Initialize motors
         self.__heli.set_12v_motor_sleep_state(False)
         self.__heli.set_5v_motor_sleep_state(False)
 
         # State variables
+        # Signal histories: x[0] is the current sample, x[1] the previous one
         (psi,theta,phi) = self.__heli.read_sensor_data()
-        self.theta = [theta, theta]
+        self.theta = RingBuffer(2, theta)
         self.theta_ref = [0]
-        self.phi = [phi, phi]
+        self.phi = RingBuffer(2, phi)
         self.phi_ref = [0]
         self.ref_idx = 0
-        self.e_theta = [0,0]
-        self.e_phi = [0,0]
-        self.u_1 = [0,0]
-        self.u_2 = [0,0]
+        self.e_theta = RingBuffer(2)
+        self.e_phi = RingBuffer(2)
+        self.u_1 = RingBuffer(2)
+        self.u_2 = RingBuffer(2)
 
         # Yaw controller parameters
         self.Kp2 = 1.0
@@ -52,56 +84,109 @@ class Controller(Thread):
         # Pitch controller parameters
         self.Kp1 = 1.0
         self.Ti1 = 10000000.0
+
+        # Gains from the config file, e.g. the section printed by autotune_pi.py
+        for gain in ('Kp1','Ti1','Kp2','Ti2'):
+            if config.has_option('Controller',gain):
+                setattr(self, gain, config.getfloat('Controller',gain))
+
+        # Any controller of dtcontrol.py for an axis with its own section,
+        # otherwise the PI law with the gains above
+        self.pitch_spec = None
+        self.yaw_spec = None
+        if config.has_section('Pitch'):
+            self.pitch_spec = spec_from_config(config, 'Pitch')
+        if config.has_section('Yaw'):
+            self.yaw_spec = spec_from_config(config, 'Yaw')
+        self.set_gains()
+        
+        # Optional stage timing of update(), see profiler.py
+        self.profiler = None
+        if config.has_option('Controller','profile') and \
+                config.getboolean('Controller','profile'):
+            window = 1000
+            if config.has_option('Controller','profile_window'):
+                window = config.getint('Controller','profile_window')
+            self.profiler = StageProfiler(window=window)
         
         self.__log_on = log
         if self.__log_on:
             self.log = True
             now_str = datetime.now().__str__().split('.')[0]
             now_str = now_str.replace(' ','-').replace(':','-')
-            self.logfile = open(now_str + '_ctrl_log.csv','wb')
-            self.logger = csv.writer(self.logfile,delimiter=';')
+            # Binary columnar log, written by a background thread.
+            # Convert with: python binlog.py <file>_ctrl_log.bin
+            fields = ['time','theta','phi','theta_ref','phi_ref',
+                      'u_1','u_2','Kp1','Ti1','Kp2','Ti2']
+            if self.profiler is not None:
+                # Stage times of each step, t_log of the previous step
+                fields += ['t_' + stage for stage in STAGES]
+            self.logger = BinaryLogger(now_str + '_ctrl_log.bin', fields)
     
     def update(self):
         """
         This is one controller step.
         """
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.start()
         
         # Update measurements
         (psi,theta,phi) = self.__heli.read_sensor_data()
+        if profiler is not None:
+            profiler.mark(SENSOR)
         
-        self.theta.insert(0,theta), self.theta.pop()
-        self.phi.insert(0,phi), self.phi.pop()
-        self.e_theta.insert(0,self.theta_ref[self.ref_idx]-theta), self.e_theta.pop()
-        self.e_phi.insert(0,self.phi_ref[self.ref_idx]-phi), self.e_phi.pop()
+        self.theta.push(theta)
+        self.phi.push(phi)
+        self.e_theta.push(self.theta_ref[self.ref_idx]-theta)
+        self.e_phi.push(self.phi_ref[self.ref_idx]-phi)
         # Advance the reference index
         self.ref_idx = (self.ref_idx + 1) % min(len(self.theta_ref), len(self.phi_ref))
 
         ### Yaw Control law ###
         
-        # The yaw control law is a simple PI controller.
-        self.u_2.insert(0,0), self.u_2.pop()
-        self.u_2[0] += self.Kp2*((self.e_phi[0] - self.e_phi[1])
-                                 + self.Td*self.e_phi[0]/self.Ti2)
+        # By default a simple PI controller.
+        self.u_2.push(self.yaw_law.step(self.e_phi[0]))
 
         ### Pitch Control law ###
-        # P Controller
-        self.u_1.insert(0,0), self.u_1.pop()
-        self.u_1 += self.Kp1*((self.e_theta[0] - self.e_theta[1])
-                              + self.Td*self.e_theta[0]/self.Ti1)
-        self.__heli.set_motor_speed_12v(self.u_1[0])
-        self.__heli.set_motor_speed_5v(self.u_2[0])
+        # By default a PI Controller, a P controller with the default Ti1
+        self.u_1.push(self.pitch_law.step(self.e_theta[0]))
+        if profiler is not None:
+            profiler.mark(LAW)
+        # Both motors are actuated in one batched serial write
+        with self.__heli.batch():
+            self.__heli.set_motor_speed_12v(self.u_1[0])
+            self.__heli.set_motor_speed_5v(self.u_2[0])
+        if profiler is not None:
+            profiler.mark(ACTUATE)
         print(self.u_1[0], self.u_2[0])
         
         # Log data
         if self.__log_on:
-            self.logger.writerow([time.time(),self.theta[0],self.phi[0],
-                                  self.theta_ref[self.ref_idx], self.phi_ref[self.ref_idx],
-                                  self.u_1[0], self.u_2[0]])
+            self.logger.log(time.time(),self.theta[0],self.phi[0],
+                            self.theta_ref[self.ref_idx], self.phi_ref[self.ref_idx],
+                            self.u_1[0], self.u_2[0], self.Kp1, self.Ti1, self.Kp2, self.Ti2,
+                            *(profiler.last if profiler is not None else ()))
+        if profiler is not None:
+            profiler.mark(LOG)
+    
+    def set_gains(self, **gains):
+        """
+        Set the PI gains (Kp1, Ti1, Kp2, Ti2) and discretize the control
+        laws again, which also resets their state. Axes configured with
+        their own section keep their controller.
+        """
+        for name, value in gains.items():
+            setattr(self, name, value)
+        self.pitch_law = compile_spec(self.pitch_spec or pi_spec(self.Kp1, self.Ti1),
+                                      self.Td, U1_LIMITS)
+        self.yaw_law = compile_spec(self.yaw_spec or pi_spec(self.Kp2, self.Ti2),
+                                    self.Td, U2_LIMITS)
     
-    def set_ref(self, x_ref, y_ref):
+    def set_ref(self, theta_ref, phi_ref):
         """
-        Set the reference position of the ball.
-        x_ref and y_ref should be lists of the same size
+        Set the reference pitch and yaw.
+        theta_ref and phi_ref should be lists of the same size
         """
         self.theta_ref = theta_ref
         self.phi_ref = phi_ref
@@ -109,10 +194,10 @@ class Controller(Thread):
     
     def run(self):
         """
-        Run update every Td
+        Run update every Td, on absolute deadlines so the period does not
+        drift. Loop statistics are available from self.scheduler.stats().
         """
-        while not self.stopped.wait(self.Td):
-            self.update()
+        self.scheduler.run(self.update)
         
         self.__cleanup()
         
@@ -120,7 +205,9 @@ class Controller(Thread):
         self.__heli.reset_all()
         self.__heli.close()
         if self.__log_on:
-            self.logfile.close()
+            self.logger.close()
+        if self.profiler is not None:
+            print(self.profiler.report())
         
 if __name__ == '__main__':
 
@@ -3,6 +3,12 @@ Template for a fuzzy controller.
 """
 
 from pyheli import Heli
+from heli_broker import BrokerHeli
+from scheduler import PeriodicScheduler, SKIP
+from ringbuffer import RingBuffer
+from profiler import StageProfiler, STAGES, SENSOR, LAW, ACTUATE, LOG
+from fuzzy import FuzzyEngine, SparseFuzzyEngine, compile_surface, load_rules, \
+    accuracy_report
 
 import argparse
 import ConfigParser
@@ -11,14 +17,14 @@ from threading import Thread, Event
 # For logging
 import time
 from datetime import datetime
-import csv
+from binlog import BinaryLogger
 
 class Controller(Thread):
     """
     Controls the pitch and yaw of the helicopter model.
     """
     
-    def __init__(self, event, config_file, log = True, show = False):
+    def __init__(self, event, config_file, log = True, show = False, heli = None):
         
         Thread.__init__(self)
         self.stopped = event
@@ -27,23 +33,56 @@ class Controller(Thread):
         config = ConfigParser.RawConfigParser()
         config.read(config_file)
         self.Td = config.getfloat('Controller','Td')
-        self.__heli = Heli(config.getstring('Motors','port'))
+        # Optional precompiled lookup table of the fuzzy control surface,
+        # with fuzzy_grid regularly spaced points per input besides the
+        # breakpoints of the sets (0 for only these, which is exact)
+        self.fuzzy_grid = None
+        if config.has_option('Controller','fuzzy_grid'):
+            self.fuzzy_grid = config.getint('Controller','fuzzy_grid')
+        # Grid ranges, by default the span of the sets, and the largest
+        # error of the surface against the exact rules, in percent
+        self.fuzzy_e_range = None
+        self.fuzzy_de_range = None
+        for name in ('e_range','de_range'):
+            if config.has_option('Controller','fuzzy_' + name):
+                setattr(self, 'fuzzy_' + name, tuple(
+                    float(x) for x in config.get('Controller','fuzzy_' + name).split()))
+        self.fuzzy_tolerance = 1.0
+        if config.has_option('Controller','fuzzy_tolerance'):
+            self.fuzzy_tolerance = config.getfloat('Controller','fuzzy_tolerance')
+        # Overrun policy of the fixed-rate loop: skip, catch_up or stretch
+        policy = SKIP
+        if config.has_option('Controller','overrun'):
+            policy = config.get('Controller','overrun')
+        self.scheduler = PeriodicScheduler(self.Td, policy, self.stopped)
+        # A Heli can be passed in, e.g. one on a virtual_heli.VirtualArduino
+        if heli is None:
+            if config.has_option('Motors','broker'):
+                # Shared link of a running heli_broker.py
+                heli = BrokerHeli(config.get('Motors','broker'))
+            else:
+                # Optional link rate negotiation, see Arduino.negotiate_baud
+                negotiate = config.has_option('Motors','negotiate') and \
+                    config.getboolean('Motors','negotiate')
+                heli = Heli(config.get('Motors','port'), negotiate=negotiate)
+        self.__heli = heli
 
         # Initialize motors
         self.__heli.set_12v_motor_sleep_state(False)
         self.__heli.set_5v_motor_sleep_state(False)
 
         # State variables
+        # Signal histories: x[0] is the current sample, x[1] the previous one
         (psi,theta,phi) = self.__heli.read_sensor_data()
-        self.theta = [theta, theta]
+        self.theta = RingBuffer(2, theta)
         self.theta_ref = [0]
-        self.phi = [phi, phi]
+        self.phi = RingBuffer(2, phi)
         self.phi_ref = [0]
         self.ref_idx = 0
-        self.e_theta = [0,0]
-        self.e_phi = [0,0]
-        self.u_1 = [0,0]
-        self.u_2 = [0,0]
+        self.e_theta = RingBuffer(2)
+        self.e_phi = RingBuffer(2)
+        self.u_1 = RingBuffer(2)
+        self.u_2 = RingBuffer(2)
 
         # Yaw controller parameters
         self.Kp2 = 1
@@ -73,95 +112,143 @@ class Controller(Thread):
                   [0.0, 0.0, 0.0, 0.0, 0.0], 
                   [0.0, 0.0, 0.0, 0.0, 0.0]]
         
-        # Proposition vectors
-        self.mu_e_theta = [0 for i in range(len(self.e_trimf))]
-        self.mu_e_phi = [0 for i in range(len(self.e_trimf))]
-        self.mu_de_theta = [0 for i in range(len(self.de_trimf))]
-        self.mu_de_phi = [0 for i in range(len(self.de_trimf))]
-        self.antecedent_theta = [[0 for j in range(len(self.A))] for i in range(len(self.A))]
-        self.antecedent_phi = [[0 for j in range(len(self.A))] for i in range(len(self.A))]
+        # Inference engine of the pitch controller, on a rule base from a
+        # file, e.g. one exported by fuzzy_optimizer.py
+        if config.has_option('Controller','fuzzy_rules'):
+            self.load_rules(config.get('Controller','fuzzy_rules'))
+        else:
+            self.set_rules(self.e_trimf, self.de_trimf, self.A)
+        
+        # Optional stage timing of update(), see profiler.py
+        self.profiler = None
+        if config.has_option('Controller','profile') and \
+                config.getboolean('Controller','profile'):
+            window = 1000
+            if config.has_option('Controller','profile_window'):
+                window = config.getint('Controller','profile_window')
+            self.profiler = StageProfiler(window=window)
         
         self.__log_on = log
         if self.__log_on:
             self.log = True
             now_str = datetime.now().__str__().split('.')[0]
             now_str = now_str.replace(' ','-').replace(':','-')
-            self.logfile = open(now_str + '_ctrl_log.csv','wb')
-            self.logger = csv.writer(self.logfile,delimiter=';')
+            # Binary columnar log, written by a background thread.
+            # Convert with: python binlog.py <file>_ctrl_log.bin
+            fields = ['time','theta','phi','theta_ref','phi_ref',
+                      'u_1','u_2','Kp2','Ti2']
+            if self.profiler is not None:
+                # Stage times of each step, t_log of the previous step
+                fields += ['t_' + stage for stage in STAGES]
+            self.logger = BinaryLogger(now_str + '_ctrl_log.bin', fields)
     
     def update(self):
         """
         This is one controller step.
         """
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.start()
         
         # Update measurements
         (psi,theta,phi) = self.__heli.read_sensor_data()
+        if profiler is not None:
+            profiler.mark(SENSOR)
         
-        self.theta.insert(0,theta), self.theta.pop()
-        self.phi.insert(0,phi), self.phi.pop()
-        self.e_theta.insert(0,self.theta_ref[self.ref_idx]-theta), self.e_theta.pop()
-        self.e_phi.insert(0,self.phi_ref[self.ref_idx]-phi), self.e_phi.pop()
+        self.theta.push(theta)
+        self.phi.push(phi)
+        self.e_theta.push(self.theta_ref[self.ref_idx]-theta)
+        self.e_phi.push(self.phi_ref[self.ref_idx]-phi)
         # Advance the reference index
         self.ref_idx = (self.ref_idx + 1) % min(len(self.theta_ref), len(self.phi_ref))
 
         ### Yaw Control law ###
         
-        # The yaw control law is a simple PI controller.
-        self.u_2.insert(0,0), self.u_2.pop()
-        self.u_2[0] += self.Kp2*((self.e_phi[0] - self.e_phi[1])
-                                 + self.Td*self.e_phi[0]/self.Ti2)
+        # The yaw control law is a simple PI controller, in velocity form:
+        # the increment is added to the previous output u_2[0]
+        self.u_2.push(self.u_2[0] + self.Kp2*((self.e_phi[0] - self.e_phi[1])
+                                              + self.Td*self.e_phi[0]/self.Ti2))
 
         ### Pitch Fuzzy Control law ###
 
-        ### Compute fuzzy propositions ###
-        for i in range(len(self.mu_e_theta)):
-            self.mu_e_theta[i] = self.proposition_trimf(self.e_theta[0],
-                                                    self.e_trimf[i])
-
-        for i in range(len(self.mu_de_theta)):
-            self.mu_de_theta[i] = self.proposition_trimf(self.e_theta[0]-self.e_theta[1],
-                                                         self.de_trimf[i])
-      
-        ### Compute fuzzy relations ###
-        ### AND method: poduct ###
-        for i in range(len(self.antecedent_theta)):
-            for j in range(len(self.antecedent_theta)):
-                self.antecedent_theta[i][j] = self.mu_de_theta[i] * self.mu_e_theta[j]
-
-        ### Perform fuzzy implicaton and output aggregation. ###
+        ### Fuzzy propositions of e and de, AND method: product ###
         ### Outputs are singletons, so MIN is equal to multiplicaton ###
-        self.u_1.insert(0,0), self.u_1.pop()
-        for i in range(len(self.A)):
-            for j in range(len(self.A[i])):
-                self.u_1[0] += self.antecedent_theta[i][j] * self.theta[i][j]
+        e = self.e_theta[0]
+        de = e - self.e_theta[1]
+        self.u_1.push(self.pitch_law(e, de))
+        if profiler is not None:
+            profiler.mark(LAW)
 
-        #self.__heli.set_motor_speed_12v(self.u_1[0])
-        #self.__heli.set_motor_speed_5v(self.u_2[0])
+        # Both motors are actuated in one batched serial write
+        #with self.__heli.batch():
+        #    self.__heli.set_motor_speed_12v(self.u_1[0])
+        #    self.__heli.set_motor_speed_5v(self.u_2[0])
+        if profiler is not None:
+            profiler.mark(ACTUATE)
         print(self.u_1[0], self.u_2[0])
 
         # Log data
         if self.__log_on:
-            self.logger.writerow([time.time(),self.theta[0],self.phi[0],
-                                  self.theta_ref[self.ref_idx], self.phi_ref[self.ref_idx],
-                                  self.u_1[0], self.u_2[0]])
+            self.logger.log(time.time(),self.theta[0],self.phi[0],
+                            self.theta_ref[self.ref_idx], self.phi_ref[self.ref_idx],
+                            self.u_1[0], self.u_2[0], self.Kp2, self.Ti2,
+                            *(profiler.last if profiler is not None else ()))
+        if profiler is not None:
+            profiler.mark(LOG)
+    
+    def set_rules(self, e_trimf, de_trimf, A):
+        """
+        Set the rule base of the pitch fuzzy controller.
+        e_trimf and de_trimf hold the L, C, R points of each set,
+        A the output singletons (rows: de, columns: e)
+        """
+        try:
+            # Only the at most 2x2 active rules are evaluated each step
+            engine = SparseFuzzyEngine(e_trimf, de_trimf, A)
+        except ValueError:
+            # Sets overlapping past their neighbours need all the rules
+            engine = FuzzyEngine(e_trimf, de_trimf, A)
+        if self.fuzzy_grid is not None and engine.A.any():
+            # Bilinear lookup in the compiled surface, used only if it
+            # matches the exact rules within the tolerance. The all-zero
+            # placeholder rules are not compiled.
+            surface = compile_surface(engine, self.fuzzy_e_range,
+                                      self.fuzzy_de_range,
+                                      n_e=self.fuzzy_grid, n_de=self.fuzzy_grid)
+            report = accuracy_report(engine, surface)
+            print('Fuzzy surface %dx%d, e %g..%g, de %g..%g: max error %.3g, '
+                  'RMS %.3g' % (len(surface.e_values), len(surface.de_values),
+                                surface.e_values[0], surface.e_values[-1],
+                                surface.de_values[0], surface.de_values[-1],
+                                report['max_abs'], report['rms']))
+            if report['max_abs'] > self.fuzzy_tolerance:
+                raise ValueError('fuzzy surface error %.3g at (e, de) = (%.3g, %.3g) '
+                                 'exceeds fuzzy_tolerance = %g, fuzzy_e_range and '
+                                 'fuzzy_de_range must cover the span of the sets'
+                                 % ((report['max_abs'],) + report['max_at']
+                                    + (self.fuzzy_tolerance,)))
+            self.fuzzy_accuracy = report
+            self.fuzzy_surface = surface
+            self.pitch_law = surface.lookup
+        else:
+            self.fuzzy_surface = None
+            self.pitch_law = engine.evaluate
+        self.e_trimf = e_trimf
+        self.de_trimf = de_trimf
+        self.A = A
+        self.fuzzy_theta = engine
     
-    def proposition_trimf(self, x, trimf):
+    def load_rules(self, path):
         """
-        Compute fuzzy proposition for triangular membership function.
+        Load the rule base of the pitch fuzzy controller from a JSON file
+        with e_trimf, de_trimf and A, as written by fuzzy.save_rules
         """
-        mu = 0.0
-        (L,C,R) = trimf
-        if (x >= L) and (x <= C):
-            mu = (x - L) / (C - L)
-        elif (x > C) and (x <= R):
-            mu = -(x - R) / (R - C)
-            
-        return mu
+        self.set_rules(*load_rules(path))
     
-    def set_ref(self, x_ref, y_ref):
+    def set_ref(self, theta_ref, phi_ref):
         """
-        Set the reference position of the ball.
-        x_ref and y_ref should be lists of the same size
+        Set the reference pitch and yaw.
+        theta_ref and phi_ref should be lists of the same size
         """
         self.theta_ref = theta_ref
         self.phi_ref = phi_ref
@@ -169,10 +256,10 @@ class Controller(Thread):
     
     def run(self):
         """
-        Run update every Td
+        Run update every Td, on absolute deadlines so the period does not
+        drift. Loop statistics are available from self.scheduler.stats().
         """
-        while not self.stopped.wait(self.Td):
-            self.update()
+        self.scheduler.run(self.update)
         
         self.__cleanup()
         
@@ -180,7 +267,9 @@ class Controller(Thread):
         self.__heli.reset_all()
         self.__heli.close()
         if self.__log_on:
-            self.logfile.close()
+            self.logger.close()
+        if self.profiler is not None:
+            print(self.profiler.report())
         
 if __name__ == '__main__':
 
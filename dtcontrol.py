@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+"""
+Precompiled discrete-time controllers.
+
+A controller is specified as a continuous-time transfer function C(s):
+
+    pi        Kp, Ti            Kp (1 + 1/(Ti s))
+    pid       Kp, Ti, Tv, N     Kp (1 + 1/(Ti s) + Tv s/(Tv/N s + 1))
+    leadlag   K, T1, T2         K (T1 s + 1)/(T2 s + 1)
+    tf        num, den          num(s)/den(s), coefficients in descending
+                                powers of s, den of at least the degree of num
+
+It is discretized once with the sample time Td by one of
+
+    tustin    s = 2/Td (z - 1)/(z + 1)
+    zoh       zero-order hold, with the matrix exponential of a state space
+              realization
+    backward  s = (z - 1)/(Td z), backward Euler; the pi spec gives the
+              velocity form PI law
+
+into the difference equation
+
+    y(k) = b0 x(k) + b1 x(k-1) + ... + bn x(k-n) - a1 y(k-1) - ... - an y(k-n)
+
+which is run in the transposed direct form II: every step is one multiply-add
+per coefficient over a preallocated state array, and no coefficient is
+recomputed. The output is limited to the motor range and the limited output
+is fed back into the state, which keeps integral action from winding up.
+
+The axes of a controller are configured in platform.cfg, one section each:
+
+    [Pitch]
+    type = pid
+    Kp = 2.0
+    Ti = 5.0
+    Tv = 0.3
+    N = 10
+    method = tustin
+    limits = 0 100
+"""
+
+from array import array
+
+import numpy as np
+
+SPECS = {"pi": ("Kp", "Ti"),
+         "pid": ("Kp", "Ti", "Tv", "N"),
+         "leadlag": ("K", "T1", "T2"),
+         "tf": ("num", "den")}
+METHODS = ("tustin", "zoh", "backward")
+# Derivative filter of the pid spec, Tv/N is its time constant
+DEFAULT_N = 10.0
+
+
+def _coefficients(text):
+    return [float(c) for c in text.replace(",", " ").split()]
+
+
+def continuous_tf(spec):
+    """
+    Transfer function of a controller spec
+    -------------
+    :param spec: dict with type and the parameters of SPECS
+    :return value: (num, den) arrays in descending powers of s
+    """
+    kind = spec.get("type", "pi")
+    if kind == "pi":
+        Kp, Ti = spec["Kp"], spec["Ti"]
+        return np.array([Kp * Ti, Kp]), np.array([Ti, 0.0])
+    if kind == "pid":
+        Kp, Ti, Tv = spec["Kp"], spec["Ti"], spec["Tv"]
+        Tf = Tv / spec.get("N", DEFAULT_N)
+        # Kp ((Ti s + 1)(Tf s + 1) + Ti Tv s^2) / (Ti s (Tf s + 1))
+        num = Kp * np.array([Ti * Tf + Ti * Tv, Ti + Tf, 1.0])
+        return num, np.array([Ti * Tf, Ti, 0.0])
+    if kind == "leadlag":
+        K, T1, T2 = spec["K"], spec["T1"], spec["T2"]
+        return np.array([K * T1, K]), np.array([T2, 1.0])
+    if kind == "tf":
+        num = np.trim_zeros(np.asarray(spec["num"], dtype=float), "f")
+        den = np.trim_zeros(np.asarray(spec["den"], dtype=float), "f")
+        if not len(den):
+            raise ValueError("the denominator must not be zero")
+        if len(num) > len(den):
+            raise ValueError("the transfer function must be proper")
+        return num, den
+    raise ValueError("Unknown controller type: %s" % kind)
+
+
+def expm(M):
+    """
+    Matrix exponential by scaling and squaring with a (6, 6) Pade
+    approximant.
+    """
+    M = np.asarray(M, dtype=float)
+    norm = np.abs(M).sum(axis=0).max()
+    squarings = 0
+    if norm > 0.5:
+        squarings = int(np.ceil(np.log2(norm))) + 1
+    X = M / 2.0 ** squarings
+    identity = np.eye(len(M))
+    N = identity.copy()
+    D = identity.copy()
+    term = identity
+    c = 1.0
+    q = 6
+    for k in range(1, q + 1):
+        c *= (q - k + 1) / float(k * (2 * q - k + 1))
+        term = X.dot(term)
+        N += c * term
+        D += (-1) ** k * c * term
+    E = np.linalg.solve(D, N)
+    for k in range(squarings):
+        E = E.dot(E)
+    return E
+
+
+def _polypow(p, k):
+    result = np.ones(1)
+    for i in range(k):
+        result = np.polymul(result, p)
+    return result
+
+
+def _substitute(num, den, p, q):
+    """
+    Replaces s by p(z)/q(z), both of degree one, and clears the
+    denominators.
+    """
+    n = len(den) - 1
+    num = np.concatenate([np.zeros(len(den) - len(num)), num])
+    # s^(n - k) -> p^(n - k) q^k
+    basis = [np.polymul(_polypow(p, n - k), _polypow(q, k))
+             for k in range(n + 1)]
+    return (sum(c * term for c, term in zip(num, basis)),
+            sum(c * term for c, term in zip(den, basis)))
+
+
+def _zoh(num, den, Td):
+    n = len(den) - 1
+    num = np.concatenate([np.zeros(len(den) - len(num)), num]) / den[0]
+    den = den / den[0]
+    if n == 0:
+        return num, den
+    # Controllable canonical realization of the strictly proper part
+    D = num[0]
+    C = (num - D * den)[1:]
+    A = np.zeros((n, n))
+    A[0] = -den[1:]
+    A[1:, :-1] = np.eye(n - 1)
+    B = np.zeros(n)
+    B[0] = 1.0
+    # exp([[A, B], [0, 0]] Td) holds Ad and Bd
+    M = np.zeros((n + 1, n + 1))
+    M[:n, :n] = A
+    M[:n, n] = B
+    E = expm(M * Td)
+    Ad = E[:n, :n]
+    Bd = E[:n, n]
+    # C (zI - Ad)^-1 Bd + D
+    #   = (det(zI - Ad + Bd C) - det(zI - Ad)) / det(zI - Ad) + D
+    den_z = np.poly(Ad).real
+    num_z = np.poly(Ad - np.outer(Bd, C)).real - den_z + D * den_z
+    return num_z, den_z
+
+
+def discretize(num, den, Td, method="tustin"):
+    """
+    Discrete transfer function of a continuous one
+    -------------
+    :param num, den: coefficients in descending powers of s
+    :param Td: sample time in s
+    :param method: one of METHODS
+    :return value: (b, a) in descending powers of z, a[0] = 1, of equal
+                   length
+    """
+    num = np.asarray(num, dtype=float)
+    den = np.asarray(den, dtype=float)
+    if method == "tustin":
+        num_z, den_z = _substitute(num, den, np.array([2.0 / Td, -2.0 / Td]),
+                                   np.array([1.0, 1.0]))
+    elif method == "backward":
+        num_z, den_z = _substitute(num, den, np.array([1.0, -1.0]),
+                                   np.array([Td, 0.0]))
+    elif method == "zoh":
+        num_z, den_z = _zoh(num, den, Td)
+    else:
+        raise ValueError("Unknown discretization method: %s" % method)
+    if den_z[0] == 0.0:
+        raise ValueError("the transfer function cannot be discretized")
+    return list(num_z / den_z[0]), list(den_z / den_z[0])
+
+
+class DiscreteController(object):
+    """
+    Difference equation in transposed direct form II with a limited output.
+    """
+
+    def __init__(self, b, a, limits=None):
+        """
+        -------------
+        :param b, a: numerator and denominator in descending powers of z,
+                     of equal length, a[0] = 1
+        :param limits: (min, max) of the output, None for no limit
+        """
+        if len(b) != len(a) or a[0] != 1.0:
+            raise ValueError("b and a must have equal length and a[0] = 1")
+        if len(a) == 1:
+            # A static gain still gets one state, kept at zero
+            b = list(b) + [0.0]
+            a = list(a) + [0.0]
+        self.b = tuple(float(c) for c in b)
+        self.a = tuple(float(c) for c in a)
+        self.order = len(a) - 1
+        self.limits = limits or (float("-inf"), float("inf"))
+        self.state = array('d', [0.0]) * self.order
+        # Coefficients as used by step, looked up once per step
+        self._lo, self._hi = self.limits
+        self._b0 = self.b[0]
+        # (k, b[k], a[k]) of the states updated from their successor, and
+        # of the last state
+        self._terms = tuple(zip(range(1, self.order), self.b[1:self.order],
+                                self.a[1:self.order]))
+        self._last = (self.order - 1, self.b[-1], self.a[-1])
+
+    def step(self, x):
+        """
+        Returns the output for the input x, one sample period after the
+        previous call.
+        """
+        s = self.state
+        y = self._b0 * x + s[0]
+        if y > self._hi:
+            y = self._hi
+        elif y < self._lo:
+            y = self._lo
+        for k, b, a in self._terms:
+            s[k - 1] = b * x - a * y + s[k]
+        k, b, a = self._last
+        s[k] = b * x - a * y
+        return y
+
+    def reset(self):
+        for k in range(self.order):
+            self.state[k] = 0.0
+
+
+def compile_spec(spec, Td, limits=None):
+    """
+    Discretizes a controller spec
+    -------------
+    :param spec: dict with type, its parameters (SPECS), and optionally
+                 method and limits
+    :param limits: output limits used if the spec has none
+    :return value: DiscreteController
+    """
+    b, a = discretize(*continuous_tf(spec), Td=Td,
+                      method=spec.get("method", "tustin"))
+    return DiscreteController(b, a, spec.get("limits", limits))
+
+
+def spec_from_config(config, section):
+    """
+    Reads a controller spec from a config section, see the module docstring.
+    """
+    kind = "pi"
+    if config.has_option(section, "type"):
+        kind = config.get(section, "type")
+    if kind not in SPECS:
+        raise ValueError("Unknown controller type %s in [%s]" % (kind, section))
+    spec = {"type": kind}
+    for name in SPECS[kind]:
+        if not config.has_option(section, name):
+            if name == "N":
+                continue
+            raise ValueError("[%s] needs %s for a %s controller"
+                             % (section, name, kind))
+        if kind == "tf":
+            spec[name] = _coefficients(config.get(section, name))
+        else:
+            spec[name] = config.getfloat(section, name)
+    if config.has_option(section, "method"):
+        spec["method"] = config.get(section, "method")
+    if config.has_option(section, "limits"):
+        spec["limits"] = tuple(_coefficients(config.get(section, "limits")))
+    return spec
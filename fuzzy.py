@@ -0,0 +1,405 @@
+#!/usr/bin/env python
+"""
+Fuzzy inference for singleton-output controllers with two inputs.
+
+The rule base is given by triangular membership functions of the error e
+and its difference de, and a table A of output singletons (rows: de,
+columns: e). The AND method is the product and, since the outputs are
+singletons, the output is the sum of the rule activations weighted by
+their singletons:
+
+    u = sum_ij mu_de[i] * mu_e[j] * A[i][j]
+
+Memberships and the rule base are evaluated with NumPy, for one (e, de)
+pair per control step or for whole arrays of pairs at once.
+
+Inputs are limited to the span of the sets (from the smallest L to the
+largest R), so an outer set closed at its own centre (L == C or C == R)
+acts as a shoulder for all inputs beyond it.
+
+With triangular partitions in which every set ends at the centres of its
+neighbours, at most two sets per input are active. SparseFuzzyEngine finds
+them with a bisection over the sorted centres and evaluates only those 2x2
+rules, so the cost of a step does not grow with the size of the rule base.
+
+A rule base can also be compiled into a FuzzySurface, a table sampled on a
+grid and interpolated bilinearly at run time. Between the L, C and R points
+of the sets every membership is linear, so the output is bilinear in each
+cell of a grid that holds all of these breakpoints, and the lookup is exact
+up to rounding. Compiled surfaces are cached on disk, keyed by a hash of the
+rule parameters and the grid.
+"""
+
+import hashlib
+import json
+import os
+from bisect import bisect_right
+
+import numpy as np
+
+
+def trimf(x, sets):
+    """
+    Evaluates triangular membership functions.
+    -------------
+    :param x: input value or array of values
+    :param sets: array of shape (n, 3) with the L, C, R points of each set,
+                 or of shape x.shape + (n, 3) for different sets per value
+    :return value: memberships of shape x.shape + (n,)
+    """
+    x = np.asarray(x, dtype=float)[..., np.newaxis]
+    L = sets[..., 0]
+    C = sets[..., 1]
+    R = sets[..., 2]
+    # Degenerate sides (L == C or C == R) are shoulders with membership 1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rising = np.where(C > L, (x - L) / (C - L), 1.0)
+        falling = np.where(R > C, (R - x) / (R - C), 1.0)
+    return np.where((x >= L) & (x <= C), rising,
+                    np.where((x > C) & (x <= R), falling, 0.0))
+
+
+class FuzzyEngine(object):
+
+    def __init__(self, e_trimf, de_trimf, A):
+        """
+        -------------
+        :param e_trimf: L, C, R points of the sets of e, one row per set
+        :param de_trimf: L, C, R points of the sets of de, one row per set
+        :param A: output singletons, rows: de, columns: e
+        """
+        self.e_sets = np.array(e_trimf, dtype=float).reshape(-1, 3)
+        self.de_sets = np.array(de_trimf, dtype=float).reshape(-1, 3)
+        self.A = np.array(A, dtype=float)
+        if self.A.shape != (len(self.de_sets), len(self.e_sets)):
+            raise ValueError("A must have one row per de set and one column "
+                             "per e set")
+        # Span of the sets, inputs are limited to it
+        self.e_span = (float(self.e_sets[:, 0].min()),
+                       float(self.e_sets[:, 2].max()))
+        self.de_span = (float(self.de_sets[:, 0].min()),
+                        float(self.de_sets[:, 2].max()))
+
+    def memberships(self, e, de):
+        """
+        Returns the membership vectors (mu_e, mu_de) of the inputs.
+        """
+        e = np.clip(e, self.e_span[0], self.e_span[1])
+        de = np.clip(de, self.de_span[0], self.de_span[1])
+        return trimf(e, self.e_sets), trimf(de, self.de_sets)
+
+    def evaluate(self, e, de):
+        """
+        Output for a single (e, de) pair.
+        """
+        mu_e, mu_de = self.memberships(e, de)
+        return float(mu_de.dot(self.A).dot(mu_e))
+
+    def evaluate_batch(self, e, de):
+        """
+        Outputs for arrays of (e, de) pairs of the same shape.
+        -------------
+        :return value: array of outputs with the shape of e
+        """
+        mu_e, mu_de = self.memberships(e, de)
+        return np.einsum('...i,ij,...j->...', mu_de, self.A, mu_e)
+
+    def surface(self, e_values, de_values):
+        """
+        Control surface on a grid, e.g. for plotting.
+        -------------
+        :param e_values: 1D array of e values
+        :param de_values: 1D array of de values
+        :return value: array of shape (len(de_values), len(e_values))
+        """
+        e_grid, de_grid = np.meshgrid(e_values, de_values)
+        return self.evaluate_batch(e_grid, de_grid)
+
+
+class SparseFuzzyEngine(FuzzyEngine):
+    """
+    FuzzyEngine whose single pair evaluation only visits the active rules.
+    Raises ValueError if some set reaches past the centre of a neighbour,
+    since then more than two sets per input can be active.
+    """
+
+    def __init__(self, e_trimf, de_trimf, A):
+        super(SparseFuzzyEngine, self).__init__(e_trimf, de_trimf, A)
+        self._e_order, self._e_centers, self._e_sorted = \
+            _sorted_partition(self.e_sets)
+        self._de_order, self._de_centers, self._de_sorted = \
+            _sorted_partition(self.de_sets)
+        # Singletons reordered to the sorted sets, as plain lists
+        self._A = [[float(self.A[i, j]) for j in self._e_order]
+                   for i in self._de_order]
+
+    def evaluate(self, e, de):
+        """
+        Output for a single (e, de) pair.
+        """
+        e_lo, e_hi = self.e_span
+        if e < e_lo:
+            e = e_lo
+        elif e > e_hi:
+            e = e_hi
+        de_lo, de_hi = self.de_span
+        if de < de_lo:
+            de = de_lo
+        elif de > de_hi:
+            de = de_hi
+        active_e = _active_sets(e, self._e_centers, self._e_sorted)
+        active_de = _active_sets(de, self._de_centers, self._de_sorted)
+        u = 0.0
+        A = self._A
+        for i, mu_de in active_de:
+            row = A[i]
+            for j, mu_e in active_e:
+                u += mu_de * mu_e * row[j]
+        return u
+
+
+def _sorted_partition(sets):
+    """
+    Sorts the sets by their centres and checks that each set ends at or
+    before the centres of its neighbours.
+    -------------
+    :return value: (order, centres, sets) of the sorted partition
+    """
+    order = sorted(range(len(sets)), key=lambda k: sets[k, 1])
+    sorted_sets = [tuple(float(p) for p in sets[k]) for k in order]
+    centers = [C for (L, C, R) in sorted_sets]
+    # Tolerance for breakpoints computed with rounding errors
+    tol = 1e-9 * (abs(centers[-1] - centers[0]) + 1.0)
+    for k in range(1, len(sorted_sets)):
+        if centers[k] <= centers[k - 1]:
+            raise ValueError("fuzzy sets must have distinct centres")
+        if sorted_sets[k][0] < centers[k - 1] - tol or \
+                sorted_sets[k - 1][2] > centers[k] + tol:
+            raise ValueError("fuzzy sets overlap past their neighbours")
+    return order, centers, sorted_sets
+
+
+def _active_sets(x, centers, sets):
+    """
+    Returns (index, membership) of the at most two sets around x.
+    """
+    k = bisect_right(centers, x)
+    active = []
+    for idx in (k - 1, k):
+        if idx < 0 or idx >= len(sets):
+            continue
+        L, C, R = sets[idx]
+        if L <= x <= C:
+            mu = (x - L) / (C - L) if C > L else 1.0
+        elif C < x <= R:
+            mu = (R - x) / (R - C)
+        else:
+            continue
+        if mu:
+            active.append((idx, mu))
+    return active
+
+
+def save_rules(path, e_trimf, de_trimf, A, **extra):
+    """
+    Writes a rule base to a JSON file, with any extra entries (e.g. the
+    score of an optimization run) alongside.
+    """
+    rules = dict(extra)
+    rules["e_trimf"] = np.asarray(e_trimf, dtype=float).tolist()
+    rules["de_trimf"] = np.asarray(de_trimf, dtype=float).tolist()
+    rules["A"] = np.asarray(A, dtype=float).tolist()
+    with open(path, 'w') as f:
+        json.dump(rules, f, indent=2, sort_keys=True)
+
+
+def load_rules(path):
+    """
+    Reads a rule base written by save_rules
+    -------------
+    :return value: (e_trimf, de_trimf, A) as nested lists
+    """
+    with open(path) as f:
+        rules = json.load(f)
+    return rules["e_trimf"], rules["de_trimf"], rules["A"]
+
+
+def rule_hash(engine, e_values, de_values):
+    """
+    Key of a compiled surface: hash of the rule base and the grid.
+    """
+    h = hashlib.sha1()
+    for a in (engine.e_sets, engine.de_sets, engine.A,
+              np.asarray(e_values, dtype=float),
+              np.asarray(de_values, dtype=float)):
+        h.update(np.ascontiguousarray(a).tostring())
+        h.update(str(a.shape))
+    return h.hexdigest()
+
+
+def grid_points(sets, value_range, n=0):
+    """
+    Grid of one input of a surface: n regularly spaced points over
+    value_range and every L, C, R point of the sets inside it.
+    -------------
+    :param value_range: (min, max) of the grid, e.g. the span of the sets
+    :return value: sorted array of distinct points, at least the two ends
+    """
+    lo, hi = float(value_range[0]), float(value_range[1])
+    if not hi > lo:
+        raise ValueError("the grid range must not be empty")
+    points = np.asarray(sets, dtype=float).reshape(-1)
+    points = points[(points > lo) & (points < hi)]
+    return np.unique(np.concatenate([[lo, hi], points,
+                                     np.linspace(lo, hi, n)]))
+
+
+def _locate(x, points):
+    """
+    Cell of a grid that holds x, and the position of x in it
+    -------------
+    :return value: (index of the lower grid point, fraction from 0 to 1),
+                   x is clamped to the grid
+    """
+    if x <= points[0]:
+        return 0, 0.0
+    last = len(points) - 1
+    if x >= points[last]:
+        return last - 1, 1.0
+    j = bisect_right(points, x) - 1
+    return j, (x - points[j]) / (points[j + 1] - points[j])
+
+
+def _locate_batch(x, points):
+    """
+    _locate for an array of inputs.
+    """
+    x = np.clip(np.asarray(x, dtype=float), points[0], points[-1])
+    j = np.clip(np.searchsorted(points, x, side='right') - 1,
+                0, len(points) - 2)
+    return j, (x - points[j]) / (points[j + 1] - points[j])
+
+
+class FuzzySurface(object):
+    """
+    Control surface of a rule base sampled on a grid. lookup() interpolates
+    it bilinearly, in a time that grows only with the log of the grid size
+    regardless of the number of rules. Inputs outside the grid are clamped
+    to its edges, as the engines limit them to the span of the sets.
+    """
+
+    def __init__(self, e_values, de_values, table):
+        """
+        -------------
+        :param e_values: increasing grid points of e, at least two
+        :param de_values: increasing grid points of de, at least two
+        :param table: outputs, shape (len(de_values), len(e_values))
+        """
+        self.e_values = np.asarray(e_values, dtype=float)
+        self.de_values = np.asarray(de_values, dtype=float)
+        self.table = np.asarray(table, dtype=float)
+        if len(self.e_values) < 2 or len(self.de_values) < 2:
+            raise ValueError("a surface needs at least two grid points per "
+                             "input")
+        # Plain lists are faster than NumPy for single element access
+        self._e_points = self.e_values.tolist()
+        self._de_points = self.de_values.tolist()
+        self._rows = self.table.tolist()
+
+    @classmethod
+    def compile(cls, engine, e_range=None, de_range=None, n_e=101, n_de=101):
+        """
+        Samples the rule base of a FuzzyEngine on a grid, see grid_points
+        -------------
+        :param e_range: (min, max) of e, by default the span of the sets,
+                        the inputs the engine accepts
+        :param de_range: (min, max) of de, by default the span of its sets
+        :param n_e: number of regularly spaced grid points of e, in addition
+                    to the breakpoints of the sets; 0 for only these, which
+                    is already exact
+        :param n_de: the same for de
+        """
+        e_values = grid_points(engine.e_sets, e_range or engine.e_span, n_e)
+        de_values = grid_points(engine.de_sets, de_range or engine.de_span,
+                                n_de)
+        return cls(e_values, de_values, engine.surface(e_values, de_values))
+
+    def lookup(self, e, de):
+        """
+        Output for a single (e, de) pair.
+        """
+        j, tx = _locate(e, self._e_points)
+        i, ty = _locate(de, self._de_points)
+        row0 = self._rows[i]
+        row1 = self._rows[i + 1]
+        u0 = row0[j] + tx * (row0[j + 1] - row0[j])
+        u1 = row1[j] + tx * (row1[j + 1] - row1[j])
+        return u0 + ty * (u1 - u0)
+
+    def lookup_batch(self, e, de):
+        """
+        Outputs for arrays of (e, de) pairs of the same shape.
+        """
+        j, tx = _locate_batch(e, self.e_values)
+        i, ty = _locate_batch(de, self.de_values)
+        t = self.table
+        u0 = t[i, j] + tx * (t[i, j + 1] - t[i, j])
+        u1 = t[i + 1, j] + tx * (t[i + 1, j + 1] - t[i + 1, j])
+        return u0 + ty * (u1 - u0)
+
+    def save(self, path):
+        np.savez(path, e_values=self.e_values, de_values=self.de_values,
+                 table=self.table)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        return cls(data['e_values'], data['de_values'], data['table'])
+
+
+def compile_surface(engine, e_range=None, de_range=None, n_e=101, n_de=101,
+                    cache_dir='fuzzy_cache'):
+    """
+    Compiles the rule base of engine into a FuzzySurface, reusing a surface
+    cached in cache_dir for the same rules and grid. Pass cache_dir=None to
+    always recompile.
+    """
+    e_values = grid_points(engine.e_sets, e_range or engine.e_span, n_e)
+    de_values = grid_points(engine.de_sets, de_range or engine.de_span, n_de)
+    path = None
+    if cache_dir is not None:
+        key = rule_hash(engine, e_values, de_values)
+        path = os.path.join(cache_dir, 'fuzzy_%s.npz' % key)
+        if os.path.exists(path):
+            return FuzzySurface.load(path)
+    surface = FuzzySurface(e_values, de_values,
+                           engine.surface(e_values, de_values))
+    if path is not None:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        surface.save(path)
+    return surface
+
+
+def accuracy_report(engine, surface, n=10000, seed=0):
+    """
+    Compares a compiled surface against the exact inference at n random
+    points of the whole input domain: the span of the sets, which the
+    engine limits its inputs to, and the grid, outside of which the lookup
+    clamps
+    -------------
+    :return value: dict with the max, mean and RMS absolute error and the
+                   (e, de) point of the max error
+    """
+    rng = np.random.RandomState(seed)
+    e = rng.uniform(min(engine.e_span[0], surface.e_values[0]),
+                    max(engine.e_span[1], surface.e_values[-1]), n)
+    de = rng.uniform(min(engine.de_span[0], surface.de_values[0]),
+                     max(engine.de_span[1], surface.de_values[-1]), n)
+    err = np.abs(surface.lookup_batch(e, de) - engine.evaluate_batch(e, de))
+    k = int(err.argmax())
+    return {"points": n,
+            "max_abs": float(err[k]),
+            "mean_abs": float(err.mean()),
+            "rms": float(np.sqrt((err ** 2).mean())),
+            "max_at": (float(e[k]), float(de[k]))}
@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+"""
+Particle swarm optimization of the pitch fuzzy controller.
+
+A candidate rule base is a pair of triangular partitions of e and de,
+symmetric around zero and with every set ending at the centres of its
+neighbours (so the controller can use SparseFuzzyEngine), and the table A
+of output singletons. The outermost sets end at their own centres, so the
+span of the sets is the range the rules were tuned on; the engines limit
+larger inputs to that span, where the outer sets act as shoulders. The
+parameters of a candidate are the distances between successive centres of e
+and of de, and the singletons.
+
+The whole swarm is simulated at once: the pitch axis of virtual_heli's
+HeliPlant is integrated with NumPy arrays holding one state per candidate,
+and the fuzzy controllers of all candidates are evaluated together with
+fuzzy.trimf on per-candidate sets. Each candidate is scored on a pitch
+reference step:
+
+    score = IAE(theta) + overshoot weight * overshoot + effort weight * effort
+
+The best rule base is written with fuzzy.save_rules, and is loaded by the
+fuzzy controller with the [Controller] fuzzy_rules option:
+
+    python fuzzy_optimizer.py --sets 5 --particles 64 --iterations 100
+"""
+
+import argparse
+import ConfigParser
+
+import numpy as np
+
+from autotune_pi import step_reference
+from fuzzy import trimf, save_rules
+from virtual_heli import HeliPlant
+
+def symmetric_partition(gaps):
+    """
+    Builds triangular partitions symmetric around zero, the outer sets
+    closed at the outermost centres (shoulders)
+    -------------
+    :param gaps: positive distances between successive centres, from zero
+                 outwards, array of shape (..., m)
+    :return value: L, C, R points of shape (..., 2m + 1, 3)
+    """
+    half = np.cumsum(gaps, axis=-1)
+    zero = np.zeros(half.shape[:-1] + (1,))
+    centers = np.concatenate([-half[..., ::-1], zero, half], axis=-1)
+    L = np.concatenate([centers[..., :1], centers[..., :-1]], axis=-1)
+    R = np.concatenate([centers[..., 1:], centers[..., -1:]], axis=-1)
+    return np.stack([L, centers, R], axis=-1)
+
+
+class RuleEncoding(object):
+    """
+    Maps the parameter vectors of the swarm to rule bases.
+    """
+
+    def __init__(self, sets=5, e_gap=(1.0, 20.0), de_gap=(0.1, 5.0),
+                 output=(0.0, 100.0)):
+        """
+        -------------
+        :param sets: number of sets of e and of de, odd
+        :param e_gap: (min, max) distance between centres of e in degrees
+        :param de_gap: (min, max) distance between centres of de
+        :param output: (min, max) of the singletons, in motor percent
+        """
+        if sets < 3 or sets % 2 == 0:
+            raise ValueError("the number of sets must be odd and at least 3")
+        self.sets = sets
+        self.m = sets // 2
+        m = self.m
+        self.lower = np.array([e_gap[0]] * m + [de_gap[0]] * m
+                              + [output[0]] * (sets * sets))
+        self.upper = np.array([e_gap[1]] * m + [de_gap[1]] * m
+                              + [output[1]] * (sets * sets))
+
+    def decode(self, x):
+        """
+        -------------
+        :param x: parameter vectors of shape (..., dimensions)
+        :return value: (e_sets, de_sets, A) of shapes (..., sets, 3),
+                       (..., sets, 3) and (..., sets, sets)
+        """
+        m = self.m
+        A = x[..., 2 * m:].reshape(x.shape[:-1] + (self.sets, self.sets))
+        return (symmetric_partition(x[..., :m]),
+                symmetric_partition(x[..., m:2 * m]), A)
+
+
+class PitchPopulation(object):
+    """
+    Pitch axis of HeliPlant for a whole population at once, integrated
+    with the semi-implicit Euler method of HeliPlant.step.
+    """
+
+    def __init__(self, size, plant=None, dt=0.005, pitch=0.0):
+        """
+        -------------
+        :param size: number of simulated plants
+        :param plant: HeliPlant the parameters are taken from
+        :param dt: integration step in s
+        :param pitch: initial pitch in degrees
+        """
+        plant = plant or HeliPlant()
+        self.J = plant.J_pitch
+        self.k = plant.k_pitch
+        self.g = plant.g_pitch
+        self.b = plant.b_pitch
+        self.tau = plant.tau_motor
+        self.pitch_min = plant.pitch_min
+        self.pitch_max = plant.pitch_max
+        self.dt = dt
+        self.pitch = np.full(size, np.radians(pitch))
+        self.rate = np.zeros(size)
+        self.w = np.zeros(size)
+
+    def step(self, u, duration):
+        """
+        Integrates duration seconds with the motor commands u (0 to 1).
+        """
+        n = max(1, int(round(duration / self.dt)))
+        h = duration / n
+        for k in range(n):
+            dw = (u - self.w) / self.tau
+            dd = (self.k * self.w * np.abs(self.w)
+                  - self.g * np.cos(self.pitch) - self.b * self.rate) / self.J
+            self.w += h * dw
+            self.rate += h * dd
+            self.pitch += h * self.rate
+            # Mechanical end stops
+            low = self.pitch < self.pitch_min
+            high = self.pitch > self.pitch_max
+            self.pitch = np.clip(self.pitch, self.pitch_min, self.pitch_max)
+            self.rate = np.where(low, np.maximum(self.rate, 0.0), self.rate)
+            self.rate = np.where(high, np.minimum(self.rate, 0.0), self.rate)
+
+    def angles(self):
+        return np.degrees(self.pitch)
+
+
+def simulate_population(e_sets, de_sets, A, theta_ref, Td, noise=0.1, seed=0,
+                        dt=0.005):
+    """
+    Closed-loop runs of a population of fuzzy pitch controllers, with the
+    control law of controller_fuzzy_template.Controller.update
+    -------------
+    :param e_sets, de_sets, A: rule bases as returned by RuleEncoding.decode
+    :param theta_ref: pitch reference of every step, in degrees
+    :param noise: standard deviation of the pitch measurement noise
+    :return value: (theta, u) arrays of shape (steps, population)
+    """
+    size = A.shape[0]
+    plant = PitchPopulation(size, dt=dt)
+    rng = np.random.RandomState(seed)
+    steps = len(theta_ref)
+    theta = np.zeros((steps, size))
+    u = np.zeros((steps, size))
+    e_prev = np.zeros(size)
+    for k in range(steps):
+        # Every candidate sees the same noise
+        theta[k] = plant.angles() + rng.normal(0.0, noise)
+        e = theta_ref[k] - theta[k]
+        # Inputs limited to the span of the sets, as in fuzzy.FuzzyEngine
+        mu_e = trimf(np.clip(e, e_sets[:, 0, 1], e_sets[:, -1, 1]), e_sets)
+        mu_de = trimf(np.clip(e - e_prev, de_sets[:, 0, 1], de_sets[:, -1, 1]),
+                      de_sets)
+        u[k] = np.einsum('pi,pij,pj->p', mu_de, A, mu_e)
+        e_prev = e
+        # Heli.set_motor_speed_12v limits the command to 0 - 100 %
+        plant.step(np.clip(u[k], 0.0, 100.0) / 100.0, Td)
+    return theta, u
+
+
+def score_population(theta, u, theta_ref, Td, overshoot_weight=0.1,
+                     effort_weight=0.001):
+    """
+    Cost of every run, lower is better, with the IAE, overshoot and effort
+    as in autotune_pi.score.
+    """
+    ref = np.asarray(theta_ref, dtype=float)[:, np.newaxis]
+    cost = np.abs(ref - theta).sum(axis=0) * Td
+    steps = np.flatnonzero(np.diff(ref[:, 0]) != 0) + 1
+    for k0, k1 in zip(steps, np.append(steps[1:], len(ref))):
+        size = ref[k0, 0] - ref[k0 - 1, 0]
+        s = (theta[k0:k1] - ref[k0 - 1, 0]) / size
+        cost += overshoot_weight * np.maximum(s.max(axis=0) - 1.0, 0.0) * 100.0
+    cost += effort_weight * np.abs(np.clip(u, 0.0, 100.0)).sum(axis=0) * Td
+    return cost
+
+
+class ParticleSwarm(object):
+    """
+    Particle swarm minimizing over a box, with inertia weight w and the
+    cognitive and social factors c1, c2.
+    """
+
+    def __init__(self, lower, upper, particles=64, w=0.72, c1=1.49, c2=1.49,
+                 seed=0):
+        self.lower = np.asarray(lower, dtype=float)
+        self.upper = np.asarray(upper, dtype=float)
+        self.w = w
+        self.c1 = c1
+        self.c2 = c2
+        self.rng = np.random.RandomState(seed)
+        span = self.upper - self.lower
+        shape = (particles, len(self.lower))
+        self.x = self.lower + self.rng.uniform(size=shape) * span
+        self.v = self.rng.uniform(-0.1, 0.1, size=shape) * span
+        self.v_max = 0.2 * span
+        self.best_x = self.x.copy()
+        self.best_cost = np.full(particles, np.inf)
+        self.global_x = self.x[0].copy()
+        self.global_cost = np.inf
+
+    def tell(self, cost):
+        """
+        Records the costs of the current positions and moves the swarm.
+        """
+        better = cost < self.best_cost
+        self.best_x[better] = self.x[better]
+        self.best_cost[better] = cost[better]
+        k = int(self.best_cost.argmin())
+        if self.best_cost[k] < self.global_cost:
+            self.global_cost = float(self.best_cost[k])
+            self.global_x = self.best_x[k].copy()
+        r1 = self.rng.uniform(size=self.x.shape)
+        r2 = self.rng.uniform(size=self.x.shape)
+        self.v = (self.w * self.v + self.c1 * r1 * (self.best_x - self.x)
+                  + self.c2 * r2 * (self.global_x - self.x))
+        self.v = np.clip(self.v, -self.v_max, self.v_max)
+        self.x = np.clip(self.x + self.v, self.lower, self.upper)
+
+
+def optimize(encoding, theta_ref, Td, particles=64, iterations=100, seed=0,
+             noise=0.1, dt=0.005, overshoot_weight=0.1, effort_weight=0.001,
+             callback=None):
+    """
+    Runs the swarm, simulating all particles together in every iteration
+    -------------
+    :param callback: called with (iteration, best cost) after every iteration
+    :return value: (best cost, (e_sets, de_sets, A) of the best rule base)
+    """
+    swarm = ParticleSwarm(encoding.lower, encoding.upper, particles,
+                          seed=seed)
+    for iteration in range(iterations):
+        e_sets, de_sets, A = encoding.decode(swarm.x)
+        theta, u = simulate_population(e_sets, de_sets, A, theta_ref, Td,
+                                       noise, seed, dt)
+        swarm.tell(score_population(theta, u, theta_ref, Td,
+                                    overshoot_weight, effort_weight))
+        if callback is not None:
+            callback(iteration, swarm.global_cost)
+    return swarm.global_cost, encoding.decode(swarm.global_x)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Fuzzy pitch controller '
+                                     'optimization on the simulated plant')
+    parser.add_argument('--config_file', help='Platform configuration file name',
+                        default='platform.cfg')
+    parser.add_argument('--sets', type=int, default=5,
+                        help='Number of sets of e and de, odd')
+    parser.add_argument('--particles', type=int, default=64)
+    parser.add_argument('--iterations', type=int, default=100)
+    parser.add_argument('--duration', type=float, default=20.0,
+                        help='Simulated time of a run in s')
+    parser.add_argument('--theta_step', type=float, nargs=2, default=(0.0, 10.0),
+                        metavar=('FROM', 'TO'), help='Pitch reference step')
+    parser.add_argument('--noise', type=float, default=0.1,
+                        help='Pitch noise of the simulated IMU in degrees')
+    parser.add_argument('--dt', type=float, default=0.005,
+                        help='Integration step of the plant in s')
+    parser.add_argument('--overshoot_weight', type=float, default=0.1)
+    parser.add_argument('--effort_weight', type=float, default=0.001)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default='fuzzy_rules.json',
+                        help='File the best rule base is written to')
+    args = parser.parse_args()
+
+    config = ConfigParser.RawConfigParser()
+    config.read(args.config_file)
+    Td = config.getfloat('Controller', 'Td')
+    steps = int(round(args.duration / Td))
+    theta_ref = step_reference(args.theta_step[0], args.theta_step[1], steps)
+
+    def report(iteration, cost):
+        print('iteration %4d  best score %.3f' % (iteration + 1, cost))
+
+    cost, (e_sets, de_sets, A) = optimize(
+        RuleEncoding(args.sets), theta_ref, Td, args.particles,
+        args.iterations, args.seed, args.noise, args.dt,
+        args.overshoot_weight, args.effort_weight, report)
+    save_rules(args.out, e_sets, de_sets, A, score=cost, Td=Td)
+    print('')
+    print('Rule base written to %s, use it with' % args.out)
+    print('[Controller]')
+    print('fuzzy_rules = %s' % args.out)
@@ -0,0 +1,485 @@
+#!/usr/bin/env python
+"""
+Serial broker: one process owns the link to the board and shares it.
+
+The broker opens the Heli, publishes every IMU sample to any number of
+local subscribers and executes actuator commands for the one client that
+holds the lease. Clients talk to it over UDP on the loopback interface with
+small fixed-size binary messages, all little endian:
+
+    header          type (uint8), sequence number (uint32)
+    SUBSCRIBE       header, renewed by the client as a keepalive
+    UNSUBSCRIBE     header
+    LEASE           header, lease time in s (float32), also renews a lease
+    RELEASE         header
+    COMMAND         header, then per command: method (uint8), argument (float32)
+    SAMPLE          header, broker time (float64), roll, pitch, yaw (float32)
+    REPLY           header (sequence number of the request), status (uint8),
+                    value (float32)
+
+Motor commands are only executed for the lease holder; reading the motor
+fault pin is open to every client. If the lease runs out without being
+renewed (e.g. the client crashed) the broker stops the motors.
+
+BrokerHeli is the client side with the API of Heli, so a controller can
+use the broker instead of the port ([Motors] broker = 127.0.0.1:5005):
+
+    python heli_broker.py --config_file platform.cfg --stream
+"""
+
+import argparse
+import ConfigParser
+import Queue
+import select
+import socket
+import struct
+import threading
+import time
+from contextlib import contextmanager
+
+import serial
+
+from pyheli import Heli
+from pyno import IMUSample
+
+DEFAULT_ADDRESS = ('127.0.0.1', 5005)
+
+HEADER = struct.Struct("<BI")
+LEASE_TIME = struct.Struct("<f")
+COMMAND = struct.Struct("<Bf")
+SAMPLE = struct.Struct("<d3f")
+REPLY = struct.Struct("<Bf")
+
+SUBSCRIBE = 1
+UNSUBSCRIBE = 2
+LEASE = 3
+RELEASE = 4
+COMMANDS = 5
+SAMPLE_MSG = 6
+REPLY_MSG = 7
+
+OK = 0
+DENIED = 1
+ERROR = 2
+
+# Method code -> (Heli method, needs the lease)
+METHODS = {1: ("set_motor_speed_5v", True),
+           2: ("set_motor_speed_12v", True),
+           3: ("set_5v_motor_sleep_state", True),
+           4: ("set_12v_motor_sleep_state", True),
+           5: ("reset_all", True),
+           6: ("check_5v_motor_fault", False)}
+METHOD_CODES = dict((name, code) for code, (name, lease) in METHODS.items())
+
+
+def parse_address(text):
+    """
+    Parses "host:port", the port alone meaning the loopback interface.
+    """
+    if ':' in text:
+        host, port = text.rsplit(':', 1)
+        return host, int(port)
+    return DEFAULT_ADDRESS[0], int(text)
+
+
+class HeliBroker(object):
+
+    def __init__(self, heli, address=DEFAULT_ADDRESS, stream=True,
+                 period=0.01, subscriber_timeout=5.0):
+        """
+        -------------
+        :param heli: the Heli owned by the broker
+        :param address: (host, port) the broker listens on
+        :param stream: publish the samples streamed by the board, otherwise
+                       poll the sensor every period seconds
+        :param period: sensor polling period when not streaming
+        :param subscriber_timeout: subscribers that do not renew their
+                                   subscription for this long are dropped
+        """
+        self.heli = heli
+        self.stream = stream
+        self.period = period
+        self.subscriber_timeout = subscriber_timeout
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(address)
+        self.address = self.sock.getsockname()
+        self.subscribers = {}
+        self.lease_holder = None
+        self.lease_expiry = 0.0
+        self.seq = 0
+        self.samples_published = 0
+        self.commands_executed = 0
+        self.commands_denied = 0
+        self._lock = threading.Lock()
+
+    def publish(self, data):
+        """
+        Sends one IMU sample to every subscriber.
+        """
+        if data is None:
+            return
+        with self._lock:
+            self.seq += 1
+            msg = HEADER.pack(SAMPLE_MSG, self.seq) + \
+                SAMPLE.pack(time.time(), *[float(x) for x in data])
+            subscribers = list(self.subscribers)
+            self.samples_published += 1
+        for addr in subscribers:
+            try:
+                self.sock.sendto(msg, addr)
+            except socket.error:
+                pass
+
+    def _reply(self, addr, seq, status, value=0.0):
+        self.sock.sendto(HEADER.pack(REPLY_MSG, seq) +
+                         REPLY.pack(status, value), addr)
+
+    def _has_lease(self, addr, now):
+        return self.lease_holder == addr and now < self.lease_expiry
+
+    def handle(self, msg, addr, now):
+        """
+        Handles one client message.
+        """
+        if len(msg) < HEADER.size:
+            return
+        kind, seq = HEADER.unpack_from(msg)
+        body = msg[HEADER.size:]
+        if kind == SUBSCRIBE:
+            with self._lock:
+                self.subscribers[addr] = now
+        elif kind == UNSUBSCRIBE:
+            with self._lock:
+                self.subscribers.pop(addr, None)
+        elif kind == LEASE:
+            duration = LEASE_TIME.unpack_from(body)[0]
+            if self.lease_holder in (None, addr) or now >= self.lease_expiry:
+                self.lease_holder = addr
+                self.lease_expiry = now + duration
+                self._reply(addr, seq, OK, duration)
+            else:
+                self._reply(addr, seq, DENIED, self.lease_expiry - now)
+        elif kind == RELEASE:
+            if self.lease_holder == addr:
+                self.lease_holder = None
+            self._reply(addr, seq, OK)
+        elif kind == COMMANDS:
+            self._execute(body, addr, seq, now)
+
+    def _execute(self, body, addr, seq, now):
+        """
+        Executes a batch of commands in one batched serial write.
+        """
+        count = len(body) // COMMAND.size
+        commands = [COMMAND.unpack_from(body, k * COMMAND.size)
+                    for k in range(count)]
+        for code, arg in commands:
+            if code not in METHODS:
+                self._reply(addr, seq, ERROR)
+                return
+            if METHODS[code][1] and not self._has_lease(addr, now):
+                self.commands_denied += count
+                self._reply(addr, seq, DENIED)
+                return
+        value = 0.0
+        try:
+            with self.heli.batch():
+                for code, arg in commands:
+                    name = METHODS[code][0]
+                    if name == "reset_all" or name == "check_5v_motor_fault":
+                        result = getattr(self.heli, name)()
+                    elif name.endswith("sleep_state"):
+                        result = getattr(self.heli, name)(bool(arg))
+                    else:
+                        result = getattr(self.heli, name)(arg)
+                    if result is not None:
+                        value = float(result)
+        except (serial.SerialException, ValueError):
+            self._reply(addr, seq, ERROR)
+            return
+        self.commands_executed += count
+        self._reply(addr, seq, OK, value)
+
+    def _expire(self, now):
+        """
+        Drops silent subscribers and stops the motors of an expired lease.
+        """
+        with self._lock:
+            for addr, seen in list(self.subscribers.items()):
+                if now - seen > self.subscriber_timeout:
+                    del self.subscribers[addr]
+        if self.lease_holder is not None and now >= self.lease_expiry:
+            self.lease_holder = None
+            self.heli.reset_all()
+
+    def serve(self, stop_event):
+        """
+        Serves clients until stop_event is set.
+        """
+        if self.stream:
+            self.heli.on_sample = self.publish
+            self.heli.start_stream()
+        next_poll = time.time()
+        try:
+            while not stop_event.is_set():
+                timeout = 0.1
+                if not self.stream:
+                    timeout = max(0.0, next_poll - time.time())
+                readable = select.select([self.sock], [], [], timeout)[0]
+                now = time.time()
+                if readable:
+                    msg, addr = self.sock.recvfrom(512)
+                    try:
+                        self.handle(msg, addr, now)
+                    except struct.error:
+                        # Truncated message
+                        pass
+                if not self.stream and now >= next_poll:
+                    self.publish(self.heli.read_sensor())
+                    next_poll = max(next_poll + self.period, now)
+                self._expire(now)
+        finally:
+            self.heli.on_sample = None
+            self.heli.reset_all()
+            self.heli.close()
+            self.sock.close()
+
+
+class BrokerHeli(object):
+    """
+    Client of a HeliBroker with the API of Heli. The motor commands of a
+    batch are sent in one message. The lease is taken when the client is
+    created (lease=True) and renewed in the background until close().
+    """
+
+    def __init__(self, address=DEFAULT_ADDRESS, lease=True, lease_time=1.0,
+                 timeout=2.0):
+        """
+        -------------
+        :param address: (host, port) of the broker or a "host:port" string
+        :param lease: take the actuator lease, False to only watch
+        :param lease_time: lease time in s, renewed every third of it
+        :param timeout: time to wait for replies and for the first sample
+        """
+        if isinstance(address, str):
+            address = parse_address(address)
+        self.address = address
+        self.timeout = timeout
+        self.lease_time = lease_time
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((address[0], 0))
+        self.seq = 0
+        self.samples_received = 0
+        self.samples_lost = 0
+        self._sample = None
+        self._sample_seq = None
+        self._sample_ready = threading.Event()
+        self._replies = Queue.Queue()
+        self._waiting = None
+        self._request_lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._batch = None
+        self._batch_depth = 0
+        self._leased = False
+        self._stop = threading.Event()
+        self._receiver = threading.Thread(target=self._receive_loop)
+        self._receiver.daemon = True
+        self._receiver.start()
+        self._send(SUBSCRIBE)
+        if lease and not self.acquire_lease():
+            self.close()
+            raise IOError("the broker lease is held by another client")
+
+    def _send(self, kind, body=b"", wait=False):
+        # Also called by the receiver thread for the keepalives. With wait
+        # the receiver keeps the reply to this seq, it drops all others
+        with self._send_lock:
+            self.seq += 1
+            if wait:
+                self._waiting = self.seq
+            self.sock.sendto(HEADER.pack(kind, self.seq) + body, self.address)
+            return self.seq
+
+    def _request(self, kind, body=b""):
+        """
+        Sends a request and waits for its reply
+        -------------
+        :return value: (status, value), (ERROR, 0.0) on timeout
+        """
+        with self._request_lock:
+            seq = self._send(kind, body, wait=True)
+            deadline = time.time() + self.timeout
+            try:
+                while True:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return ERROR, 0.0
+                    try:
+                        reply_seq, status, value = self._replies.get(
+                            timeout=remaining)
+                    except Queue.Empty:
+                        return ERROR, 0.0
+                    if reply_seq == seq:
+                        return status, value
+            finally:
+                self._waiting = None
+
+    def _receive_loop(self):
+        renew = time.time()
+        while not self._stop.is_set():
+            if time.time() >= renew:
+                # Keepalive of the subscription and the lease
+                renew = time.time() + self.lease_time / 3.0
+                self._send(SUBSCRIBE)
+                if self._leased:
+                    self._send(LEASE, LEASE_TIME.pack(self.lease_time))
+            readable = select.select([self.sock], [], [],
+                                     self.lease_time / 3.0)[0]
+            if not readable:
+                continue
+            try:
+                msg = self.sock.recv(512)
+            except socket.error:
+                continue
+            if len(msg) < HEADER.size:
+                continue
+            kind, seq = HEADER.unpack_from(msg)
+            if kind == SAMPLE_MSG:
+                fields = SAMPLE.unpack_from(msg, HEADER.size)
+                if self._sample_seq is not None and seq > self._sample_seq + 1:
+                    self.samples_lost += seq - self._sample_seq - 1
+                self._sample_seq = seq
+                self._sample = IMUSample(fields[1], fields[2], fields[3],
+                                         fields[0])
+                self.samples_received += 1
+                self._sample_ready.set()
+            elif kind == REPLY_MSG and seq == self._waiting:
+                self._replies.put((seq,) + REPLY.unpack_from(msg, HEADER.size))
+
+    def acquire_lease(self):
+        """
+        Takes the actuator lease
+        -------------
+        :return value: True if the lease was granted
+        """
+        status, value = self._request(LEASE, LEASE_TIME.pack(self.lease_time))
+        self._leased = status == OK
+        return self._leased
+
+    def release_lease(self):
+        if self._leased:
+            self._leased = False
+            self._request(RELEASE)
+
+    def _command(self, name, arg=0.0):
+        record = COMMAND.pack(METHOD_CODES[name], float(arg))
+        if self._batch is not None:
+            self._batch.append(record)
+            return None
+        status, value = self._request(COMMANDS, record)
+        if status != OK:
+            return None
+        return value
+
+    def begin_batch(self):
+        if self._batch_depth == 0:
+            self._batch = []
+        self._batch_depth += 1
+
+    def commit(self):
+        if self._batch_depth == 0:
+            return
+        self._batch_depth -= 1
+        if self._batch_depth > 0:
+            return
+        records = self._batch
+        self._batch = None
+        if records:
+            self._request(COMMANDS, b"".join(records))
+
+    @contextmanager
+    def batch(self):
+        self.begin_batch()
+        try:
+            yield self
+        finally:
+            self.commit()
+
+    def set_motor_speed_5v(self, percentage):
+        self._command("set_motor_speed_5v", percentage)
+
+    def set_motor_speed_12v(self, percentage):
+        self._command("set_motor_speed_12v", percentage)
+
+    def set_5v_motor_sleep_state(self, state):
+        self._command("set_5v_motor_sleep_state", bool(state))
+
+    def set_12v_motor_sleep_state(self, state):
+        self._command("set_12v_motor_sleep_state", bool(state))
+
+    def reset_all(self):
+        self._command("reset_all")
+
+    def check_5v_motor_fault(self):
+        value = self._command("check_5v_motor_fault")
+        if value is None:
+            return None
+        return int(value)
+
+    def read_sensor(self):
+        """
+        Returns the newest published sample, an IMUSample stamped with the
+        broker time.
+        """
+        self._sample_ready.wait(self.timeout)
+        return self._sample
+
+    def read_sensor_data(self):
+        return self.read_sensor()
+
+    def close(self):
+        """
+        Releases the lease and the subscription. The broker keeps the port.
+        """
+        if self._stop.is_set():
+            return
+        self.release_lease()
+        self._send(UNSUBSCRIBE)
+        self._stop.set()
+        self._receiver.join(self.timeout)
+        self.sock.close()
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Share the helicopter '
+                                     'link between local processes')
+    parser.add_argument('--config_file', help='Platform configuration file name',
+                        default='platform.cfg')
+    parser.add_argument('--address', default='%s:%d' % DEFAULT_ADDRESS,
+                        help='host:port the broker listens on')
+    parser.add_argument('--stream', action='store_true',
+                        help='Publish the samples streamed by the board')
+    parser.add_argument('--period', type=float, default=0.01,
+                        help='Sensor polling period without --stream')
+    parser.add_argument('--virtual', action='store_true',
+                        help='Use the simulated helicopter')
+    args = parser.parse_args()
+
+    if args.virtual:
+        from virtual_heli import VirtualArduino
+        heli = Heli(None, sr=VirtualArduino(speed=1.0), binary=True)
+        heli.sensor_delay = 0.0
+    else:
+        config = ConfigParser.RawConfigParser()
+        config.read(args.config_file)
+        heli = Heli(config.get('Motors', 'port'), binary=True)
+
+    stop_flag = threading.Event()
+    broker = HeliBroker(heli, parse_address(args.address), args.stream,
+                        args.period)
+    print('Broker listening on %s:%d' % broker.address)
+    try:
+        broker.serve(stop_flag)
+    except KeyboardInterrupt:
+        print('Stopping broker...')
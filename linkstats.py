@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+"""
+Opt-in instrumentation of the pyno transport.
+
+LinkStats keeps, for every command type, the number of commands, the bytes
+sent and received, the timeouts, the replies that could not be parsed and
+a latency histogram. Commands with a reply (dr, ar, sd) are timed from the
+write of the request to the parsed reply, the others from the write to the
+end of the flush. Commands sent together by a batch are counted per
+command, the write of the whole batch is timed under "batch".
+
+The histograms are log-linear, as in HdrHistogram: values are counted in
+buckets whose width doubles every sub_buckets / 2 buckets, so the relative
+error is the same from microseconds to seconds and the memory is fixed.
+
+    board = Arduino(port="/dev/ttyACM0", stats=True)
+    board.stats.start_dump("link.jsonl", interval=10.0)
+    ...
+    print board.stats.snapshot()["commands"]["sd"]["p99"]
+"""
+
+import json
+import threading
+import time
+from array import array
+
+from scheduler import monotonic
+
+COMMANDS = ("dw", "aw", "pm", "dr", "ar", "sd")
+# Commands timed until their reply is parsed
+REPLY_COMMANDS = ("dr", "ar", "sd")
+BATCH = "batch"
+PERCENTILES = (50.0, 90.0, 99.0, 99.9)
+
+
+class LatencyHistogram(object):
+    """
+    Log-linear histogram of durations between lowest and highest seconds.
+    Durations below lowest count as lowest, above highest as highest.
+    """
+
+    def __init__(self, lowest=1e-6, highest=10.0, sub_buckets=32):
+        """
+        -------------
+        :param lowest: resolution in seconds
+        :param highest: largest duration told apart, in seconds
+        :param sub_buckets: buckets per doubling of the duration, times two;
+                            a power of two, the relative error is at most
+                            2 / sub_buckets
+        """
+        if sub_buckets < 2 or sub_buckets & (sub_buckets - 1):
+            raise ValueError("sub_buckets must be a power of two")
+        self.lowest = lowest
+        self.highest = highest
+        self.sub_buckets = sub_buckets
+        self._sub_bits = sub_buckets.bit_length() - 1
+        self._half = sub_buckets // 2
+        self._top = int(highest / lowest)
+        self.counts = array('L', [0]) * (self._index(self._top) + 1)
+        self.reset()
+
+    def _index(self, units):
+        if units < self.sub_buckets:
+            return units
+        shift = units.bit_length() - self._sub_bits
+        return (self.sub_buckets + (shift - 1) * self._half
+                + (units >> shift) - self._half)
+
+    def _lower(self, index):
+        """
+        Smallest duration in units of lowest counted in bucket index, and
+        the width of the bucket.
+        """
+        if index < self.sub_buckets:
+            return index, 1
+        shift, sub = divmod(index - self.sub_buckets, self._half)
+        shift += 1
+        return (sub + self._half) << shift, 1 << shift
+
+    def record(self, seconds):
+        units = int(seconds / self.lowest)
+        if units > self._top:
+            units = self._top
+        elif units < 0:
+            units = 0
+        self.counts[self._index(units)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds < self.min:
+            self.min = seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p):
+        """
+        Duration below which p percent of the recorded durations lie,
+        the middle of the bucket it falls in, None if nothing was recorded.
+        """
+        if not self.count:
+            return None
+        rank = max(1, int(round(p / 100.0 * self.count)))
+        seen = 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                lower, width = self._lower(index)
+                value = (lower + 0.5 * width) * self.lowest
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def snapshot(self):
+        """
+        Returns a dict with count, mean, min, max, the PERCENTILES as p50,
+        p90, p99, p99.9 and the non-empty buckets as [lower bound, count].
+        """
+        result = {"count": self.count,
+                  "mean": self.total / self.count if self.count else None,
+                  "min": self.min if self.count else None,
+                  "max": self.max if self.count else None,
+                  "buckets": [[self._lower(index)[0] * self.lowest, n]
+                              for index, n in enumerate(self.counts) if n]}
+        for p in PERCENTILES:
+            result["p%g" % p] = self.percentile(p)
+        return result
+
+    def reset(self):
+        for index in range(len(self.counts)):
+            self.counts[index] = 0
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+
+
+class CommandStats(object):
+    """
+    Counters and latency histogram of one command type.
+    """
+
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.timeouts = 0
+        self.parse_failures = 0
+        self.latency.reset()
+
+    def snapshot(self):
+        result = self.latency.snapshot()
+        result.update(commands=self.count, bytes_sent=self.bytes_sent,
+                      bytes_received=self.bytes_received,
+                      timeouts=self.timeouts,
+                      parse_failures=self.parse_failures)
+        return result
+
+
+class LinkStats(object):
+    """
+    Statistics of one link, updated by Arduino when it was created with
+    stats=True. Updates and snapshots may come from different threads.
+    """
+
+    def __init__(self, commands=COMMANDS):
+        self._lock = threading.Lock()
+        self.commands = dict((cmd, CommandStats())
+                             for cmd in tuple(commands) + (BATCH, ))
+        self.started = time.time()
+        self._dump_stop = None
+        self._dump_thread = None
+
+    def _get(self, cmd):
+        stats = self.commands.get(cmd)
+        if stats is None:
+            # e.g. ss, version or bin
+            stats = self.commands[cmd] = CommandStats()
+        return stats
+
+    def sent(self, cmd, size, latency=None):
+        """
+        Counts a command of size bytes, written in latency seconds if it
+        was written on its own and has no reply.
+        """
+        with self._lock:
+            stats = self._get(cmd)
+            stats.count += 1
+            stats.bytes_sent += size
+            if latency is not None:
+                stats.latency.record(latency)
+
+    def batch(self, size, latency):
+        """
+        Times the write of a batch, its commands are counted by sent.
+        """
+        with self._lock:
+            stats = self.commands[BATCH]
+            stats.count += 1
+            stats.bytes_sent += size
+            stats.latency.record(latency)
+
+    def replied(self, cmd, size, latency, complete=True, parsed=True):
+        """
+        Records a reply of size bytes received latency seconds after its
+        request was written. An incomplete reply counts as a timeout, a
+        complete one that could not be parsed as a parse failure.
+        """
+        with self._lock:
+            stats = self._get(cmd)
+            stats.bytes_received += size
+            if not complete:
+                stats.timeouts += 1
+            elif not parsed:
+                stats.parse_failures += 1
+            else:
+                stats.latency.record(latency)
+
+    def timeout(self, cmd):
+        """
+        Counts a write timeout.
+        """
+        with self._lock:
+            self._get(cmd).timeouts += 1
+
+    def snapshot(self, reset=False):
+        """
+        Returns the statistics as a dict of plain values
+        -------------
+        :param reset: start new statistics after taking the snapshot
+        :return value: {"time", "since", "commands": {cmd: dict}} with the
+                       dicts of CommandStats.snapshot
+        """
+        with self._lock:
+            now = time.time()
+            result = {"time": now, "since": self.started,
+                      "commands": dict((cmd, stats.snapshot())
+                                       for cmd, stats in self.commands.items()
+                                       if stats.count or stats.timeouts)}
+            if reset:
+                self._reset(now)
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._reset(time.time())
+
+    def _reset(self, now):
+        for stats in self.commands.values():
+            stats.reset()
+        self.started = now
+
+    def dump(self, path, reset=False):
+        """
+        Appends a snapshot to path as one line of JSON.
+        """
+        line = json.dumps(self.snapshot(reset), sort_keys=True)
+        with open(path, "a") as f:
+            f.write(line + "\n")
+
+    def start_dump(self, path, interval=10.0, reset=True):
+        """
+        Dumps a snapshot every interval seconds from a background thread
+        -------------
+        :param reset: every line covers only its own interval
+        """
+        self.stop_dump()
+        self._dump_stop = threading.Event()
+        self._dump_thread = threading.Thread(
+            target=self._dump_loop, args=(path, interval, reset,
+                                          self._dump_stop))
+        self._dump_thread.daemon = True
+        self._dump_thread.start()
+
+    def _dump_loop(self, path, interval, reset, stop):
+        deadline = monotonic() + interval
+        while not stop.wait(max(0.0, deadline - monotonic())):
+            self.dump(path, reset)
+            deadline += interval
+
+    def stop_dump(self):
+        if self._dump_thread is not None:
+            self._dump_stop.set()
+            self._dump_thread.join()
+            self._dump_thread = None
@@ -0,0 +1,326 @@
+#!/usr/bin/env python
+"""
+Runs one controller per helicopter rig for several rigs from one process.
+
+The rigs are listed in a config file, one section per rig:
+
+    [Controller]
+    Td = 0.05
+
+    [rig:left]
+    port = /dev/ttyACM0
+    controller = pi
+
+    [rig:right]
+    port = /dev/ttyACM1
+    controller = fuzzy
+    config_file = fuzzy.cfg
+    theta_ref = 10.0
+
+Every board streams its IMU frames (Arduino.start_stream without a reader
+thread). Instead of one thread per rig, a single select() loop over the
+serial ports hands the received bytes to Arduino.feed while the shared
+PeriodicScheduler waits for its next deadline. On every tick each rig's
+controller runs its update() on the newest sample and sends its motor
+commands in one batched write. Ports without a file descriptor (port =
+virtual, a VirtualArduino running in real time) are polled.
+
+    python multirig.py rigs.cfg --duration 60 --report 5
+"""
+
+import argparse
+import ConfigParser
+import select
+import threading
+import time
+
+import serial
+
+import controller_PI
+import controller_fuzzy_template
+from pyheli import Heli
+from scheduler import PeriodicScheduler, SKIP, monotonic
+from virtual_heli import VirtualArduino
+
+CONTROLLERS = {"pi": controller_PI.Controller,
+               "fuzzy": controller_fuzzy_template.Controller}
+RIG_PREFIX = "rig:"
+# Longest wait between two polls of ports that cannot be selected
+POLL_INTERVAL = 0.002
+
+
+class Rig(object):
+    """
+    One helicopter: its link, its controller and their statistics.
+    """
+
+    def __init__(self, name, heli):
+        self.name = name
+        self.heli = heli
+        self.controller = None
+        self.selectable = hasattr(heli.sr, "fileno")
+        self.bytes_received = 0
+        self.reads = 0
+        self.steps = 0
+        self.stale = 0
+        self.missing = 0
+        self.errors = 0
+        self.step_time = 0.0
+        self.max_step_time = 0.0
+        self._last_samples = 0
+
+    def fileno(self):
+        return self.heli.sr.fileno()
+
+    def receive(self):
+        """
+        Reads whatever the board has sent and feeds it to the link.
+        """
+        waiting = self.heli.sr.in_waiting
+        if waiting:
+            data = self.heli.sr.read(waiting)
+            self.reads += 1
+            self.bytes_received += len(data)
+            self.heli.feed(data)
+
+    def step(self):
+        """
+        One controller step on the newest sample.
+        """
+        start = monotonic()
+        if self.heli.stream_samples == self._last_samples:
+            # No new sample since the last step
+            self.stale += 1
+        self._last_samples = self.heli.stream_samples
+        if not self._last_samples:
+            # No sample has arrived yet, read_sensor() would return None
+            self.missing += 1
+        else:
+            try:
+                self.controller.update()
+            except (serial.SerialException, ValueError):
+                # A lost link must not stop the other rigs
+                self.errors += 1
+        elapsed = monotonic() - start
+        self.steps += 1
+        self.step_time += elapsed
+        self.max_step_time = max(self.max_step_time, elapsed)
+
+    def stats(self):
+        return {"steps": self.steps,
+                "stale": self.stale,
+                "missing": self.missing,
+                "errors": self.errors,
+                "mean_step_time": self.step_time / self.steps
+                if self.steps else None,
+                "max_step_time": self.max_step_time,
+                "samples": self.heli.stream_samples,
+                "bytes_received": self.bytes_received,
+                "reads": self.reads,
+                "commands_sent": self.heli.commands_sent,
+                "commands_skipped": self.heli.commands_skipped}
+
+
+class RigManager(object):
+
+    def __init__(self, config_file, log=False, stop_event=None):
+        """
+        Opens every rig of the config file and starts their controllers
+        -------------
+        :param config_file: file with [Controller] Td and one [rig:name]
+                            section per rig
+        :param log: write a binary log per controller
+        :param stop_event: threading.Event that ends run() when set
+        """
+        self.stopped = stop_event or threading.Event()
+        config = ConfigParser.RawConfigParser()
+        config.read(config_file)
+        self.Td = config.getfloat('Controller', 'Td')
+        policy = SKIP
+        if config.has_option('Controller', 'overrun'):
+            policy = config.get('Controller', 'overrun')
+        self.scheduler = PeriodicScheduler(self.Td, policy, self.stopped,
+                                           sleep=self.poll)
+
+        self.rigs = []
+        sections = [s for s in config.sections() if s.startswith(RIG_PREFIX)]
+        if not sections:
+            raise ValueError("no [%s...] sections in %s"
+                             % (RIG_PREFIX, config_file))
+        try:
+            for section in sections:
+                self.rigs.append(self.open_rig(section[len(RIG_PREFIX):],
+                                               config, section))
+            self._selectable = [rig for rig in self.rigs if rig.selectable]
+            self._polled = [rig for rig in self.rigs if not rig.selectable]
+            # The controllers read a first sample when they are created
+            self.wait_for_samples()
+            for section, rig in zip(sections, self.rigs):
+                self.start_controller(rig, config, section, config_file, log)
+        except:
+            self.close()
+            raise
+
+    def open_rig(self, name, config, section):
+        """
+        Opens the link of one rig, streaming without a reader thread.
+        """
+        port = config.get(section, 'port')
+        if port == 'virtual':
+            heli = Heli(None, sr=VirtualArduino(speed=1.0), binary=True)
+        else:
+            heli = Heli(port, binary=True)
+        heli.start_stream(reader=False)
+        return Rig(name, heli)
+
+    def start_controller(self, rig, config, section, config_file, log):
+        """
+        Creates the controller of a rig on its Heli.
+        """
+        kind = 'pi'
+        if config.has_option(section, 'controller'):
+            kind = config.get(section, 'controller')
+        if kind not in CONTROLLERS:
+            raise ValueError("unknown controller %s of rig %s" % (kind, rig.name))
+        rig_config = config_file
+        if config.has_option(section, 'config_file'):
+            rig_config = config.get(section, 'config_file')
+        # The controllers are stepped by the manager, not run as threads
+        rig.controller = CONTROLLERS[kind](threading.Event(), rig_config,
+                                           log=log, heli=rig.heli)
+        theta_ref = phi_ref = 0.0
+        if config.has_option(section, 'theta_ref'):
+            theta_ref = config.getfloat(section, 'theta_ref')
+        if config.has_option(section, 'phi_ref'):
+            phi_ref = config.getfloat(section, 'phi_ref')
+        rig.controller.set_ref([theta_ref], [phi_ref])
+        if config.has_option(section, 'enable') and \
+                config.getboolean(section, 'enable'):
+            rig.heli.set_12v_motor_sleep_state(True)
+            rig.heli.set_5v_motor_sleep_state(True)
+
+    def poll(self, timeout):
+        """
+        Serves the incoming data of all rigs for timeout seconds, used by
+        the scheduler to wait for its next deadline.
+        """
+        end = monotonic() + timeout
+        while True:
+            remaining = end - monotonic()
+            if remaining <= 0:
+                return
+            if self._polled:
+                remaining = min(remaining, POLL_INTERVAL)
+            if self._selectable:
+                readable = select.select(self._selectable, [], [],
+                                         remaining)[0]
+            else:
+                time.sleep(remaining)
+                readable = []
+            for rig in readable:
+                rig.receive()
+            for rig in self._polled:
+                rig.receive()
+
+    def wait_for_samples(self, timeout=2.0):
+        """
+        Serves the links until every rig has streamed a sample.
+        """
+        end = monotonic() + timeout
+        while any(rig.heli.stream_samples == 0 for rig in self.rigs):
+            if monotonic() > end:
+                missing = [rig.name for rig in self.rigs
+                           if rig.heli.stream_samples == 0]
+                raise IOError("no IMU data from rig(s) %s" % ", ".join(missing))
+            self.poll(POLL_INTERVAL)
+
+    def step(self):
+        for rig in self.rigs:
+            rig.step()
+
+    def run(self, report=None):
+        """
+        Runs the controllers until the stop event is set
+        -------------
+        :param report: print the statistics every report seconds
+        """
+        step = self.step
+        if report:
+            next_report = [monotonic() + report]
+
+            def step():
+                self.step()
+                if monotonic() >= next_report[0]:
+                    next_report[0] += report
+                    print_stats(self.stats())
+        try:
+            self.scheduler.run(step)
+        finally:
+            self.close()
+
+    def stats(self):
+        """
+        Returns (scheduler statistics, dict of rig name -> rig statistics).
+        """
+        return (self.scheduler.stats(),
+                dict((rig.name, rig.stats()) for rig in self.rigs))
+
+    def close(self):
+        """
+        Stops the motors and closes the links and the logs of all rigs.
+        """
+        for rig in self.rigs:
+            if not rig.heli.sr.isOpen():
+                continue
+            try:
+                rig.heli.reset_all()
+                rig.heli.close()
+            except serial.SerialException:
+                pass
+            if getattr(rig.controller, 'logger', None) is not None:
+                rig.controller.logger.close()
+                rig.controller.logger = None
+
+
+def print_stats(stats):
+    loop, rigs = stats
+    print('loop: %d steps, %d overruns, %d skipped, jitter %.2f ms, '
+          'max lateness %.2f ms' % (loop['steps'], loop['overruns'],
+                                    loop['skipped'], loop['jitter'] * 1e3,
+                                    loop['max_lateness'] * 1e3))
+    for name in sorted(rigs):
+        r = rigs[name]
+        print('  %-10s %6d steps %5d stale %4d missing %4d errors  '
+              'step %.2f/%.2f ms  '
+              '%d samples %d bytes in %d reads  %d commands (%d skipped)'
+              % (name, r['steps'], r['stale'], r['missing'], r['errors'],
+                 (r['mean_step_time'] or 0.0) * 1e3,
+                 r['max_step_time'] * 1e3, r['samples'],
+                 r['bytes_received'], r['reads'], r['commands_sent'],
+                 r['commands_skipped']))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Control several rigs '
+                                     'from one process')
+    parser.add_argument('config_file', help='Rig configuration file')
+    parser.add_argument('--duration', type=float, default=None,
+                        help='Stop after this many seconds')
+    parser.add_argument('--report', type=float, default=None,
+                        help='Print the statistics every REPORT seconds')
+    parser.add_argument('--log', action='store_true',
+                        help='Write a binary log per rig')
+    args = parser.parse_args()
+
+    stop_flag = threading.Event()
+    manager = RigManager(args.config_file, log=args.log, stop_event=stop_flag)
+    if args.duration:
+        timer = threading.Timer(args.duration, stop_flag.set)
+        timer.daemon = True
+        timer.start()
+    try:
+        manager.run(args.report)
+    except KeyboardInterrupt:
+        print('Stopping rigs...')
+    print_stats(manager.stats())
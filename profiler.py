@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""
+Stage-level timing of a control step.
+
+The controllers split update() into stages and call mark() at the end of
+each one. The duration of every stage is kept for the last window steps in
+preallocated arrays, so profiling a step does not allocate, and the
+rolling p50/p99/max are computed only when stats() is called:
+
+    profiler = StageProfiler()
+    profiler.start()
+    sample = heli.read_sensor_data()
+    profiler.mark(SENSOR)
+    ...
+    profiler.mark(LOG)
+    print profiler.report()
+
+With profiling off the controllers keep profiler = None and only test for
+it, which costs a few attribute checks per step.
+"""
+
+from array import array
+
+from scheduler import monotonic
+
+# Stages of Controller.update, in order
+STAGES = ("sensor", "law", "actuate", "log")
+SENSOR, LAW, ACTUATE, LOG = range(len(STAGES))
+
+
+class StageProfiler(object):
+
+    def __init__(self, stages=STAGES, window=1000, clock=monotonic):
+        """
+        -------------
+        :param stages: names of the stages, marked by their index
+        :param window: number of steps the statistics are taken over
+        :param clock: monotonic time source in seconds
+        """
+        self.stages = tuple(stages)
+        self.window = window
+        self.clock = clock
+        self.times = [array('d', [0.0]) * window for stage in self.stages]
+        # Durations of the stages of the current step
+        self.last = array('d', [0.0]) * len(self.stages)
+        self.steps = 0
+        self._slot = 0
+        self._mark = 0.0
+
+    def start(self):
+        """
+        Starts the first stage of a step.
+        """
+        self._mark = self.clock()
+
+    def mark(self, stage):
+        """
+        Ends a stage, the next one starts now. Marking the last stage
+        completes the step.
+        """
+        now = self.clock()
+        elapsed = now - self._mark
+        self._mark = now
+        self.last[stage] = elapsed
+        self.times[stage][self._slot] = elapsed
+        if stage == len(self.stages) - 1:
+            self.steps += 1
+            self._slot += 1
+            if self._slot == self.window:
+                self._slot = 0
+
+    def stats(self):
+        """
+        Rolling statistics over the last window steps
+        -------------
+        :return value: dict of stage name (and "total") -> dict with p50,
+                       p99 and max in seconds, None before the first step
+        """
+        n = min(self.steps, self.window)
+        if n == 0:
+            return None
+        columns = [times[:n] if n < self.window else times
+                   for times in self.times]
+        totals = [sum(step) for step in zip(*columns)]
+        result = {}
+        for name, values in zip(self.stages + ("total", ),
+                                columns + [totals]):
+            values = sorted(values)
+            result[name] = {"p50": values[(n - 1) // 2],
+                            "p99": values[min(n - 1, int(0.99 * n))],
+                            "max": values[-1]}
+        return result
+
+    def report(self):
+        """
+        Returns the statistics as a table in milliseconds.
+        """
+        stats = self.stats()
+        if stats is None:
+            return "no steps profiled"
+        lines = ["%-8s %8s %8s %8s" % ("stage", "p50", "p99", "max")]
+        for name in self.stages + ("total", ):
+            s = stats[name]
+            lines.append("%-8s %8.3f %8.3f %8.3f" % (
+                name, s["p50"] * 1e3, s["p99"] * 1e3, s["max"] * 1e3))
+        lines.append("over the last %d of %d steps (ms)"
+                     % (min(self.steps, self.window), self.steps))
+        return "\n".join(lines)
+
+    def reset(self):
+        for times in self.times:
+            for k in range(self.window):
+                times[k] = 0.0
+        self.steps = 0
+        self._slot = 0
@@ -30,11 +30,22 @@ def ang2per(angle):
 
 class Heli(Arduino):
 
-    def __init__(self, port):
+    def __init__(self, port, **kwargs):
         """
         Initialises the motors and parameters used for heli control
+
+        Keyword arguments (e.g. binary=True) are passed on to Arduino.
         """
-        super(Heli, self).__init__(port=port)
+        super(Heli, self).__init__(port=port, **kwargs)
+
+        #Shadow copy of the last commanded pin modes and outputs, used to
+        #skip writes that would not change the hardware state
+        self._shadow_mode = {}
+        self._shadow_out = {}
+        #write_timeouts when the board was last known to match the shadow
+        self._shadow_timeouts = self.write_timeouts
+        self.commands_sent = 0
+        self.commands_skipped = 0
 
         #Initialization of 5V motor pins
         self.motor_5v_sleep = 4
@@ -48,15 +59,15 @@ class Heli(Arduino):
         self.motor_12v_in2 = 10
 
         #5V motor initialization
-        Arduino.pin_mode(self, self.motor_5v_sleep, "OUTPUT")
-        Arduino.pin_mode(self, self.motor_5v_in1, "OUTPUT")
-        Arduino.pin_mode(self, self.motor_5v_in2, "OUTPUT")
-        Arduino.pin_mode(self, self.motor_5v_fault, "INPUT")
+        self._pin_mode(self.motor_5v_sleep, "OUTPUT")
+        self._pin_mode(self.motor_5v_in1, "OUTPUT")
+        self._pin_mode(self.motor_5v_in2, "OUTPUT")
+        self._pin_mode(self.motor_5v_fault, "INPUT")
 
         #12V motor initialization
-        Arduino.pin_mode(self, self.motor_12v_sleep, "OUTPUT")
-        Arduino.pin_mode(self, self.motor_12v_in1, "OUTPUT")
-        Arduino.pin_mode(self, self.motor_12v_in2, "OUTPUT")
+        self._pin_mode(self.motor_12v_sleep, "OUTPUT")
+        self._pin_mode(self.motor_12v_in1, "OUTPUT")
+        self._pin_mode(self.motor_12v_in2, "OUTPUT")
 
         #Initialization of 5v motor state
         self.state_5v_motor = False
@@ -64,6 +75,110 @@ class Heli(Arduino):
         #Initialization of 12v motor state
         self.state_12v_motor = False
 
+    def _check_shadow(self):
+        """
+        Resends the shadow copy if a write timed out since the last check,
+        on its own or in a batch: the board may not have reached the state
+        the shadow records, and skipping writes against it would keep it
+        there.
+        """
+        if self.write_timeouts != self._shadow_timeouts:
+            self._shadow_timeouts = self.write_timeouts
+            self.resync()
+
+    def _pin_mode(self, pin, val):
+        """
+        Sends pin_mode only if the mode of the pin differs from its shadow
+        """
+        self._check_shadow()
+        if self._shadow_mode.get(pin) == val:
+            self.commands_skipped += 1
+            return
+        self._shadow_mode[pin] = val
+        self.commands_sent += 1
+        Arduino.pin_mode(self, pin, val)
+
+    def _digital_write(self, pin, val):
+        """
+        Sends digital_write only if the pin is not already at that level
+        """
+        self._check_shadow()
+        if self._shadow_out.get(pin) == ("dw", val):
+            self.commands_skipped += 1
+            return
+        self._shadow_out[pin] = ("dw", val)
+        self.commands_sent += 1
+        Arduino.digital_write(self, pin, val)
+
+    def _analog_write(self, pin, val):
+        """
+        Sends analog_write only if the pin does not already output that PWM
+        """
+        val = min(max(val, 0), 255)
+        self._check_shadow()
+        if self._shadow_out.get(pin) == ("aw", val):
+            self.commands_skipped += 1
+            return
+        self._shadow_out[pin] = ("aw", val)
+        self.commands_sent += 1
+        Arduino.analog_write(self, pin, val)
+
+    def pin_mode(self, pin, val):
+        """
+        Sends pin_mode, also if the pin is already in that mode, and
+        records the mode in the shadow copy
+        """
+        self._check_shadow()
+        self._shadow_mode[pin] = val
+        self.commands_sent += 1
+        Arduino.pin_mode(self, pin, val)
+
+    def digital_write(self, pin, val):
+        """
+        Sends digital_write, also if the pin is already at that level, and
+        records the level in the shadow copy
+        """
+        self._check_shadow()
+        self._shadow_out[pin] = ("dw", val)
+        self.commands_sent += 1
+        Arduino.digital_write(self, pin, val)
+
+    def analog_write(self, pin, val):
+        """
+        Sends analog_write, also if the pin already outputs that PWM, and
+        records the PWM in the shadow copy
+        """
+        val = min(max(val, 0), 255)
+        self._check_shadow()
+        self._shadow_out[pin] = ("aw", val)
+        self.commands_sent += 1
+        Arduino.analog_write(self, pin, val)
+
+    def resync(self):
+        """
+        Resends every pin mode and output from the shadow copy, e.g. after
+        the board was reset, regardless of what was sent before.
+        """
+        with self.batch():
+            for pin, val in self._shadow_mode.items():
+                self.commands_sent += 1
+                Arduino.pin_mode(self, pin, val)
+            for pin, (cmd, val) in self._shadow_out.items():
+                self.commands_sent += 1
+                if cmd == "aw":
+                    Arduino.analog_write(self, pin, val)
+                else:
+                    Arduino.digital_write(self, pin, val)
+
+    def command_stats(self):
+        """
+        Returns the number of actuator commands sent to the board and the
+        number skipped because they would not change the hardware state
+        -------------
+        :return value: (sent, skipped)
+        """
+        return self.commands_sent, self.commands_skipped
+
     def set_5v_motor_sleep_state(self, state):
         """
         Sets the state of the 5v motor and sends the value to the uC
@@ -73,10 +188,10 @@ class Heli(Arduino):
 
         if state:
             self.state_5v_motor = True
-            Arduino.digital_write(self, self.motor_5v_sleep, "HIGH")
+            self._digital_write(self.motor_5v_sleep, "HIGH")
         elif not state:
             self.state_5v_motor = False
-            Arduino.digital_write(self, self.motor_5v_sleep, "LOW")
+            self._digital_write(self.motor_5v_sleep, "LOW")
 
     def check_5v_motor_fault(self):
         """
@@ -84,7 +199,7 @@ class Heli(Arduino):
         -------------
         :return value: returns a 0 when in fault, 1 when operational
         """
-        return Arduino.digital_read(self, self.motor_5v_fault)
+        return self.digital_read(self.motor_5v_fault)
 
     def set_12v_motor_sleep_state(self, state):
         """
@@ -94,10 +209,10 @@ class Heli(Arduino):
         """
         if state:
             self.state_12v_motor = True
-            Arduino.digital_write(self, self.motor_12v_sleep, "HIGH")
+            self._digital_write(self.motor_12v_sleep, "HIGH")
         elif not state:
             self.state_12v_motor = False
-            Arduino.digital_write(self, self.motor_12v_sleep, "LOW")
+            self._digital_write(self.motor_12v_sleep, "LOW")
 
     def set_motor_speed_5v(self, percentage):
         """
@@ -119,15 +234,17 @@ class Heli(Arduino):
 
         #sends the direction and value to the motor only if there is no fault
         #and the motor is not in sleep condition
-        if (percentage > 0) and self.state_5v_motor:  # and (self.check_5v_motor_fault()):
-            Arduino.analog_write(self, self.motor_5v_in1, per2val(percentage))
-            Arduino.digital_write(self, self.motor_5v_in2, "LOW")
-        elif percentage < 0 and self.state_5v_motor:  # and (self.check_5v_motor_fault()):
-            Arduino.analog_write(self, self.motor_5v_in2, per2val(-percentage))
-            Arduino.digital_write(self, self.motor_5v_in1, "LOW")
-        elif not self.state_5v_motor:
-            Arduino.digital_write(self, self.motor_5v_in1, "LOW")
-            Arduino.digital_write(self, self.motor_5v_in2, "LOW")
+        #both pins are sent in one batched write
+        with self.batch():
+            if (percentage > 0) and self.state_5v_motor:  # and (self.check_5v_motor_fault()):
+                self._analog_write(self.motor_5v_in1, per2val(percentage))
+                self._digital_write(self.motor_5v_in2, "LOW")
+            elif percentage < 0 and self.state_5v_motor:  # and (self.check_5v_motor_fault()):
+                self._analog_write(self.motor_5v_in2, per2val(-percentage))
+                self._digital_write(self.motor_5v_in1, "LOW")
+            elif not self.state_5v_motor:
+                self._digital_write(self.motor_5v_in1, "LOW")
+                self._digital_write(self.motor_5v_in2, "LOW")
 
     def set_motor_speed_12v(self, percentage):
         """
@@ -143,22 +260,25 @@ class Heli(Arduino):
         elif percentage < 0:
             percentage = 0
 
-        #sends the direction and value to the motor
-        if self.state_12v_motor:
-            Arduino.analog_write(self, self.motor_12v_in1, per2val(percentage))
-            Arduino.digital_write(self, self.motor_12v_in2, "LOW")
-        else:
-            Arduino.digital_write(self, self.motor_12v_in1, "LOW")
-            Arduino.digital_write(self, self.motor_12v_in2, "LOW")
+        #sends the direction and value to the motor in one batched write
+        with self.batch():
+            if self.state_12v_motor:
+                self._analog_write(self.motor_12v_in1, per2val(percentage))
+                self._digital_write(self.motor_12v_in2, "LOW")
+            else:
+                self._digital_write(self.motor_12v_in1, "LOW")
+                self._digital_write(self.motor_12v_in2, "LOW")
 
     def read_sensor_data(self):
         """
         Reads the data from the IMU
+        When the board is streaming (Heli(port, stream=True)) the newest
+        sample is returned without a serial round trip.
         -----------
         :return value: returns the sensor data roll, pitch, yaw
         """
 
-        data = Arduino.read_sensor(self)
+        data = self.read_sensor()
         # print data[0]
         # print data[1]
         # print data[2]
@@ -169,9 +289,10 @@ class Heli(Arduino):
         A function to reset all ports that control the motors
 
         """
-        if self.state_12v_motor:
-            self.set_12v_motor_sleep_state(0)
-        if self.state_5v_motor:
-            self.set_5v_motor_sleep_state(0)
-        self.set_motor_speed_12v(0)
-        self.set_motor_speed_5v(0)
+        with self.batch():
+            if self.state_12v_motor:
+                self.set_12v_motor_sleep_state(0)
+            if self.state_5v_motor:
+                self.set_5v_motor_sleep_state(0)
+            self.set_motor_speed_12v(0)
+            self.set_motor_speed_5v(0)
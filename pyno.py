@@ -3,8 +3,226 @@ __author__ = 'tratincica'
 
 
 import serial
+import struct
 import time
-import string
+import threading
+import collections
+import Queue
+from contextlib import contextmanager
+
+from linkstats import LinkStats, BATCH, REPLY_COMMANDS
+from scheduler import monotonic
+
+
+# Binary protocol
+# ---------------
+# Every binary frame starts with a sync byte and an opcode and ends with a
+# CRC-8 (polynomial 0x07) of all preceding bytes. Commands are fixed size:
+#   sync | opcode | pin (int8, negative for LOW/INPUT) | value (uint8) | crc
+# Integer replies (dr, ar):
+#   sync | opcode | value (uint16) | crc
+# IMU replies (sd), also pushed unrequested in streaming mode (ss):
+#   sync | opcode | roll, pitch, yaw (float32) | crc
+# All multi-byte fields are little endian.
+BIN_SYNC = 0xA5
+BIN_OPCODES = {"dw": 0x01, "dr": 0x02, "aw": 0x03, "ar": 0x04, "pm": 0x05,
+               "sd": 0x06, "ss": 0x07}
+BIN_CMD = struct.Struct("<BBbB")
+BIN_INT_REPLY = struct.Struct("<BBH")
+BIN_IMU_REPLY = struct.Struct("<BB3f")
+
+# Token in the version string by which the firmware advertises binary support
+BIN_CAPABILITY = "bin"
+
+# Link rate negotiation
+# ---------------------
+# Firmware that can change its baud rate lists every rate it supports in the
+# version string as a token "baud=<rate>". On @baud%<rate>$! it answers
+# "baud=<rate>" at the current rate and switches. If no valid command arrives
+# at the new rate within BAUD_CONFIRM_TIME it returns to the previous rate.
+BAUD_CAPABILITY = "baud="
+BAUD_CONFIRM_TIME = 1.0
+# Time the firmware needs to reconfigure its UART after the acknowledgement
+BAUD_SETTLE_TIME = 0.05
+
+
+def _crc8_table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            if crc & 0x80:
+                crc = ((crc << 1) ^ 0x07) & 0xFF
+            else:
+                crc = (crc << 1) & 0xFF
+        table.append(crc)
+    return table
+
+_CRC8_TABLE = _crc8_table()
+
+
+def crc8(data, start=0, end=None):
+    """
+    Computes the CRC-8 (polynomial 0x07) checksum of a binary frame.
+    -------------
+    :param data: frame bytes
+    :param start, end: checksummed part of data, by default all of it;
+                       a bytearray is checksummed in place
+    :return value: checksum as an integer from 0 to 255
+    """
+    if not isinstance(data, bytearray):
+        data = bytearray(data)
+    crc = 0
+    table = _CRC8_TABLE
+    if start == 0 and end is None:
+        for byte in data:
+            crc = table[crc ^ byte]
+        return crc
+    if end is None:
+        end = len(data)
+    for k in xrange(start, end):
+        crc = table[crc ^ data[k]]
+    return crc
+
+
+def build_cmd_bin(cmd, args=None):
+    """
+    Build a fixed size binary command frame that can be sent to the arduino.
+
+    Input:
+    :param cmd (str): the command to send, one of BIN_OPCODES
+    :param args (iterable): pin and, optionally, value of the command
+    """
+    pin = 0
+    val = 0
+    if args:
+        pin = args[0]
+        if len(args) > 1:
+            val = args[1]
+    frame = BIN_CMD.pack(BIN_SYNC, BIN_OPCODES[cmd], pin, val)
+    return frame + struct.pack("<B", crc8(frame))
+
+
+def parse_reply_bin(frame, reply):
+    """
+    Checks and unpacks a binary reply frame.
+    -------------
+    :param frame: raw bytes read from the serial port
+    :param reply: struct of the expected reply (BIN_INT_REPLY or BIN_IMU_REPLY)
+    -------------
+    :return value: tuple of payload fields or None for a corrupt frame
+    """
+    if len(frame) != reply.size + 1:
+        return None
+    if crc8(frame[:-1]) != bytearray(frame[-1:])[0]:
+        return None
+    fields = reply.unpack(frame[:-1])
+    if fields[0] != BIN_SYNC:
+        return None
+    return fields[2:]
+
+
+def parse_imu_frame(buf, t=None, offset=0):
+    """
+    Checks and unpacks an IMU frame in place, without copying it.
+    -------------
+    :param buf: bytearray holding the frame at offset
+    :param t: receive time of the frame
+    :return value: IMUSample, None for a corrupt or incomplete frame
+    """
+    size = BIN_IMU_REPLY.size + 1
+    if len(buf) - offset < size:
+        return None
+    # The CRC of a frame including its own checksum is 0
+    if len(buf) == size:
+        crc = crc8(buf)
+    else:
+        crc = crc8(buf, offset, offset + size)
+    if crc != 0:
+        return None
+    sync, opcode, roll, pitch, yaw = BIN_IMU_REPLY.unpack_from(buf, offset)
+    if sync != BIN_SYNC:
+        return None
+    return IMUSample(roll, pitch, yaw, t)
+
+
+def parse_capabilities(version):
+    """
+    Splits the version string reported by the firmware into capability tokens.
+    -------------
+    :param version: version string, e.g. "2.1 bin"
+    :return value: set of tokens, empty if the version is unknown
+    """
+    if not version:
+        return set()
+    return set(version.replace(",", " ").replace(";", " ").split())
+
+
+def parse_baud_rates(capabilities):
+    """
+    Collects the baud rates advertised among the capability tokens.
+    -------------
+    :param capabilities: set of tokens, see parse_capabilities
+    :return value: sorted list of baud rates, empty for older firmware
+    """
+    rates = []
+    for token in capabilities:
+        if token.startswith(BAUD_CAPABILITY):
+            try:
+                rates.append(int(token[len(BAUD_CAPABILITY):]))
+            except ValueError:
+                pass
+    return sorted(rates)
+
+
+def parse_imu_line(line, t=None):
+    """
+    Parses an IMU line of the form "!ANG:roll,pitch,yaw\r\n" into numbers.
+    Unlike parse_imu_frame this copies the fields: float() only takes
+    strings, and one split() is cheaper than slicing around find().
+    -------------
+    :param line: line read from the serial port
+    :param t: receive time of the line
+    :return value: IMUSample, None for invalid lines
+    """
+    if not line.startswith("!ANG:"):
+        return None
+    try:
+        # float() ignores the trailing \r\n
+        roll, pitch, yaw = line[5:].split(",")
+        return IMUSample(float(roll), float(pitch), float(yaw), t)
+    except ValueError:
+        return None
+
+
+class IMUSample(object):
+    """
+    One IMU reading: roll, pitch and yaw in degrees and the time t at which
+    it was received (time.time(), None if unknown). Indexing and iteration
+    give roll, pitch and yaw, like the lists returned by earlier versions,
+    so roll, pitch, yaw = sample keeps working.
+    """
+
+    __slots__ = ('roll', 'pitch', 'yaw', 't')
+
+    def __init__(self, roll, pitch, yaw, t=None):
+        self.roll = roll
+        self.pitch = pitch
+        self.yaw = yaw
+        self.t = t
+
+    def __getitem__(self, k):
+        return (self.roll, self.pitch, self.yaw)[k]
+
+    def __len__(self):
+        return 3
+
+    def __iter__(self):
+        return iter((self.roll, self.pitch, self.yaw))
+
+    def __repr__(self):
+        return "IMUSample(roll=%r, pitch=%r, yaw=%r, t=%r)" % (
+            self.roll, self.pitch, self.yaw, self.t)
 
 
 def build_cmd_str(cmd, args=None):
@@ -44,7 +262,9 @@ def get_version(sr):
 
 class Arduino(object):
 
-    def __init__(self, baud=9600, port="COM6", timeout=2, sr=None):
+    def __init__(self, baud=9600, port="COM6", timeout=2, sr=None,
+                 binary=False, stream=False, negotiate=False, max_baud=None,
+                 stats=False):
         """
         Initializes serial communication with Arduino if no connection is
         given.
@@ -53,15 +273,356 @@ class Arduino(object):
         :param port: Serial communication port
         :param timeout: Read timeout value
         :param sr: Serial communication variable
+        :param binary: use the binary protocol if the firmware supports it
+        :param stream: start continuous IMU streaming, see start_stream
+        :param negotiate: switch to the highest baud rate supported by both
+                          sides and probe the link, see negotiate_baud
+        :param max_baud: highest baud rate negotiate may choose
+        :param stats: record per command counters and latencies in
+                      self.stats, a linkstats.LinkStats
         """
         if not sr:
             sr = serial.Serial(port, baud, timeout=timeout)
         sr.flush()
         self.sr = sr
+        self._readinto = getattr(sr, "readinto", None)
+        #receive buffer of binary IMU frames, reused for every sample
+        self._imu_frame = bytearray(BIN_IMU_REPLY.size + 1)
+        #IMU lines and frames that could not be parsed
+        self.malformed_frames = 0
+        #writes that timed out, the commands are dropped
+        self.write_timeouts = 0
+        #optional transport statistics, and when the last request was written
+        self.stats = LinkStats() if stats else None
+        self._request_start = 0.0
+        self.binary = False
+        self.timeout = timeout
+        #time given to the board to answer a sensor request in ASCII mode
+        self.sensor_delay = 0.03
+        self._batch = None
+        self._batch_depth = 0
+        self.streaming = False
+        #IMU samples received in streaming mode
+        self.stream_samples = 0
+        #called with every streamed sample, e.g. to forward it
+        self.on_sample = None
+        #baud rate in use and the figures measured by probe_link
+        self.baudrate = getattr(sr, "baudrate", baud)
+        self.link_rtt = None
+        self.link_throughput = None
+        self.link_probe = None
+        if negotiate:
+            self.negotiate_baud(max_baud, probe=False)
+        if binary:
+            self.enable_binary()
+        if negotiate:
+            #measured in the protocol that will be used
+            self.probe_link()
+        if stream:
+            self.start_stream()
 
     def version(self):
         return get_version(self.sr)
 
+    def negotiate_baud(self, max_baud=None, probe=True):
+        """
+        Steps the link up to the highest baud rate that the firmware
+        advertises in its version string, trying lower ones if a switch is
+        not confirmed. Firmware without baud= tokens keeps the current rate.
+        Must be called before streaming is started.
+        -------------
+        :param max_baud: highest rate to try, e.g. the limit of a USB adapter
+        :param probe: measure the link at the chosen rate, see probe_link
+        :return value: baud rate in use
+        """
+        rates = parse_baud_rates(parse_capabilities(self.version()))
+        for rate in reversed(rates):
+            if rate <= self.baudrate:
+                break
+            if max_baud is not None and rate > max_baud:
+                continue
+            if self._switch_baud(rate):
+                break
+        if probe:
+            self.probe_link()
+        return self.baudrate
+
+    def _switch_baud(self, rate):
+        """
+        Switches both sides to rate and confirms the switch with a version
+        request at the new rate. On failure the host returns to the old rate
+        and waits until the firmware has done the same.
+        -------------
+        :return value: True if the link works at the new rate
+        """
+        old = self.baudrate
+        try:
+            version = self.version()
+            self.sr.write(build_cmd_str("baud", (rate, )))
+            self.sr.flush()
+            ack = self.sr.readline().strip()
+        except serial.SerialException:
+            return False
+        if ack != BAUD_CAPABILITY + str(rate):
+            return False
+        time.sleep(BAUD_SETTLE_TIME)
+        try:
+            self.sr.baudrate = rate
+            if self.version() == version:
+                self.baudrate = rate
+                return True
+            self.sr.baudrate = old
+        except (serial.SerialException, ValueError):
+            # The port driver does not accept the rate
+            self.sr.baudrate = old
+        time.sleep(BAUD_CONFIRM_TIME)
+        self._discard_input()
+        return False
+
+    def _discard_input(self):
+        reset = getattr(self.sr, "reset_input_buffer", None) or \
+            getattr(self.sr, "flushInput", None)
+        if reset is not None:
+            reset()
+
+    def probe_link(self, rounds=5, burst=10):
+        """
+        Measures the link: the round trip time of version requests and the
+        reply throughput of a burst of sensor requests sent in one write.
+        The burst is kept short so the commands fit into the receive buffer
+        of the firmware. Must not be called while streaming.
+        -------------
+        :param rounds: number of timed version requests
+        :param burst: number of sensor requests in the burst
+        :return value: dict with baudrate, rtt, rtt_min, rtt_max (s),
+                       throughput (received bytes per second), bytes_sent,
+                       bytes_received and utilization of the line rate
+        """
+        rtts = []
+        for k in range(rounds):
+            start = time.time()
+            if self.version():
+                rtts.append(time.time() - start)
+        rtts.sort()
+
+        data = self._build("sd") * burst
+        received = 0
+        start = time.time()
+        try:
+            self.sr.write(data)
+            self.sr.flush()
+            for k in range(burst):
+                if self.binary:
+                    reply = self.sr.read(BIN_IMU_REPLY.size + 1)
+                else:
+                    reply = self.sr.readline()
+                if not reply:
+                    break
+                received += len(reply)
+        except serial.SerialException:
+            pass
+        elapsed = time.time() - start
+
+        self.link_rtt = rtts[len(rtts) // 2] if rtts else None
+        self.link_throughput = received / elapsed if received else None
+        self.link_probe = {
+            "baudrate": self.baudrate,
+            "rtt": self.link_rtt,
+            "rtt_min": rtts[0] if rtts else None,
+            "rtt_max": rtts[-1] if rtts else None,
+            "throughput": self.link_throughput,
+            "bytes_sent": len(data),
+            "bytes_received": received,
+            # 8N1: ten bits on the line per byte
+            "utilization": self.link_throughput * 10.0 / self.baudrate
+            if self.link_throughput else None}
+        return self.link_probe
+
+    def enable_binary(self):
+        """
+        Switches to the binary protocol if the version handshake reports
+        that the firmware supports it, otherwise stays with ASCII commands.
+        -------------
+        :return value: True if the binary protocol is in use
+        """
+        if BIN_CAPABILITY in parse_capabilities(self.version()):
+            try:
+                self.sr.write(build_cmd_str("bin", (1, )))
+                self.sr.flush()
+                self.binary = True
+            except serial.SerialTimeoutException:
+                self.binary = False
+        return self.binary
+
+    def _build(self, cmd, args=None):
+        """
+        Builds a command in the active protocol.
+        """
+        if self.binary:
+            return build_cmd_bin(cmd, args)
+        return build_cmd_str(cmd, args)
+
+    def _send(self, cmd, args=None):
+        """
+        Writes one command in the active protocol, or queues it if a batch
+        is open.
+        """
+        cmd_str = self._build(cmd, args)
+        if self._batch is not None:
+            self._batch.append(cmd_str)
+            if self.stats is not None:
+                self.stats.sent(cmd, len(cmd_str))
+            return
+        self._write(cmd_str, cmd)
+
+    def _write_batch(self):
+        """
+        Sends the commands queued so far in a single write and flush.
+        """
+        if self._batch:
+            data = "".join(self._batch)
+            del self._batch[:]
+            self._write(data, BATCH)
+
+    def _write(self, data, cmd):
+        """
+        Writes and flushes data, counting write timeouts. With stats the
+        write is timed under cmd, a command name or BATCH.
+        """
+        stats = self.stats
+        if stats is not None:
+            start = self._request_start = monotonic()
+        try:
+            self.sr.write(data)
+            self.sr.flush()
+        except serial.SerialTimeoutException:
+            self.write_timeouts += 1
+            if stats is not None:
+                stats.timeout(cmd)
+            raise
+        if stats is not None:
+            latency = monotonic() - start
+            if cmd == BATCH:
+                stats.batch(len(data), latency)
+            elif cmd in REPLY_COMMANDS:
+                #timed until the reply is in, see _record_reply
+                stats.sent(cmd, len(data))
+            else:
+                stats.sent(cmd, len(data), latency)
+
+    def _record_reply(self, cmd, size, complete, parsed):
+        """
+        Records a reply in stats, timed from the write of the request.
+        """
+        self.stats.replied(cmd, size, monotonic() - self._request_start,
+                           complete, parsed)
+
+    def begin_batch(self):
+        """
+        Starts collecting commands instead of sending them one by one.
+        Batches can be nested, commands are sent by the outermost commit.
+        """
+        if self._batch_depth == 0:
+            self._batch = []
+        self._batch_depth += 1
+
+    def commit(self):
+        """
+        Closes a batch started with begin_batch. The outermost commit sends
+        all collected commands in one buffered write with one flush.
+        """
+        if self._batch_depth == 0:
+            return
+        self._batch_depth -= 1
+        if self._batch_depth > 0:
+            return
+        try:
+            self._write_batch()
+        except serial.SerialTimeoutException:
+            pass
+        finally:
+            self._batch = None
+
+    @contextmanager
+    def batch(self):
+        """
+        Context manager form of begin_batch/commit:
+
+            with board.batch():
+                board.analog_write(5, 100)
+                board.digital_write(6, "LOW")
+        """
+        self.begin_batch()
+        try:
+            yield self
+        finally:
+            self.commit()
+
+    def _read_reply(self, size=None):
+        """
+        Reads one reply: a line in ASCII mode or a frame of the given size in
+        binary mode. While streaming, replies are taken from the queue filled
+        by the reader thread.
+        """
+        if self.streaming:
+            try:
+                return self._replies.get(timeout=self.timeout)
+            except Queue.Empty:
+                return ""
+        if self.binary:
+            return self.sr.read(size)
+        return self.sr.readline()
+
+    def _read_into(self, buf, start, size):
+        """
+        Reads size bytes into buf[start:]. Ports with readinto fill the
+        buffer directly, others through one read.
+        -------------
+        :return value: number of bytes read
+        """
+        if self._readinto is not None:
+            if start == 0 and size == len(buf):
+                return self._readinto(buf)
+            return self._readinto(memoryview(buf)[start:start + size])
+        data = self.sr.read(size)
+        buf[start:start + len(data)] = data
+        return len(data)
+
+    def _read_int(self, cmd):
+        """
+        Reads an integer reply to cmd (dr or ar), 0 if it cannot be parsed.
+        """
+        if self.binary:
+            size = BIN_INT_REPLY.size + 1
+            reply = self._read_reply(size)
+            complete = len(reply) == size
+        else:
+            reply = self._read_reply()
+            complete = reply.endswith("\n")
+        value = self._parse_int(reply, None)
+        if self.stats is not None:
+            self._record_reply(cmd, len(reply), complete, value is not None)
+        if value is None:
+            if self.binary and not self.streaming:
+                self._discard_input()
+            return 0
+        return value
+
+    def _parse_int(self, reply, default=0):
+        """
+        Parses an integer reply in the active protocol, default if it is
+        invalid.
+        """
+        if self.binary:
+            fields = parse_reply_bin(reply, BIN_INT_REPLY)
+            if fields is None:
+                return default
+            return fields[0]
+        try:
+            return int(reply.replace("\r\n", ""))
+        except ValueError:
+            return default
+
     def digital_write(self, pin, val):
         """
         Sends digital_write command
@@ -74,10 +635,8 @@ class Arduino(object):
             pin_ = -pin
         else:
             pin_ = pin
-        cmd_str = build_cmd_str("dw", (pin_, ))
         try:
-            self.sr.write(cmd_str)
-            self.sr.flush()
+            self._send("dw", (pin_, ))
         except serial.SerialTimeoutException:
             pass
 
@@ -92,17 +651,12 @@ class Arduino(object):
         returns:
         :return value: 0 for "LOW", 1 for "HIGH"
         """
-        cmd_str = build_cmd_str("dr", (pin, ))
         try:
-            self.sr.write(cmd_str)
-            self.sr.flush()
+            self._send("dr", (pin, ))
+            self._write_batch()
         except serial.SerialTimeoutException:
             pass
-        rd = self.sr.readline().replace("\r\n", "")
-        try:
-            return int(rd)
-        except ValueError:
-            return 0
+        return self._read_int("dr")
 
     def analog_write(self, pin, val):
         """
@@ -117,10 +671,8 @@ class Arduino(object):
             val = 255
         elif val < 0:
             val = 0
-        cmd_str = build_cmd_str("aw", (pin, val))
         try:
-            self.sr.write(cmd_str)
-            self.sr.flush()
+            self._send("aw", (pin, val))
         except serial.SerialTimeoutException:
             pass
 
@@ -135,17 +687,12 @@ class Arduino(object):
         returns:
         :return value: integer from 0 to 1023
         """
-        cmd_str = build_cmd_str("ar", (pin, ))
         try:
-            self.sr.write(cmd_str)
-            self.sr.flush()
+            self._send("ar", (pin, ))
+            self._write_batch()
         except serial.SerialTimeoutException:
             pass
-        rd = self.sr.readline().replace("\r\n", "")
-        try:
-            return int(rd)
-        except ValueError:
-            return 0
+        return self._read_int("ar")
 
     def pin_mode(self, pin, val):
         """
@@ -160,39 +707,216 @@ class Arduino(object):
             pin_ = -pin
         else:
             pin_ = pin
-        cmd_str = build_cmd_str("pm", (pin_, ))
         try:
-            self.sr.write(cmd_str)
-            self.sr.flush()
+            self._send("pm", (pin_, ))
+        except serial.SerialTimeoutException:
+            pass
+
+    def start_stream(self, history=256, reader=True):
+        """
+        Asks the board to push IMU frames continuously and starts a
+        background thread that keeps the newest sample and a bounded history
+        of samples. read_sensor then returns the newest sample without a
+        serial round trip.
+        -------------
+        :param history: number of samples kept in sensor_history
+        :param reader: start the reader thread; with reader=False the caller
+                       reads the port and passes the bytes to feed(), e.g.
+                       from a select() loop over several boards
+        """
+        if self.streaming:
+            return
+        self._stream_lock = threading.Lock()
+        self._stream_ready = threading.Event()
+        self._stream_stop = threading.Event()
+        self._stream_latest = None
+        self._stream_history = collections.deque(maxlen=history)
+        self.stream_samples = 0
+        self._replies = Queue.Queue()
+        self._rx = bytearray()
+        self._stream_frame = bytearray(BIN_IMU_REPLY.size + 1)
+        try:
+            self._send("ss", (1, ))
+            self._write_batch()
+        except serial.SerialTimeoutException:
+            pass
+        self.streaming = True
+        self._stream_thread = None
+        if reader:
+            self._stream_thread = threading.Thread(target=self._stream_reader)
+            self._stream_thread.daemon = True
+            self._stream_thread.start()
+
+    def stop_stream(self):
+        """
+        Stops IMU streaming on the board and the background reader.
+        """
+        if not self.streaming:
+            return
+        try:
+            self._send("ss", (0, ))
+            self._write_batch()
         except serial.SerialTimeoutException:
             pass
+        self._stream_stop.set()
+        if self._stream_thread is not None:
+            self._stream_thread.join(self.timeout)
+        self.streaming = False
+
+    def _stream_reader(self):
+        """
+        Body of the streaming reader thread.
+        """
+        while not self._stream_stop.is_set():
+            try:
+                if self.binary:
+                    self._read_frame_bin()
+                else:
+                    line = self.sr.readline()
+                    if line:
+                        self.feed_line(line)
+            except serial.SerialException:
+                if self._stream_stop.is_set() or not self.sr.isOpen():
+                    break
+
+    def _read_frame_bin(self):
+        """
+        Reads one binary frame in streaming mode and dispatches it.
+        """
+        frame = self._stream_frame
+        if self._read_into(frame, 0, 1) != 1 or frame[0] != BIN_SYNC:
+            return
+        if self._read_into(frame, 1, 1) != 1:
+            return
+        if frame[1] in (BIN_OPCODES["sd"], BIN_OPCODES["ss"]):
+            size = BIN_IMU_REPLY.size + 1
+        else:
+            size = BIN_INT_REPLY.size + 1
+        if self._read_into(frame, 2, size - 2) != size - 2:
+            self.malformed_frames += 1
+            return
+        if size == BIN_IMU_REPLY.size + 1:
+            sample = parse_imu_frame(frame, time.time())
+            if sample is None:
+                self.malformed_frames += 1
+            else:
+                self._store_sample(sample)
+        else:
+            self._replies.put(bytes(frame[:size]))
+
+    def feed(self, data):
+        """
+        Dispatches bytes received in streaming mode without a reader thread
+        (start_stream(reader=False)). Incomplete lines or frames are kept
+        until the rest of them arrives.
+        """
+        rx = self._rx
+        rx.extend(data)
+        if not self.binary:
+            while True:
+                end = rx.find(b"\n")
+                if end < 0:
+                    return
+                line = str(rx[:end + 1])
+                del rx[:end + 1]
+                self.feed_line(line)
+        while rx:
+            if rx[0] != BIN_SYNC:
+                del rx[:1]
+                continue
+            if len(rx) < 2:
+                return
+            if rx[1] in (BIN_OPCODES["sd"], BIN_OPCODES["ss"]):
+                size = BIN_IMU_REPLY.size + 1
+            else:
+                size = BIN_INT_REPLY.size + 1
+            if len(rx) < size:
+                return
+            if size == BIN_IMU_REPLY.size + 1:
+                sample = parse_imu_frame(rx, time.time())
+                if sample is None:
+                    self.malformed_frames += 1
+                else:
+                    self._store_sample(sample)
+            else:
+                self._replies.put(bytes(rx[:size]))
+            del rx[:size]
+
+    def feed_line(self, line):
+        """
+        Dispatches one line received in streaming mode: IMU lines update the
+        newest sample and the history, anything else is a command reply.
+        """
+        if line.startswith("!ANG:"):
+            sample = parse_imu_line(line, time.time())
+            if sample is None:
+                self.malformed_frames += 1
+            else:
+                self._store_sample(sample)
+        else:
+            self._replies.put(line)
+
+    def _store_sample(self, data):
+        with self._stream_lock:
+            self._stream_latest = data
+            self._stream_history.append(data)
+            self.stream_samples += 1
+        self._stream_ready.set()
+        if self.on_sample is not None:
+            self.on_sample(data)
+
+    def sensor_history(self):
+        """
+        Returns the streamed IMU samples kept so far, oldest first.
+        """
+        if not self.streaming:
+            return []
+        with self._stream_lock:
+            return list(self._stream_history)
 
     def read_sensor(self):
         """
         Reads the data from the IMU
+        In streaming mode the newest pushed sample is returned right away.
+        Malformed and missing replies are counted in malformed_frames.
         -------------
-        :return value: imu_data
+        :return value: IMUSample, None if the reply could not be parsed
         """
-        cmd_str = build_cmd_str("sd")
+        if self.streaming:
+            self._stream_ready.wait(self.timeout)
+            with self._stream_lock:
+                return self._stream_latest
         try:
-            self.sr.write(cmd_str)
-            self.sr.flush()
+            self._send("sd")
+            self._write_batch()
         except serial.SerialTimeoutException:
-            print "Gwaaah!"
-        time.sleep(0.03)
-        try:
-            raw_data = self.sr.readline()
-            raw_data = raw_data.replace("!ANG:", "")
-            raw_data = raw_data.replace("\r\n", "")
-            data = string.split(raw_data, ",")
-        except:
-            print "Failed to reach sensor"
-            data = ['False', 'False', 'False']
-        if len(data) > 2:
+            #counted in write_timeouts, the read below times out as well
+            pass
+        if self.binary:
+            frame = self._imu_frame
+            received = self._read_into(frame, 0, len(frame))
+            complete = received == len(frame)
+            sample = None
+            if complete:
+                sample = parse_imu_frame(frame, time.time())
+        else:
+            time.sleep(self.sensor_delay)
             try:
-                return data
-            except ValueError:
-                print "Invalid line"
+                line = self.sr.readline()
+            except serial.SerialException:
+                line = ""
+            received = len(line)
+            complete = line.endswith("\n")
+            sample = parse_imu_line(line, time.time())
+        if sample is None:
+            self.malformed_frames += 1
+            if self.binary:
+                #frames are read by size, drop the rest of a misaligned
+                #reply so the next request starts at its sync byte
+                self._discard_input()
+        if self.stats is not None:
+            self._record_reply("sd", received, complete, sample is not None)
+        return sample
 
     def close(self):
         """
@@ -201,5 +925,7 @@ class Arduino(object):
 
         """
         if self.sr.isOpen():
+            self.stop_stream()
+            self._write_batch()
             self.sr.flush()
             self.sr.close()
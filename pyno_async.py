@@ -0,0 +1,368 @@
+#!/usr/bin/env python
+"""
+Pipelined, non-blocking transport for the Arduino and the helicopter model.
+
+Commands return immediately and reads return futures. A single I/O thread
+owns the serial port: it writes every queued command, coalescing whatever
+has been queued in the meantime into one write, and completes the
+outstanding read futures in the order their requests were sent. Sensing,
+actuation, logging and the UI can therefore share one board without
+blocking each other on readline().
+
+Python 2 has no asyncio, so the futures are thread-safe objects with
+result() and add_done_callback() instead of awaitables.
+"""
+
+import serial
+import threading
+import collections
+import Queue
+import time
+
+from linkstats import BATCH, REPLY_COMMANDS
+from pyno import Arduino, BIN_INT_REPLY, BIN_IMU_REPLY, BIN_OPCODES, \
+    BIN_SYNC, parse_imu_frame, parse_imu_line
+from pyheli import Heli
+from scheduler import monotonic
+
+
+class Future(object):
+    """
+    Result of a pipelined read, completed by the I/O thread.
+    """
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._result = None
+        self._callbacks = []
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """
+        Waits for the reply and returns it
+        -------------
+        :param timeout: seconds to wait, None waits until the reply arrives
+        :return value: parsed reply, None if it did not arrive in time
+        """
+        self._done.wait(timeout)
+        return self._result
+
+    def add_done_callback(self, fn):
+        """
+        Calls fn(future) once the reply is in, from the I/O thread, or right
+        away if it is already done.
+        """
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def set_result(self, result):
+        with self._lock:
+            self._result = result
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            fn(self)
+
+
+class AsyncArduino(Arduino):
+
+    def __init__(self, *args, **kwargs):
+        """
+        Takes the same arguments as Arduino.
+        """
+        self._outgoing = Queue.Queue()
+        self._pending = collections.deque()
+        # Binary bytes received but not yet taken as a reply
+        self._reply_rx = bytearray()
+        super(AsyncArduino, self).__init__(*args, **kwargs)
+        self._io_thread = threading.Thread(target=self._io_loop)
+        self._io_thread.daemon = True
+        self._io_thread.start()
+
+    def start_stream(self, history=256):
+        """
+        Asks the board to push IMU frames continuously, see
+        Arduino.start_stream. The I/O thread passes the received bytes to
+        feed(), read_sensor returns the newest sample and sensor_history the
+        kept ones.
+        -------------
+        :param history: number of samples kept in sensor_history
+        """
+        Arduino.start_stream(self, history, reader=False)
+
+    def _send(self, cmd, args=None):
+        """
+        Queues one command for the I/O thread, or for the open batch.
+        """
+        cmd_str = self._build(cmd, args)
+        if self._batch is not None:
+            self._batch.append(cmd_str)
+            if self.stats is not None:
+                self.stats.sent(cmd, len(cmd_str))
+            return
+        self._outgoing.put((cmd_str, cmd, None, None))
+
+    def _write_batch(self):
+        if self._batch:
+            data = "".join(self._batch)
+            del self._batch[:]
+            self._outgoing.put((data, BATCH, None, None))
+
+    def _submit(self, cmd, args, kind):
+        """
+        Queues a command that expects a reply and returns its future.
+        Anything already batched is sent first, as in the blocking API.
+        """
+        future = Future()
+        self._write_batch()
+        self._outgoing.put((self._build(cmd, args), cmd, future, kind))
+        return future
+
+    def digital_read_async(self, pin):
+        """
+        Requests the value of a digital pin
+        -------------
+        :return value: future of 0 for "LOW", 1 for "HIGH"
+        """
+        return self._submit("dr", (pin, ), "int")
+
+    def analog_read_async(self, pin):
+        """
+        Requests the value of an analog pin
+        -------------
+        :return value: future of an integer from 0 to 1023
+        """
+        return self._submit("ar", (pin, ), "int")
+
+    def read_sensor_async(self):
+        """
+        Requests the data from the IMU. While streaming the future holds the
+        newest sample right away.
+        -------------
+        :return value: future of imu_data
+        """
+        if self.streaming:
+            future = Future()
+            with self._stream_lock:
+                sample = self._stream_latest
+            future.set_result(sample)
+            return future
+        return self._submit("sd", None, "sd")
+
+    def digital_read(self, pin):
+        return self.digital_read_async(pin).result()
+
+    def analog_read(self, pin):
+        return self.analog_read_async(pin).result()
+
+    def read_sensor(self):
+        if self.streaming:
+            # Waits for the first sample
+            return Arduino.read_sensor(self)
+        return self.read_sensor_async().result()
+
+    def _io_loop(self):
+        """
+        Body of the I/O thread: writes queued commands and completes the
+        pending futures in order. A None item stops the loop.
+        """
+        stop = False
+        while not stop:
+            if self._pending or self.streaming:
+                wait = 0.001
+            else:
+                wait = 0.05
+            try:
+                item = self._outgoing.get(timeout=wait)
+            except Queue.Empty:
+                item = False
+            items = []
+            while item is not False:
+                if item is None:
+                    stop = True
+                    break
+                items.append(item)
+                try:
+                    item = self._outgoing.get_nowait()
+                except Queue.Empty:
+                    item = False
+            if items:
+                self._write_items(items)
+            self._read_replies()
+        while self._pending:
+            self._complete(self._pending.popleft(), "")
+
+    def _write_items(self, items):
+        """
+        Writes queued commands in one write and flush. With stats they are
+        counted as Arduino._write does: commands and batches without a reply
+        are timed until the flush, requests until their reply is parsed.
+        """
+        start = monotonic()
+        for cmd_str, cmd, future, kind in items:
+            if future is not None:
+                self._pending.append((future, kind, cmd, start))
+        try:
+            self.sr.write("".join(item[0] for item in items))
+            self.sr.flush()
+        except serial.SerialTimeoutException:
+            self.write_timeouts += 1
+            if self.stats is not None:
+                for item in items:
+                    self.stats.timeout(item[1])
+            return
+        stats = self.stats
+        if stats is not None:
+            latency = monotonic() - start
+            for cmd_str, cmd, future, kind in items:
+                if cmd == BATCH:
+                    stats.batch(len(cmd_str), latency)
+                elif cmd in REPLY_COMMANDS:
+                    stats.sent(cmd, len(cmd_str))
+                else:
+                    stats.sent(cmd, len(cmd_str), latency)
+
+    def _bytes_waiting(self):
+        waiting = getattr(self.sr, "in_waiting", None)
+        if waiting is None:
+            waiting = self.sr.inWaiting()
+        return waiting
+
+    def _read_replies(self):
+        """
+        Completes pending futures for the replies that have arrived. A
+        request without a reply within the timeout gets the same default
+        as the blocking API (0 or None). While streaming the received bytes
+        are passed to feed() first, which keeps the samples and queues the
+        replies. Without a pending request, and not streaming, the received
+        bytes are late replies or frames and are dropped.
+        """
+        if self.streaming:
+            if self._reply_rx:
+                self.feed(bytes(self._reply_rx))
+                del self._reply_rx[:]
+            waiting = self._bytes_waiting()
+            if waiting:
+                self.feed(self.sr.read(waiting))
+        elif not self._pending:
+            if self._bytes_waiting():
+                self._discard_input()
+            del self._reply_rx[:]
+            return
+        while self._pending:
+            future, kind, cmd, sent = self._pending[0]
+            if self.streaming and kind == "sd" and self.stream_samples:
+                # Requested before the stream started, feed() took the
+                # reply as a streamed sample
+                self._pending.popleft()
+                with self._stream_lock:
+                    sample = self._stream_latest
+                future.set_result(sample)
+                continue
+            reply = self._poll_reply(cmd)
+            if reply is None:
+                if monotonic() - sent <= self.timeout:
+                    return
+                reply = ""
+            self._complete(self._pending.popleft(), reply)
+
+    def _poll_reply(self, cmd):
+        """
+        Reads the reply to cmd if it is available, None otherwise. In binary
+        mode bytes are skipped up to the sync byte and the opcode of cmd, so
+        a stray byte or the reply to another command is not taken for it.
+        """
+        if self.streaming:
+            try:
+                return self._replies.get_nowait()
+            except Queue.Empty:
+                return None
+        waiting = self._bytes_waiting()
+        if self.binary:
+            rx = self._reply_rx
+            if waiting:
+                rx.extend(self.sr.read(waiting))
+            opcode = BIN_OPCODES[cmd]
+            while len(rx) >= 2 and (rx[0] != BIN_SYNC or rx[1] != opcode):
+                del rx[:1]
+            if cmd == "sd":
+                size = BIN_IMU_REPLY.size + 1
+            else:
+                size = BIN_INT_REPLY.size + 1
+            if len(rx) < size:
+                return None
+            reply = bytes(rx[:size])
+            del rx[:size]
+            return reply
+        if waiting == 0:
+            return None
+        return self.sr.readline()
+
+    def _complete(self, pending, reply):
+        """
+        Parses the reply of a pending request, "" if none arrived in time,
+        completes its future and records it in stats.
+        """
+        future, kind, cmd, sent = pending
+        if kind == "int":
+            value = self._parse_int(reply, None)
+            parsed = value is not None
+            result = value if parsed else 0
+        else:
+            if self.binary:
+                result = parse_imu_frame(bytearray(reply), time.time())
+            else:
+                result = parse_imu_line(reply, time.time())
+            parsed = result is not None
+            if not parsed:
+                self.malformed_frames += 1
+        if self.stats is not None:
+            if self.binary:
+                complete = len(reply) > 0
+            else:
+                complete = reply.endswith("\n")
+            self.stats.replied(cmd, len(reply), monotonic() - sent,
+                               complete, parsed)
+        future.set_result(result)
+
+    def close(self):
+        """
+        Stops streaming, sends everything still queued, stops the I/O thread
+        and closes the serial port.
+        """
+        # Queued before the stop item, so the I/O thread still writes them
+        if self.sr.isOpen():
+            self.stop_stream()
+        self._write_batch()
+        self._outgoing.put(None)
+        self._io_thread.join()
+        super(AsyncArduino, self).close()
+
+
+class AsyncHeli(AsyncArduino, Heli):
+    """
+    Heli on the pipelined transport. Actuator commands never block and the
+    reads are also available as futures.
+    """
+
+    def read_sensor_data_async(self):
+        """
+        Requests the data from the IMU
+        -----------
+        :return value: future of the sensor data roll, pitch, yaw
+        """
+        return self.read_sensor_async()
+
+    def check_5v_motor_fault_async(self):
+        """
+        Requests the fault state of the 5v motor
+        -------------
+        :return value: future of 0 when in fault, 1 when operational
+        """
+        return self.digital_read_async(self.motor_5v_fault)
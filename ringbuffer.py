@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""
+Fixed-capacity signal history for discrete-time controllers and filters.
+"""
+
+from array import array
+
+
+class RingBuffer(object):
+    """
+    Keeps the last capacity samples of a signal in a preallocated array.
+    Index 0 is the newest sample, index k the sample from k steps ago, so
+    x[0], x[1], x[2] are x(k), x(k-1), x(k-2) of a difference equation.
+    Pushing a sample is O(1) and does not allocate.
+    """
+
+    __slots__ = ('capacity', 'count', '_data', '_head')
+
+    def __init__(self, capacity, fill=0.0, typecode='d'):
+        """
+        -------------
+        :param capacity: number of samples kept
+        :param fill: initial value of every sample
+        :param typecode: array typecode of the samples, 'd' for doubles
+        """
+        self.capacity = capacity
+        self.count = 0
+        self._data = array(typecode, [fill]) * capacity
+        self._head = 0
+
+    def push(self, x):
+        """
+        Adds the newest sample, dropping the oldest one.
+        """
+        head = self._head + 1
+        if head == self.capacity:
+            head = 0
+        self._data[head] = x
+        self._head = head
+        self.count += 1
+
+    def __getitem__(self, k):
+        if not 0 <= k < self.capacity:
+            raise IndexError("delay %d outside of ring buffer" % k)
+        return self._data[self._head - k]
+
+    def __setitem__(self, k, x):
+        if not 0 <= k < self.capacity:
+            raise IndexError("delay %d outside of ring buffer" % k)
+        self._data[self._head - k] = x
+
+    def __len__(self):
+        return self.capacity
+
+    def __iter__(self):
+        """
+        Iterates from the newest to the oldest sample.
+        """
+        for k in range(self.capacity):
+            yield self._data[self._head - k]
+
+    def filled(self):
+        """
+        Number of samples pushed so far, at most the capacity.
+        """
+        return min(self.count, self.capacity)
+
+    def chronological(self):
+        """
+        Returns the pushed samples as an array, oldest first.
+        """
+        n = self.filled()
+        start = self._head + 1 - n
+        if start >= 0:
+            return self._data[start:self._head + 1]
+        return self._data[start:] + self._data[:self._head + 1]
+
+    def clear(self, fill=0.0):
+        for k in range(self.capacity):
+            self._data[k] = fill
+        self.count = 0
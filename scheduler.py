@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+"""
+Fixed-rate scheduler for control loops.
+
+The loop sleeps until absolute deadlines on a monotonic clock, so the time
+spent in the step does not accumulate into the period. A step that runs
+past the next deadline is counted as an overrun and handled by one of the
+policies:
+
+    SKIP      drop the missed deadlines and stay on the original time grid
+    CATCH_UP  run the missed steps back to back until the loop is on time
+    STRETCH   start a new time grid at the end of the late step
+
+Without a monotonic clock the wall clock is used. It can step while the
+loop sleeps or runs a step: backwards, or forwards by more than CLOCK_JUMP
+besides the time the sleep should take. Such a step is taken as a clock
+jump rather than time that passed, and the deadline is moved with the
+clock, so the loop neither sleeps through nor catches up the jump. Genuine
+overruns shorter than CLOCK_JUMP are handled by the policies as usual.
+"""
+
+import math
+import time
+import warnings
+
+try:
+    from time import monotonic
+except ImportError:
+    try:
+        # Backport of time.monotonic for Python 2
+        from monotonic import monotonic
+    except ImportError:
+        monotonic = time.time
+
+SKIP = "skip"
+CATCH_UP = "catch_up"
+STRETCH = "stretch"
+POLICIES = (SKIP, CATCH_UP, STRETCH)
+# Largest forward step of the wall clock, in seconds, during one sleep or
+# step that is still taken as elapsed time
+CLOCK_JUMP = 10.0
+
+
+class PeriodicScheduler(object):
+
+    def __init__(self, period, policy=SKIP, stop_event=None, clock=monotonic,
+                 sleep=None):
+        """
+        -------------
+        :param period: period of the loop in seconds
+        :param policy: overrun policy, one of SKIP, CATCH_UP, STRETCH
+        :param stop_event: threading.Event that ends run() when set
+        :param clock: monotonic time source in seconds
+        :param sleep: waits for the given number of seconds until the next
+                      deadline, e.g. a function that serves I/O meanwhile;
+                      by default stop_event.wait, so that setting the event
+                      ends the wait, or time.sleep without a stop event
+        """
+        if policy not in POLICIES:
+            raise ValueError("Unknown overrun policy: %s" % policy)
+        self.period = period
+        self.policy = policy
+        self.stopped = stop_event
+        self.clock = clock
+        if sleep is None:
+            sleep = stop_event.wait if stop_event is not None else time.sleep
+        self.sleep = sleep
+        # The wall clock can step, see run
+        self.wall_clock = clock is time.time
+        if self.wall_clock:
+            warnings.warn("no monotonic clock, the scheduler uses time.time "
+                          "and moves its deadlines when the clock jumps",
+                          RuntimeWarning)
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.steps = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.max_lateness = 0.0
+        self.reanchored = 0
+        self._last_start = None
+        self._n = 0
+        self._mean = 0.0
+        self._m2 = 0.0
+        self._min = None
+        self._max = None
+
+    def _record(self, start, deadline):
+        self.steps += 1
+        self.max_lateness = max(self.max_lateness, start - deadline)
+        if self._last_start is not None:
+            # Welford's running mean and variance of the measured period
+            period = start - self._last_start
+            self._n += 1
+            delta = period - self._mean
+            self._mean += delta / self._n
+            self._m2 += delta * (period - self._mean)
+            if self._min is None or period < self._min:
+                self._min = period
+            if self._max is None or period > self._max:
+                self._max = period
+        self._last_start = start
+
+    def stats(self):
+        """
+        Returns the loop statistics
+        -------------
+        :return value: dict with the number of steps, overruns and skipped
+                       deadlines, the mean, min and max measured period,
+                       the jitter (standard deviation of the period), the
+                       largest delay of a step behind its deadline and the
+                       number of wall clock jumps the deadline was moved by
+        """
+        if self._n > 1:
+            jitter = math.sqrt(self._m2 / (self._n - 1))
+        else:
+            jitter = 0.0
+        return {"period": self.period,
+                "steps": self.steps,
+                "overruns": self.overruns,
+                "skipped": self.skipped,
+                "mean_period": self._mean if self._n else None,
+                "min_period": self._min,
+                "max_period": self._max,
+                "jitter": jitter,
+                "max_lateness": self.max_lateness,
+                "reanchored": self.reanchored}
+
+    def _jump(self, change):
+        """
+        Returns the clock jump in a change of the wall clock beyond the
+        expected one, 0 if the change is plausible as elapsed time.
+        """
+        if change < -self.period or change > CLOCK_JUMP:
+            self.reanchored += 1
+            return change
+        return 0.0
+
+    def run(self, step):
+        """
+        Calls step() once per period until the stop event is set.
+        """
+        clock = self.clock
+        wall_clock = self.wall_clock
+        deadline = clock() + self.period
+        while True:
+            now = clock()
+            delay = max(deadline - now, 0.0)
+            if delay > 0:
+                self.sleep(delay)
+            if self.stopped is not None and self.stopped.is_set():
+                break
+
+            start = clock()
+            if wall_clock:
+                # The sleep should have taken delay
+                deadline += self._jump(start - now - delay)
+            self._record(start, deadline)
+            step()
+            deadline += self.period
+
+            now = clock()
+            if wall_clock:
+                deadline += self._jump(now - start)
+            if now > deadline:
+                self.overruns += 1
+                if self.policy == SKIP:
+                    missed = int((now - deadline) / self.period) + 1
+                    self.skipped += missed
+                    deadline += missed * self.period
+                elif self.policy == STRETCH:
+                    deadline = now
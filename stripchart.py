@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+"""
+Live strip-chart plots for the GUI.
+
+Every channel keeps its history in a MinMaxDecimator: consecutive samples
+are folded into buckets that only store their minimum and maximum, and the
+buckets are kept in fixed-size ring buffers. Memory and drawing cost depend
+only on the number of buckets, not on how long the session has been
+running, and spikes shorter than a bucket still show up in the envelope.
+
+StripChart repaints on its own timer, independently of the rate at which
+samples are pushed, and only if something was pushed since the last frame.
+"""
+
+from PyQt4 import QtCore, QtGui
+
+from ringbuffer import RingBuffer
+
+NAN = float('nan')
+
+
+class MinMaxDecimator(object):
+    """
+    Min/max envelope of the last buckets * per_bucket samples of a signal.
+    NaN samples (e.g. outputs in manual mode) take up time but are left out
+    of the envelope.
+    """
+
+    def __init__(self, buckets, per_bucket):
+        """
+        -------------
+        :param buckets: number of buckets kept
+        :param per_bucket: samples folded into one bucket
+        """
+        self.buckets = buckets
+        self.per_bucket = per_bucket
+        self.mins = RingBuffer(buckets, NAN)
+        self.maxs = RingBuffer(buckets, NAN)
+        self._lo = NAN
+        self._hi = NAN
+        self._n = 0
+
+    def push(self, x):
+        """
+        Adds a sample, closing the current bucket when it is full.
+        """
+        if x == x:
+            if not self._lo <= x:
+                self._lo = x
+            if not self._hi >= x:
+                self._hi = x
+        self._n += 1
+        if self._n == self.per_bucket:
+            self.mins.push(self._lo)
+            self.maxs.push(self._hi)
+            self._lo = NAN
+            self._hi = NAN
+            self._n = 0
+
+    def envelope(self):
+        """
+        Returns (mins, maxs) of the buckets, oldest first, the bucket still
+        being filled last.
+        """
+        mins = list(self.mins.chronological())
+        maxs = list(self.maxs.chronological())
+        if self._n:
+            mins.append(self._lo)
+            maxs.append(self._hi)
+        return mins, maxs
+
+    def clear(self):
+        self.mins.clear(NAN)
+        self.maxs.clear(NAN)
+        self._lo = NAN
+        self._hi = NAN
+        self._n = 0
+
+
+class StripChart(QtGui.QWidget):
+
+    def __init__(self, title, history=12000, buckets=600, refresh=100,
+                 y_range=None, period=None, parent=None):
+        """
+        -------------
+        :param title: title drawn in the top left corner
+        :param history: number of samples shown across the chart
+        :param buckets: horizontal resolution of the chart
+        :param refresh: repaint period in ms
+        :param y_range: fixed (min, max) of the y axis, by default it follows
+                        the data
+        :param period: sample period in s, only used to label the time span
+        """
+        QtGui.QWidget.__init__(self, parent)
+        self.title = title
+        self.buckets = buckets
+        self.per_bucket = max(1, history // buckets)
+        self.y_range = y_range
+        if period is not None:
+            self.title += ' (%g s)' % (buckets * self.per_bucket * period)
+        self.channels = []
+        self._dirty = False
+        self.setMinimumSize(300, 150)
+
+        self._timer = QtCore.QTimer(self)
+        self._timer.timeout.connect(self._refresh)
+        self._timer.start(refresh)
+
+    def add_channel(self, name, color):
+        """
+        Adds a plotted signal, pushed in the order the channels were added.
+        """
+        self.channels.append((name, QtGui.QColor(color),
+                              MinMaxDecimator(self.buckets, self.per_bucket)))
+
+    def push(self, *values):
+        """
+        Adds one sample of every channel.
+        """
+        for (name, color, decimator), x in zip(self.channels, values):
+            decimator.push(x)
+        self._dirty = True
+
+    def clear(self):
+        for name, color, decimator in self.channels:
+            decimator.clear()
+        self._dirty = True
+
+    def _refresh(self):
+        if self._dirty:
+            self._dirty = False
+            self.update()
+
+    def _limits(self, envelopes):
+        if self.y_range is not None:
+            return self.y_range
+        values = [x for mins, maxs in envelopes for x in mins + maxs if x == x]
+        if not values:
+            return -1.0, 1.0
+        lo, hi = min(values), max(values)
+        if lo == hi:
+            return lo - 1.0, hi + 1.0
+        margin = 0.05 * (hi - lo)
+        return lo - margin, hi + margin
+
+    def paintEvent(self, event):
+        painter = QtGui.QPainter(self)
+        painter.fillRect(self.rect(), QtCore.Qt.white)
+        w = self.width()
+        h = self.height()
+        envelopes = [decimator.envelope()
+                     for name, color, decimator in self.channels]
+        lo, hi = self._limits(envelopes)
+        scale = (h - 1) / (hi - lo)
+        dx = float(w - 1) / self.buckets
+
+        # Zero line
+        if lo < 0.0 < hi:
+            painter.setPen(QtGui.QColor(200, 200, 200))
+            y0 = h - 1 - (0.0 - lo) * scale
+            painter.drawLine(QtCore.QPointF(0, y0), QtCore.QPointF(w, y0))
+
+        for (name, color, decimator), (mins, maxs) in zip(self.channels,
+                                                          envelopes):
+            painter.setPen(color)
+            # Buckets are drawn right aligned, each as its min and max
+            # point, so the polyline traces the envelope
+            x = w - 1 - len(mins) * dx
+            polygon = QtGui.QPolygonF()
+            for y_min, y_max in zip(mins, maxs):
+                x += dx
+                if y_min != y_min:
+                    if polygon.size():
+                        painter.drawPolyline(polygon)
+                        polygon = QtGui.QPolygonF()
+                    continue
+                polygon.append(QtCore.QPointF(x, h - 1 - (y_min - lo) * scale))
+                polygon.append(QtCore.QPointF(x, h - 1 - (y_max - lo) * scale))
+            if polygon.size():
+                painter.drawPolyline(polygon)
+
+        # Title, legend and the y range
+        painter.setPen(QtCore.Qt.black)
+        painter.drawText(5, 15, self.title)
+        painter.drawText(w - 60, 15, '%.1f' % hi)
+        painter.drawText(w - 60, h - 5, '%.1f' % lo)
+        for k, (name, color, decimator) in enumerate(self.channels):
+            painter.setPen(color)
+            painter.drawText(5, 30 + 15 * k, name)
+        painter.end()
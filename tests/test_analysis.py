@@ -0,0 +1,48 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import binlog
+from analysis import CSV_COLUMNS, analyse_directory, load_run
+
+
+class TestLoadRun(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        t = np.arange(200) * 0.05
+        ref = np.where(t < 2.0, 0.0, 10.0)
+        self.rows = np.column_stack([t, ref * (1.0 - np.exp(-t)), ref / 2,
+                                     ref, ref / 2, ref, ref / 4])
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def test_exported_csv_with_header(self):
+        log = binlog.BinaryLogger(self.path('run_ctrl_log.bin'), CSV_COLUMNS)
+        for row in self.rows:
+            log.log(*row)
+        log.close()
+        binlog.export_csv(self.path('run_ctrl_log.bin'),
+                          self.path('run_ctrl_log.csv'))
+        exported = load_run(self.path('run_ctrl_log.csv'))
+        original = load_run(self.path('run_ctrl_log.bin'))
+        for name in CSV_COLUMNS:
+            self.assertTrue(np.allclose(exported[name], original[name]))
+        runs = analyse_directory(self.directory, jobs=1)
+        self.assertEqual([run['file'] for run in runs], ['run_ctrl_log.bin'])
+
+    def test_headerless_csv(self):
+        np.savetxt(self.path('old_ctrl_log.csv'), self.rows, delimiter=';')
+        columns = load_run(self.path('old_ctrl_log.csv'))
+        self.assertTrue(np.allclose(columns['u_2'], self.rows[:, 6]))
+
+
+if __name__ == "__main__":
+    unittest.main()
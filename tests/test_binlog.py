@@ -0,0 +1,49 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import binlog
+
+
+class TestBinaryLogger(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'run_ctrl_log.bin')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, rows, step=0.5, **kwargs):
+        log = binlog.BinaryLogger(self.path, ['t', 'x'], chunk=4, **kwargs)
+        for k in range(rows):
+            log.log(step * k, -k)
+        log.close()
+
+    def test_round_trip(self):
+        self.write(10)
+        fields, columns = binlog.read_log(self.path)
+        self.assertEqual(fields, ['t', 'x'])
+        self.assertEqual(list(columns[0]), [0.5 * k for k in range(10)])
+        self.assertEqual(list(columns[1]), [-k for k in range(10)])
+
+    def test_typecode(self):
+        self.write(3, step=2, typecode='i')
+        fields, columns = binlog.read_log(self.path)
+        self.assertEqual(columns[1].typecode, 'i')
+        self.assertEqual(list(columns[1]), [0, -1, -2])
+
+    def test_interrupted_run(self):
+        self.write(10)
+        # Cuts the last chunk of two rows within its first column
+        size = os.path.getsize(self.path)
+        with open(self.path, 'r+b') as f:
+            f.truncate(size - 3 * 8)
+        fields, columns = binlog.read_log(self.path)
+        self.assertEqual([len(column) for column in columns], [8, 8])
+        self.assertEqual(list(columns[1]), [-k for k in range(8)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+import unittest
+
+import numpy as np
+
+from controller_PI import U1_LIMITS, pi_spec
+from dtcontrol import compile_spec, discretize
+
+
+def velocity_pi(u_prev, e, e_prev, Kp, Ti, Td, limits):
+    # The PI law controller_PI used before dtcontrol.py
+    u = u_prev + Kp*((e - e_prev) + Td*e/Ti)
+    return min(max(u, limits[0]), limits[1])
+
+
+class TestDiscreteController(unittest.TestCase):
+
+    def test_backward_pi_matches_velocity_form(self):
+        Kp, Ti, Td = 2.0, 1.5, 0.05
+        law = compile_spec(pi_spec(Kp, Ti), Td, U1_LIMITS)
+        rng = np.random.RandomState(0)
+        u = e_prev = 0.0
+        expected = []
+        actual = []
+        for e in rng.normal(0.0, 30.0, 2000):
+            u = velocity_pi(u, e, e_prev, Kp, Ti, Td, U1_LIMITS)
+            e_prev = e
+            expected.append(u)
+            actual.append(law.step(e))
+        # Equal within floating-point rounding, not bit for bit
+        self.assertTrue(np.allclose(actual, expected, rtol=0.0, atol=1e-9))
+
+    def test_zoh_first_order_lag(self):
+        b, a = discretize([1.0], [1.0, 1.0], 0.05, "zoh")
+        self.assertAlmostEqual(b[0], 0.0)
+        self.assertAlmostEqual(b[1], 1.0 - np.exp(-0.05))
+        self.assertAlmostEqual(a[1], -np.exp(-0.05))
+
+    def test_dc_gain_of_every_method(self):
+        for method in ("tustin", "zoh", "backward"):
+            law = compile_spec({"type": "leadlag", "K": 3.0, "T1": 0.5,
+                                "T2": 0.1, "method": method}, 0.05)
+            for k in range(200):
+                y = law.step(1.0)
+            self.assertAlmostEqual(y, 3.0, places=6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import unittest
+
+import numpy as np
+
+from fuzzy import (FuzzyEngine, FuzzySurface, SparseFuzzyEngine,
+                   accuracy_report)
+
+# Ordinary triangular outer sets: the rules fade to 0 beyond the outer
+# centres
+E_SETS = [[-40.0, -20.0, 0.0], [-20.0, 0.0, 20.0], [0.0, 20.0, 40.0]]
+DE_SETS = [[-10.0, -5.0, 0.0], [-5.0, 0.0, 5.0], [0.0, 5.0, 10.0]]
+A = [[60.0, 30.0, 60.0], [60.0, 0.0, 60.0], [60.0, 30.0, 60.0]]
+
+
+class TestFuzzySurface(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = FuzzyEngine(E_SETS, DE_SETS, A)
+
+    def test_breakpoint_grid_is_exact(self):
+        surface = FuzzySurface.compile(self.engine, n_e=0, n_de=0)
+        self.assertLess(accuracy_report(self.engine, surface)['max_abs'],
+                        1e-9)
+
+    def test_beyond_the_outer_centres(self):
+        surface = FuzzySurface.compile(self.engine)
+        for e in (25.0, 29.0, 35.0, 50.0, -45.0):
+            self.assertAlmostEqual(surface.lookup(e, 0.0),
+                                   self.engine.evaluate(e, 0.0))
+        self.assertTrue(np.allclose(
+            surface.lookup_batch([25.0, 35.0, 50.0], [0.0, 7.0, 20.0]),
+            self.engine.evaluate_batch([25.0, 35.0, 50.0], [0.0, 7.0, 20.0])))
+
+    def test_report_covers_the_set_span(self):
+        # A grid narrower than the sets clamps where the rules still change
+        surface = FuzzySurface.compile(self.engine, e_range=(-20.0, 20.0))
+        self.assertGreater(accuracy_report(self.engine, surface)['max_abs'],
+                           10.0)
+
+
+def triangle(x, points):
+    L, C, R = points
+    if L <= x <= C:
+        return (x - L) / (C - L)
+    if C < x <= R:
+        return (R - x) / (R - C)
+    return 0.0
+
+
+class TestFuzzyEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = FuzzyEngine(E_SETS, DE_SETS, A)
+
+    def test_weighted_sum_of_the_rules(self):
+        for e, de in ((0.0, 0.0), (-7.5, 2.0), (13.0, -4.0), (39.0, 9.5)):
+            u = sum(triangle(de, DE_SETS[i]) * triangle(e, E_SETS[j]) *
+                    A[i][j] for i in range(3) for j in range(3))
+            self.assertAlmostEqual(self.engine.evaluate(e, de), u)
+
+    def test_batch_and_clipping(self):
+        e = np.array([[-50.0, -7.5], [13.0, 45.0]])
+        de = np.array([[0.0, 2.0], [-4.0, 20.0]])
+        batch = self.engine.evaluate_batch(e, de)
+        self.assertEqual(batch.shape, (2, 2))
+        for k in np.ndindex(2, 2):
+            self.assertAlmostEqual(batch[k], self.engine.evaluate(e[k], de[k]))
+        self.assertEqual(self.engine.evaluate(-50.0, 0.0),
+                         self.engine.evaluate(-40.0, 0.0))
+
+
+class TestSparseEngine(unittest.TestCase):
+
+    def test_agrees_with_the_dense_engine(self):
+        # Shoulder sets outside, rows and columns out of order
+        e_sets = [[0.0, 20.0, 20.0], [-20.0, -20.0, 0.0], [-20.0, 0.0, 20.0]]
+        de_sets = [[-5.0, 0.0, 5.0], [-5.0, -5.0, 0.0], [0.0, 5.0, 5.0]]
+        dense = FuzzyEngine(e_sets, de_sets, A)
+        sparse = SparseFuzzyEngine(e_sets, de_sets, A)
+        rng = np.random.RandomState(0)
+        for e, de in zip(rng.uniform(-30.0, 30.0, 500),
+                         rng.uniform(-8.0, 8.0, 500)):
+            self.assertAlmostEqual(sparse.evaluate(e, de),
+                                   dense.evaluate(e, de))
+        for e in (-20.0, 0.0, 20.0):
+            self.assertAlmostEqual(sparse.evaluate(e, 5.0),
+                                   dense.evaluate(e, 5.0))
+
+    def test_overlapping_sets_are_refused(self):
+        e_sets = [[-40.0, -20.0, 10.0], [-20.0, 0.0, 20.0], [0.0, 20.0, 40.0]]
+        self.assertRaises(ValueError, SparseFuzzyEngine, e_sets, DE_SETS, A)
+
+
+if __name__ == "__main__":
+    unittest.main()
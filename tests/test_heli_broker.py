@@ -0,0 +1,51 @@
+import threading
+import time
+import unittest
+
+from heli_broker import BrokerHeli, HeliBroker
+from pyheli import Heli
+from virtual_heli import VirtualArduino
+
+
+class TestBroker(unittest.TestCase):
+
+    def setUp(self):
+        self.board = VirtualArduino(seed=0)
+        heli = Heli(None, sr=self.board, binary=True)
+        self.broker = HeliBroker(heli, address=('127.0.0.1', 0),
+                                 stream=False, period=0.01)
+        self.stop = threading.Event()
+        self.server = threading.Thread(target=self.broker.serve,
+                                       args=(self.stop,))
+        self.server.start()
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.close()
+        self.stop.set()
+        self.server.join()
+
+    def client(self, **kwargs):
+        client = BrokerHeli(self.broker.address, **kwargs)
+        self.clients.append(client)
+        return client
+
+    def test_lease_is_denied_to_a_second_client(self):
+        self.client()
+        self.assertRaises(IOError, self.client)
+        watcher = self.client(lease=False)
+        self.assertFalse(watcher.acquire_lease())
+        self.assertIsNone(watcher.set_motor_speed_5v(50))
+        self.assertEqual(self.broker.commands_denied, 1)
+        self.assertIsNotNone(watcher.read_sensor())
+
+    def test_keepalive_replies_are_not_queued(self):
+        client = self.client(lease_time=0.06)
+        time.sleep(0.3)
+        self.assertEqual(client._replies.qsize(), 0)
+        self.assertIsNotNone(client.check_5v_motor_fault())
+
+
+if __name__ == "__main__":
+    unittest.main()
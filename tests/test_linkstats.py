@@ -0,0 +1,62 @@
+import unittest
+
+import numpy as np
+
+from linkstats import LatencyHistogram, LinkStats
+
+
+class TestLatencyHistogram(unittest.TestCase):
+
+    def test_percentiles_within_the_bucket_error(self):
+        histogram = LatencyHistogram()
+        rng = np.random.RandomState(0)
+        durations = rng.lognormal(np.log(2e-3), 1.0, 5000)
+        for seconds in durations:
+            histogram.record(seconds)
+        for p in (50.0, 90.0, 99.0):
+            exact = np.percentile(durations, p)
+            self.assertLess(abs(histogram.percentile(p) - exact),
+                            2.0 / histogram.sub_buckets * exact)
+        self.assertAlmostEqual(histogram.percentile(100.0), durations.max(),
+                               delta=2.0 / histogram.sub_buckets *
+                               durations.max())
+
+    def test_small_and_out_of_range_durations(self):
+        histogram = LatencyHistogram(lowest=1e-6, highest=1.0)
+        self.assertIsNone(histogram.percentile(50.0))
+        for seconds in (3e-6, 3e-6, 3e-6, 20.0):
+            histogram.record(seconds)
+        # Durations below sub_buckets units are counted exactly to a unit
+        self.assertAlmostEqual(histogram.percentile(50.0), 3e-6, delta=1e-6)
+        # Counted as highest, the maximum is kept exactly
+        self.assertAlmostEqual(histogram.percentile(99.0), 1.0, delta=0.05)
+        snapshot = histogram.snapshot()
+        self.assertEqual(snapshot["count"], 4)
+        self.assertEqual(snapshot["max"], 20.0)
+        self.assertEqual(sum(n for lower, n in snapshot["buckets"]), 4)
+        histogram.reset()
+        self.assertEqual(histogram.snapshot()["buckets"], [])
+
+
+class TestLinkStats(unittest.TestCase):
+
+    def test_snapshot(self):
+        stats = LinkStats()
+        stats.sent("dr", 4)
+        stats.replied("dr", 5, 1e-3)
+        stats.sent("dr", 4)
+        stats.replied("dr", 2, 1e-3, complete=False)
+        stats.sent("aw", 8, 2e-4)
+        stats.timeout("ss")
+        commands = stats.snapshot(reset=True)["commands"]
+        self.assertEqual(sorted(commands), ["aw", "dr", "ss"])
+        self.assertEqual(commands["dr"]["commands"], 2)
+        self.assertEqual(commands["dr"]["count"], 1)
+        self.assertEqual(commands["dr"]["bytes_received"], 7)
+        self.assertEqual(commands["dr"]["timeouts"], 1)
+        self.assertEqual(commands["ss"]["timeouts"], 1)
+        self.assertEqual(stats.snapshot()["commands"], {})
+
+
+if __name__ == "__main__":
+    unittest.main()
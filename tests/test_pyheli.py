@@ -0,0 +1,78 @@
+import unittest
+
+import serial
+
+from pyheli import Heli
+from virtual_heli import VirtualArduino
+
+
+class FlakyVirtualArduino(VirtualArduino):
+    """
+    Virtual board whose next fail_writes writes time out without arriving.
+    """
+
+    fail_writes = 0
+
+    def write(self, data):
+        if self.fail_writes:
+            self.fail_writes -= 1
+            raise serial.SerialTimeoutException("Write timeout")
+        return super(FlakyVirtualArduino, self).write(data)
+
+
+class TestShadowAfterTimeout(unittest.TestCase):
+
+    def setUp(self):
+        self.board = FlakyVirtualArduino(seed=0)
+        self.heli = Heli(None, sr=self.board, binary=True)
+
+    def test_redundant_write_is_skipped(self):
+        self.heli._analog_write(5, 100)
+        sent = self.heli.commands_sent
+        self.heli._analog_write(5, 100)
+        self.assertEqual(self.heli.commands_sent, sent)
+
+    def test_failed_write_is_not_skipped_later(self):
+        self.board.fail_writes = 1
+        self.heli._digital_write(4, "HIGH")
+        self.assertFalse(self.board.pin_levels.get(4, False))
+        self.heli._digital_write(4, "HIGH")
+        self.assertTrue(self.board.pin_levels[4])
+
+    def test_failed_commit_is_not_skipped_later(self):
+        self.board.fail_writes = 1
+        with self.heli.batch():
+            self.heli._analog_write(5, 100)
+            self.heli._digital_write(6, "LOW")
+        self.assertNotIn(5, self.board.pin_pwm)
+        self.heli._analog_write(5, 100)
+        self.assertEqual(self.board.pin_pwm[5], 100)
+
+
+
+class TestPublicWrites(unittest.TestCase):
+
+    def setUp(self):
+        self.board = VirtualArduino(seed=0)
+        self.heli = Heli(None, sr=self.board, binary=True)
+
+    def test_public_write_updates_the_shadow(self):
+        self.heli._digital_write(4, "LOW")
+        self.heli.digital_write(4, "HIGH")
+        self.assertTrue(self.board.pin_levels[4])
+        self.heli._digital_write(4, "LOW")
+        self.assertFalse(self.board.pin_levels[4])
+
+    def test_public_write_is_always_sent(self):
+        self.heli._analog_write(5, 100)
+        sent = self.heli.commands_sent
+        self.heli.analog_write(5, 100)
+        self.assertEqual(self.heli.commands_sent, sent + 1)
+        self.heli._analog_write(5, 300)
+        self.heli.analog_write(5, 255)
+        self.heli._analog_write(5, 0)
+        self.assertEqual(self.board.pin_pwm[5], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+import time
+import unittest
+
+from pyno import BIN_IMU_REPLY, BIN_OPCODES, BIN_SYNC, Arduino, crc8
+from virtual_heli import VirtualArduino
+
+
+class TestBinaryResync(unittest.TestCase):
+
+    def setUp(self):
+        self.board = Arduino(sr=VirtualArduino(seed=0), binary=True)
+        self.assertTrue(self.board.binary)
+
+    def inject_stray_byte(self):
+        self.board.sr._tx.extend(b"\x00")
+
+    def test_sensor_reads_recover_after_stray_byte(self):
+        self.assertIsNotNone(self.board.read_sensor())
+        self.inject_stray_byte()
+        # The misaligned reply is lost, the link resynchronises after it
+        self.assertIsNone(self.board.read_sensor())
+        samples = [self.board.read_sensor() for i in range(10)]
+        self.assertNotIn(None, samples)
+        self.assertEqual(self.board.malformed_frames, 1)
+
+    def test_int_reads_recover_after_stray_byte(self):
+        self.board.sr.pin_levels[19] = 1
+        self.assertEqual(self.board.digital_read(19), 1)
+        self.inject_stray_byte()
+        self.assertEqual(self.board.digital_read(19), 0)
+        self.assertEqual([self.board.digital_read(19) for i in range(5)],
+                         [1] * 5)
+        self.assertIsNotNone(self.board.read_sensor())
+
+
+def imu_frame(roll, pitch, yaw):
+    frame = BIN_IMU_REPLY.pack(BIN_SYNC, BIN_OPCODES["ss"], roll, pitch, yaw)
+    return frame + chr(crc8(frame))
+
+
+class TestStream(unittest.TestCase):
+
+    def test_reader_keeps_the_newest_sample(self):
+        board = Arduino(sr=VirtualArduino(seed=0), binary=True)
+        board.start_stream(history=4)
+        self.assertIsNotNone(board.read_sensor())
+        while board.stream_samples < 6:
+            time.sleep(0.01)
+        self.assertEqual(len(board.sensor_history()), 4)
+        board.stop_stream()
+        self.assertFalse(board.sr.streaming)
+        self.assertEqual(board.sensor_history(), [])
+
+    def test_feed_split_frames(self):
+        board = Arduino(sr=VirtualArduino(seed=0), binary=True)
+        board.start_stream(history=2, reader=False)
+        data = b"\x00" + imu_frame(1, 2, 3) + imu_frame(4, 5, 6)
+        board.feed(data[:5])
+        self.assertEqual(board.stream_samples, 0)
+        board.feed(data[5:])
+        self.assertEqual(board.stream_samples, 2)
+        self.assertEqual(list(board.read_sensor()), [4.0, 5.0, 6.0])
+        self.assertEqual([list(x) for x in board.sensor_history()],
+                         [[1.0, 2.0, 3.0], [4.0, 5.0, 6.0]])
+
+    def test_feed_ascii_lines_and_replies(self):
+        board = Arduino(sr=VirtualArduino(seed=0))
+        self.assertFalse(board.binary)
+        board.start_stream(reader=False)
+        board.feed(b"!ANG:1.5,2,3\r\n1\r\n!ANG:1,")
+        board.feed(b"2\r\n!ANG:4,5,6\r\n")
+        self.assertEqual(board.stream_samples, 2)
+        self.assertEqual(board.malformed_frames, 1)
+        self.assertEqual(list(board.read_sensor()), [4.0, 5.0, 6.0])
+        self.assertEqual(board._replies.get_nowait(), "1\r\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+import unittest
+
+from pyno import BIN_OPCODES, BIN_SYNC
+from pyno_async import AsyncArduino
+from virtual_heli import VirtualArduino
+
+
+class TestAsyncStreaming(unittest.TestCase):
+
+    def setUp(self):
+        self.board = AsyncArduino(sr=VirtualArduino(seed=0), binary=True)
+
+    def tearDown(self):
+        self.board.close()
+
+    def test_stream_and_requests(self):
+        self.board.start_stream(history=16)
+        self.assertTrue(self.board.streaming)
+        self.assertIsNotNone(self.board.read_sensor())
+        self.assertIsNotNone(self.board.read_sensor_async().result())
+        # Replies to requests are told apart from the streamed frames
+        self.board.sr.pin_levels[4] = 1
+        self.assertEqual(self.board.digital_read(4), 1)
+        self.assertGreater(self.board.stream_samples, 0)
+        self.board.stop_stream()
+        self.assertFalse(self.board.streaming)
+        self.assertIsNotNone(self.board.read_sensor())
+        self.assertEqual(self.board.digital_read(4), 1)
+
+
+    def test_close_stops_the_stream(self):
+        board = AsyncArduino(sr=VirtualArduino(seed=1), binary=True)
+        board.start_stream()
+        self.assertIsNotNone(board.read_sensor())
+        board.close()
+        self.assertFalse(board.sr.streaming)
+        self.assertTrue(board._outgoing.empty())
+
+
+
+class TestAsyncRequests(unittest.TestCase):
+
+    def setUp(self):
+        self.board = AsyncArduino(sr=VirtualArduino(seed=0), binary=True,
+                                  stats=True)
+
+    def tearDown(self):
+        self.board.close()
+
+    def test_link_stats(self):
+        self.board.analog_write(5, 100)
+        with self.board.batch():
+            self.board.digital_write(6, "LOW")
+            self.board.analog_write(5, 50)
+        self.assertIsNotNone(self.board.read_sensor())
+        self.assertEqual(self.board.digital_read(4), 0)
+        commands = self.board.stats.snapshot()["commands"]
+        self.assertEqual(commands["aw"]["commands"], 2)
+        self.assertEqual(commands["dw"]["commands"], 1)
+        self.assertEqual(commands["batch"]["commands"], 1)
+        for cmd in ("sd", "dr"):
+            self.assertEqual(commands[cmd]["commands"], 1)
+            self.assertEqual(commands[cmd]["count"], 1)
+            self.assertEqual(commands[cmd]["timeouts"], 0)
+
+    def test_reply_of_another_command_is_skipped(self):
+        board = self.board.sr
+        reply = board._sensor_reply
+        # A stray int reply and a stray byte ahead of the sensor reply
+        board._sensor_reply = lambda: str(bytearray(
+            [BIN_SYNC, BIN_OPCODES["dr"], 1, 0, 0, BIN_SYNC])) + reply()
+        self.assertIsNotNone(self.board.read_sensor())
+        self.assertEqual(self.board.malformed_frames, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
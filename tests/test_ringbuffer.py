@@ -0,0 +1,38 @@
+import unittest
+
+from ringbuffer import RingBuffer
+
+
+class TestRingBuffer(unittest.TestCase):
+
+    def test_delays_after_wrapping(self):
+        x = RingBuffer(3)
+        for k in range(1, 6):
+            x.push(k)
+        self.assertEqual([x[0], x[1], x[2]], [5.0, 4.0, 3.0])
+        self.assertEqual(list(x), [5.0, 4.0, 3.0])
+        self.assertRaises(IndexError, lambda: x[3])
+
+    def test_chronological(self):
+        x = RingBuffer(4, fill=-1.0)
+        x.push(1)
+        x.push(2)
+        self.assertEqual(list(x.chronological()), [1.0, 2.0])
+        for k in range(3, 8):
+            x.push(k)
+        self.assertEqual(x.filled(), 4)
+        self.assertEqual(list(x.chronological()), [4.0, 5.0, 6.0, 7.0])
+
+    def test_setitem_and_clear(self):
+        x = RingBuffer(2)
+        x.push(1)
+        x[0] += 2
+        x[1] = 7
+        self.assertEqual(list(x), [3.0, 7.0])
+        x.clear(0.5)
+        self.assertEqual(list(x), [0.5, 0.5])
+        self.assertEqual(x.filled(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
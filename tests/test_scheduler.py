@@ -0,0 +1,88 @@
+import threading
+import time
+import unittest
+import warnings
+
+from scheduler import CATCH_UP, PeriodicScheduler
+
+
+class SteppingClock(object):
+    """
+    Wall clock that advances by the time slept and jumps by jumps[k] at
+    step k.
+    """
+
+    def __init__(self, jumps):
+        self.now = 1000.0
+        self.jumps = jumps
+        self.steps = 0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, delay):
+        self.sleeps.append(delay)
+        self.now += delay
+
+    def step(self):
+        self.now += self.jumps.get(self.steps, 0.0)
+        self.steps += 1
+
+
+def quiet_scheduler(*args, **kwargs):
+    # Without a monotonic clock every scheduler warns about the fallback
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        return PeriodicScheduler(*args, **kwargs)
+
+
+class TestPeriodicScheduler(unittest.TestCase):
+
+    def test_stop_event_ends_the_wait(self):
+        stop = threading.Event()
+        scheduler = quiet_scheduler(5.0, stop_event=stop)
+        threading.Timer(0.05, stop.set).start()
+        start = time.time()
+        scheduler.run(lambda: None)
+        self.assertLess(time.time() - start, 1.0)
+
+    def run_wall_clock(self, jumps, steps=10):
+        clock = SteppingClock(jumps)
+        stop = threading.Event()
+
+        def step():
+            clock.step()
+            if clock.steps == steps:
+                stop.set()
+
+        scheduler = quiet_scheduler(0.1, CATCH_UP, stop, clock=time.time,
+                                    sleep=clock.sleep)
+        self.assertTrue(scheduler.wall_clock)
+        scheduler.clock = clock.time
+        scheduler.run(step)
+        return scheduler, clock
+
+    def test_wall_clock_step_back_is_reanchored(self):
+        scheduler, clock = self.run_wall_clock({3: -3600.0})
+        self.assertEqual(scheduler.reanchored, 1)
+        self.assertLessEqual(max(clock.sleeps), 0.1 + 1e-9)
+
+    def test_wall_clock_step_forward_is_not_caught_up(self):
+        scheduler, clock = self.run_wall_clock({3: 3600.0})
+        self.assertEqual(scheduler.reanchored, 1)
+        # No burst of back to back steps after the jump: every step waits
+        self.assertEqual(len(clock.sleeps), 11)
+        self.assertGreater(min(clock.sleeps), 0.0)
+
+    def test_wall_clock_overrun_is_caught_up(self):
+        # A step 3.5 periods late is an overrun, not a clock jump
+        scheduler, clock = self.run_wall_clock({3: 0.35})
+        self.assertEqual(scheduler.reanchored, 0)
+        self.assertGreater(scheduler.overruns, 0)
+        # The missed steps ran back to back, without sleeping
+        self.assertEqual(len(clock.sleeps), 11 - 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,38 @@
+import math
+import unittest
+
+try:
+    from stripchart import MinMaxDecimator
+except ImportError:
+    # stripchart needs PyQt4
+    MinMaxDecimator = None
+
+
+@unittest.skipIf(MinMaxDecimator is None, "PyQt4 is not installed")
+class TestMinMaxDecimator(unittest.TestCase):
+
+    def test_envelope_of_the_last_buckets(self):
+        decimator = MinMaxDecimator(buckets=3, per_bucket=4)
+        for k in range(18):
+            decimator.push(k % 4 * (k // 4))
+        mins, maxs = decimator.envelope()
+        # Buckets 1 to 3 are kept, the bucket being filled comes last
+        self.assertEqual(mins, [0, 0, 0, 0])
+        self.assertEqual(maxs, [3, 6, 9, 4])
+
+    def test_spikes_and_nan(self):
+        decimator = MinMaxDecimator(buckets=2, per_bucket=3)
+        for x in (0.0, 50.0, 0.0, float('nan'), float('nan'), float('nan'),
+                  float('nan'), -1.0):
+            decimator.push(x)
+        mins, maxs = decimator.envelope()
+        self.assertEqual(mins[0], 0.0)
+        self.assertEqual(maxs[0], 50.0)
+        self.assertTrue(math.isnan(mins[1]) and math.isnan(maxs[1]))
+        self.assertEqual((mins[2], maxs[2]), (-1.0, -1.0))
+        decimator.clear()
+        self.assertEqual(decimator.envelope(), ([], []))
+
+
+if __name__ == "__main__":
+    unittest.main()
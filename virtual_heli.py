@@ -0,0 +1,462 @@
+#!/usr/bin/env python
+"""
+Virtual Arduino with a simulated helicopter model.
+
+VirtualArduino implements the part of the pyserial interface used by pyno
+(write, flush, readline, read, readinto, in_waiting, isOpen, close) and can
+be passed as the sr argument of Arduino or Heli:
+
+    heli = Heli(None, sr=VirtualArduino())
+
+It understands both the ASCII and the binary protocol, keeps track of pin
+modes, digital levels and PWM values, and answers sd requests from a 2-DOF
+pitch/yaw model driven by the motor pins. The model runs either against the
+wall clock (speed=1.0 for real time, speed=10.0 for ten times faster) or,
+with speed=None, advances by a fixed step on every sensor request so that
+a control loop runs as fast as the CPU allows.
+
+With baud_rates the board advertises link rate switching as described in
+pyno. While the rate of the port (baudrate, set by the host) differs from
+the rate of the board, everything sent in either direction is lost, and
+the board returns to its previous rate if the switch is not confirmed in
+time. Rates listed in bad_baud_rates are accepted but never work, e.g. to
+exercise the fallback of Arduino.negotiate_baud.
+"""
+
+import math
+import random
+import struct
+import threading
+import time
+
+from pyno import BIN_SYNC, BIN_OPCODES, BIN_CMD, BIN_INT_REPLY, \
+    BIN_IMU_REPLY, BIN_CAPABILITY, BAUD_CAPABILITY, BAUD_CONFIRM_TIME, crc8
+
+BIN_COMMANDS = dict((code, cmd) for cmd, code in BIN_OPCODES.items())
+
+
+class HeliPlant(object):
+    """
+    2-DOF model of the helicopter: pitch is driven by the main (12V) rotor
+    against gravity, yaw by the tail (5V) rotor and the reaction torque of
+    the main rotor. Rotor speeds follow their commands with a first order
+    lag and thrust is proportional to the square of the rotor speed.
+    Angles are in radians, motor commands from -1 to 1.
+    """
+
+    def __init__(self, pitch=0.0, yaw=0.0):
+        # Pitch axis
+        self.J_pitch = 0.02       # moment of inertia [kg m^2]
+        self.k_pitch = 0.25       # thrust torque at full speed [N m]
+        self.g_pitch = 0.06       # gravity torque of the unbalanced arm [N m]
+        self.b_pitch = 0.01       # viscous friction [N m s]
+        self.pitch_min = math.radians(-35.0)
+        self.pitch_max = math.radians(35.0)
+
+        # Yaw axis
+        self.J_yaw = 0.03
+        self.k_yaw = 0.05         # tail rotor torque at full speed [N m]
+        self.k_react = 0.01       # main rotor reaction torque [N m]
+        self.b_yaw = 0.02
+
+        # Rotors
+        self.tau_motor = 0.1      # rotor time constant [s]
+        self.dt = 0.001           # integration step [s]
+
+        self.pitch = pitch
+        self.yaw = yaw
+        self.reset()
+
+    def reset(self):
+        self.pitch_rate = 0.0
+        self.yaw_rate = 0.0
+        self.w_main = 0.0
+        self.w_tail = 0.0
+
+    def derivatives(self, u_main, u_tail):
+        """
+        Returns the rotor speed and angular accelerations for the current
+        state.
+        """
+        dw_main = (u_main - self.w_main) / self.tau_motor
+        dw_tail = (u_tail - self.w_tail) / self.tau_motor
+        thrust_main = self.w_main * abs(self.w_main)
+        thrust_tail = self.w_tail * abs(self.w_tail)
+        dd_pitch = (self.k_pitch * thrust_main
+                    - self.g_pitch * math.cos(self.pitch)
+                    - self.b_pitch * self.pitch_rate) / self.J_pitch
+        dd_yaw = (self.k_yaw * thrust_tail
+                  + self.k_react * thrust_main
+                  - self.b_yaw * self.yaw_rate) / self.J_yaw
+        return dw_main, dw_tail, dd_pitch, dd_yaw
+
+    def step(self, u_main, u_tail, duration):
+        """
+        Integrates the model over duration seconds with constant inputs
+        (semi-implicit Euler with the fixed step dt).
+        """
+        while duration > 1e-12:
+            h = min(self.dt, duration)
+            duration -= h
+            dw_main, dw_tail, dd_pitch, dd_yaw = self.derivatives(u_main,
+                                                                  u_tail)
+            self.w_main += h * dw_main
+            self.w_tail += h * dw_tail
+            self.pitch_rate += h * dd_pitch
+            self.yaw_rate += h * dd_yaw
+            self.pitch += h * self.pitch_rate
+            self.yaw += h * self.yaw_rate
+
+            # Mechanical end stops of the pitch axis
+            if self.pitch < self.pitch_min:
+                self.pitch = self.pitch_min
+                self.pitch_rate = max(self.pitch_rate, 0.0)
+            elif self.pitch > self.pitch_max:
+                self.pitch = self.pitch_max
+                self.pitch_rate = min(self.pitch_rate, 0.0)
+
+        if self.yaw > math.pi:
+            self.yaw -= 2 * math.pi
+        elif self.yaw < -math.pi:
+            self.yaw += 2 * math.pi
+
+
+class VirtualArduino(object):
+
+    def __init__(self, speed=None, step=0.05, noise=0.1, binary=True,
+                 stream_period=0.01, plant=None, seed=None, timeout=2,
+                 baud_rates=None, bad_baud_rates=()):
+        """
+        Initializes the virtual board
+        -------------
+        :param speed: simulated seconds per wall clock second, None to
+                      advance the model by step on every sensor request
+        :param step: model time between sensor requests when speed is None
+        :param noise: standard deviation of the angle noise in degrees
+        :param binary: advertise the binary protocol in the version string
+        :param stream_period: time between pushed frames in streaming mode
+        :param plant: HeliPlant instance, a new one if not given
+        :param seed: seed for the sensor noise
+        :param timeout: read timeout reported to pyno
+        :param baud_rates: rates advertised for switching, None for a board
+                           that cannot switch
+        :param bad_baud_rates: advertised rates at which the link fails
+        """
+        self.speed = speed
+        self.step = step
+        self.noise = noise
+        self.supports_binary = binary
+        self.stream_period = stream_period
+        self.plant = plant or HeliPlant()
+        self.timeout = timeout
+        self.baudrate = 9600
+        self.baud_rates = baud_rates
+        self.bad_baud_rates = bad_baud_rates
+        self.device_baudrate = 9600
+        # rate switched to when the acknowledgement has been read, and
+        # (previous rate, deadline) of a switch not confirmed yet
+        self._baud_pending = None
+        self._baud_fallback = None
+        self.random = random.Random(seed)
+
+        # 12V motor: sleep, in1, in2; 5V motor: sleep, in1, in2; fault pin
+        self.main_pins = (18, 9, 10)
+        self.tail_pins = (4, 5, 6)
+        self.fault_pin = 19
+
+        self.pin_modes = {}
+        self.pin_levels = {}
+        self.pin_pwm = {}
+
+        self.binary = False
+        self.streaming = False
+        self.sim_time = 0.0
+        self._next_frame = 0.0
+        self._start = time.time()
+        self._rx = bytearray()
+        self._tx = bytearray()
+        self._open = True
+        self._lock = threading.Lock()
+
+        self.bytes_received = 0
+        self.commands = 0
+
+    # pyserial interface
+
+    def write(self, data):
+        with self._lock:
+            if not self._link_ok():
+                return len(data)
+            self._rx.extend(data)
+            self.bytes_received += len(data)
+            self._process()
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def readline(self):
+        with self._lock:
+            if not self._link_ok():
+                return ""
+            self._fill_stream()
+            i = self._tx.find(b"\n")
+            if i < 0:
+                line = self._tx[:]
+                del self._tx[:]
+            else:
+                line = self._tx[:i + 1]
+                del self._tx[:i + 1]
+            self._apply_baud()
+        return str(line)
+
+    def read(self, size=1):
+        with self._lock:
+            if not self._link_ok():
+                return ""
+            self._fill_stream()
+            data = self._tx[:size]
+            del self._tx[:size]
+            self._apply_baud()
+        return str(data)
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    @property
+    def in_waiting(self):
+        with self._lock:
+            self._fill_stream()
+            return len(self._tx)
+
+    def inWaiting(self):
+        return self.in_waiting
+
+    def reset_input_buffer(self):
+        with self._lock:
+            del self._tx[:]
+
+    def isOpen(self):
+        return self._open
+
+    def close(self):
+        self._open = False
+
+    def _link_ok(self):
+        """
+        True if bytes get through at the current rates. A switch that was
+        not confirmed in time is undone first.
+        """
+        if self._baud_fallback is not None and \
+                time.time() > self._baud_fallback[1]:
+            self.device_baudrate = self._baud_fallback[0]
+            self._baud_fallback = None
+        if self.baudrate != self.device_baudrate or \
+                self.device_baudrate in self.bad_baud_rates:
+            del self._tx[:]
+            return False
+        return True
+
+    def _apply_baud(self):
+        if self._baud_pending is not None and not self._tx:
+            self._baud_fallback = (self.device_baudrate,
+                                   time.time() + BAUD_CONFIRM_TIME)
+            self.device_baudrate = self._baud_pending
+            self._baud_pending = None
+
+    # Simulation
+
+    def motor_command(self, pins):
+        """
+        Returns the command of a motor (-1 to 1) from the state of its
+        sleep and direction pins.
+        """
+        sleep, in1, in2 = pins
+        if not self.pin_levels.get(sleep, False):
+            return 0.0
+        return (self._pin_duty(in1) - self._pin_duty(in2))
+
+    def _pin_duty(self, pin):
+        if pin in self.pin_pwm:
+            return self.pin_pwm[pin] / 255.0
+        return 1.0 if self.pin_levels.get(pin, False) else 0.0
+
+    def advance(self, duration):
+        """
+        Integrates the model for duration simulated seconds.
+        """
+        self.plant.step(self.motor_command(self.main_pins),
+                        self.motor_command(self.tail_pins), duration)
+        self.sim_time += duration
+
+    def _sync_clock(self):
+        """
+        Brings the model up to the current time of the simulation clock.
+        """
+        if self.speed is None:
+            self.advance(self.step)
+        else:
+            now = (time.time() - self._start) * self.speed
+            if now > self.sim_time:
+                self.advance(now - self.sim_time)
+
+    def angles(self):
+        """
+        Returns the measured roll, pitch and yaw in degrees.
+        """
+        noise = self.noise
+        gauss = self.random.gauss
+        roll = gauss(0.0, noise) if noise else 0.0
+        pitch = math.degrees(self.plant.pitch)
+        yaw = math.degrees(self.plant.yaw)
+        if noise:
+            pitch += gauss(0.0, noise)
+            yaw += gauss(0.0, noise)
+        return roll, pitch, yaw
+
+    def _sensor_reply(self):
+        roll, pitch, yaw = self.angles()
+        if self.binary:
+            frame = BIN_IMU_REPLY.pack(BIN_SYNC, BIN_OPCODES["sd"],
+                                       roll, pitch, yaw)
+            return frame + struct.pack("<B", crc8(frame))
+        return "!ANG:%.2f,%.2f,%.2f\r\n" % (roll, pitch, yaw)
+
+    def _int_reply(self, cmd, value):
+        if self.binary:
+            frame = BIN_INT_REPLY.pack(BIN_SYNC, BIN_OPCODES[cmd], value)
+            return frame + struct.pack("<B", crc8(frame))
+        return "%d\r\n" % value
+
+    def _fill_stream(self):
+        """
+        Queues the frames pushed in streaming mode since the last read.
+        """
+        if not self.streaming or self._tx:
+            return
+        if self.speed is None:
+            self.advance(self.stream_period)
+            self._tx.extend(self._sensor_reply())
+            return
+        now = (time.time() - self._start) * self.speed
+        while self._next_frame <= now:
+            if self._next_frame > self.sim_time:
+                self.advance(self._next_frame - self.sim_time)
+            self._tx.extend(self._sensor_reply())
+            self._next_frame += self.stream_period
+
+    # Protocol
+
+    def _process(self):
+        """
+        Executes every complete command in the receive buffer.
+        """
+        rx = self._rx
+        while rx:
+            if rx[0] == ord("@"):
+                end = rx.find(b"$!")
+                if end < 0:
+                    return
+                fields = str(rx[1:end]).split("%")
+                del rx[:end + 2]
+                args = [int(a) for a in fields[1:] if a]
+                self._execute(fields[0], args)
+            elif rx[0] == BIN_SYNC:
+                size = BIN_CMD.size + 1
+                if len(rx) < size:
+                    return
+                frame = bytes(rx[:size])
+                del rx[:size]
+                if crc8(frame[:-1]) != bytearray(frame[-1:])[0]:
+                    continue
+                sync, opcode, pin, val = BIN_CMD.unpack(frame[:-1])
+                cmd = BIN_COMMANDS.get(opcode)
+                if cmd is not None:
+                    self._execute(cmd, [pin, val])
+            else:
+                del rx[:1]
+
+    def _execute(self, cmd, args):
+        self.commands += 1
+        # Any command at the new rate confirms a switch
+        self._baud_fallback = None
+        pin = args[0] if args else 0
+        if cmd == "version":
+            version = "VIRT-1.0"
+            if self.supports_binary:
+                version += " " + BIN_CAPABILITY
+            for rate in self.baud_rates or ():
+                version += " %s%d" % (BAUD_CAPABILITY, rate)
+            self._tx.extend(version + "\r\n")
+        elif cmd == "baud":
+            if pin in (self.baud_rates or ()):
+                # Switches once the acknowledgement has been sent
+                self._tx.extend("%s%d\r\n" % (BAUD_CAPABILITY, pin))
+                self._baud_pending = pin
+        elif cmd == "bin":
+            self.binary = self.supports_binary and pin == 1
+        elif cmd == "pm":
+            self._sync_clock_if_realtime()
+            self.pin_modes[abs(pin)] = "OUTPUT" if pin > 0 else "INPUT"
+        elif cmd == "dw":
+            self._sync_clock_if_realtime()
+            self.pin_levels[abs(pin)] = pin > 0
+            self.pin_pwm.pop(abs(pin), None)
+        elif cmd == "aw":
+            self._sync_clock_if_realtime()
+            self.pin_pwm[pin] = min(max(args[1], 0), 255)
+        elif cmd == "dr":
+            if pin == self.fault_pin:
+                value = 1
+            else:
+                value = int(self.pin_levels.get(pin, False))
+            self._tx.extend(self._int_reply(cmd, value))
+        elif cmd == "ar":
+            self._tx.extend(self._int_reply(cmd, 0))
+        elif cmd == "sd":
+            self._sync_clock()
+            self._tx.extend(self._sensor_reply())
+        elif cmd == "ss":
+            self.streaming = pin == 1
+            if self.speed is not None:
+                self._next_frame = (time.time() - self._start) * self.speed
+
+    def _sync_clock_if_realtime(self):
+        # Actuator changes take effect at the current time, so the model is
+        # first brought up to date with the previous inputs.
+        if self.speed is not None:
+            self._sync_clock()
+
+
+if __name__ == '__main__':
+
+    import argparse
+    import controller_PI
+    from pyheli import Heli
+
+    parser = argparse.ArgumentParser(
+        description='Run the PI controller against the virtual helicopter')
+    parser.add_argument('--config_file', help='Platform configuration file name',
+                        default='platform.cfg')
+    parser.add_argument('--steps', type=int, default=200,
+                        help='Number of controller steps')
+    args = parser.parse_args()
+
+    heli = Heli(None, sr=VirtualArduino(), binary=True)
+    heli.sensor_delay = 0.0
+    ctrl = controller_PI.Controller(threading.Event(), args.config_file,
+                                    log=False, heli=heli)
+    heli.sr.step = ctrl.Td
+    heli.set_12v_motor_sleep_state(True)
+    heli.set_5v_motor_sleep_state(True)
+    ctrl.set_ref([10.0], [0.0])
+
+    start = time.time()
+    for k in range(args.steps):
+        ctrl.update()
+    elapsed = time.time() - start
+    print('%d steps, %.1f s simulated in %.3f s' %
+          (args.steps, args.steps * ctrl.Td, elapsed))
+    print('pitch %.2f, yaw %.2f' % (ctrl.theta[0], ctrl.phi[0]))